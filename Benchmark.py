@@ -0,0 +1,57 @@
+# Imports sys, which lets the script report a failure to whatever ran it (e.g. a command line or a CI job)
+import sys
+# imports os, or operating system which will help perform system specific operations
+import os
+# imports the benchmark helpers, which time each stage of clustering an image (see color_cluster_kit/benchmark.py)
+from color_cluster_kit.benchmark import compare_results, load_results, results_table, run_benchmarks, save_results
+# imports the default pixel budget of the Data Collectors
+from color_cluster_kit import MAX_PIXELS
+
+# This script checks whether a change to image_summary() (or to the libraries it uses) made it faster or slower
+# It makes synthetic flower images at a few sizes, clusters them with a few values of k and times every stage:
+# decode, resize, BGR-to-HSV, scaling, K-Means fit, per-cluster stats, mask rendering and HTML write
+# The images come from a fixed seed, so every run times exactly the same work
+# The times are saved to a JSON file. The first run also saves them as the baseline, and every later run is
+# compared against it: if any stage got slower by more than threshold, the slow stages are printed and the script
+# exits with an error. To accept new times as the baseline (e.g. after upgrading a library), delete the baseline file
+
+# The image sizes, as (height, width) pairs, and the values of k to time. Images with more than max_pixels pixels
+# are shrunk first, just like in the Data Collectors
+sizes = [(240, 320), (600, 800), (1800, 2400)]
+ks = [5, 15]
+max_pixels = MAX_PIXELS
+
+# How many times each case is run. The median time of each stage is kept
+repeats = 3
+seed = 0
+
+# Where this run's times are saved, and the baseline they're compared against
+output = "benchmark.json"
+baseline = "benchmark_baseline.json"
+
+# How much slower a stage can get before it counts as a regression. 0.25 is 25% slower
+# Stages that slow down by less than min_seconds are ignored, since tiny stages vary a lot from run to run
+threshold = 0.25
+min_seconds = 0.005
+
+if __name__ == "__main__":
+
+    results = run_benchmarks(sizes, ks, seed = seed, repeats = repeats, max_pixels = max_pixels)
+    save_results(results, output)
+    print(results_table(results).round(4).to_string())
+
+    # With no baseline yet, this run becomes the baseline
+    if not os.path.exists(baseline):
+        save_results(results, baseline)
+        print("Saved a new baseline to " + baseline)
+        sys.exit(0)
+
+    regressions = compare_results(results, load_results(baseline), threshold = threshold, min_seconds = min_seconds)
+
+    if regressions:
+        print("These stages are slower than the baseline:")
+        for regression in regressions:
+            print("  {case}, {stage}: {baseline:.4f}s -> {current:.4f}s ({ratio:.2f}x)".format(**regression))
+        sys.exit(1)
+
+    print("No stage is more than " + str(round(threshold * 100)) + "% slower than the baseline")
@@ -0,0 +1,60 @@
+# imports the calibration helpers, which work out cut points from a results file in one pass (see
+# color_cluster_kit/calibration.py)
+from color_cluster_kit import DEFAULT_CAPACITY, calibrate, save_thresholds
+
+# This script works out the thresholds the Classifiers use from the Data Collectors' results, and saves them to a
+# thresholds file that the Classifiers read instead of their fixed example values
+# The results file is read a chunk of rows at a time and never loaded whole, so it works the same on a file with a
+# hundred rows or with tens of millions. The cut points are approximate, but the error is known: it's printed for
+# every threshold as a share of the rows (e.g. 0.01% means the cut point is within 0.01% of the rows of the exact one)
+# Only the rows with flowers in them (status "ok") are used
+# Run it again whenever there are new results, and the Classifiers pick up the new thresholds
+
+# Where the thresholds are saved. The Classifiers read this file (see thresholds in each Classifier)
+thresholds = "thresholds.json"
+
+# What to calibrate. Each entry is saved under its name, which is the name the Classifier looks up
+#   results     the Data Collector's results file (csv, .parquet or .feather). Add an "r" in front of the path
+#   column      the column to cut, e.g. "s_mean" for the saturation or "num_points" for the number of pixels
+#   quantiles   where to cut, as shares of the rows: [1 / 3, 2 / 3] are the terciles, which split the rows into three
+#               groups of the same size, and [0.5] is the median, which splits them in two
+#   measure     "v_mean" or "num_points", the collector's measure. It's only needed for older results files
+#   profile     for a results file from Data Collector (Profiles), the name of the species' profile. Leave it out
+#               for the other collectors
+# Geranium is split into light, medium and dark at the terciles of the saturation. Sandblossom is split into white
+# and blue at a number of pixels: set its quantile to the share of the observations expected to be white
+calibrations = {
+    "Geranium": {
+        "results": r"C:\Users\Example\FlowerClassification\YourSaveFile.csv",
+        "column": "s_mean",
+        "quantiles": [1 / 3, 2 / 3],
+        "measure": "v_mean",
+    },
+    "Sandblossom": {
+        "results": r"C:\Users\Example\FlowerClassification\YourSaveFile.csv",
+        "column": "num_points",
+        "quantiles": [0.5],
+        "measure": "num_points",
+    },
+}
+
+# How many rows are read at a time. Lower it if the machine runs out of memory
+chunk_size = 100000
+
+# How many values the sketch keeps per level. A larger capacity makes the cut points more exact and uses more memory
+capacity = DEFAULT_CAPACITY
+
+if __name__ == "__main__":
+
+    for name, calibration in calibrations.items():
+
+        result = calibrate(calibration["results"], calibration["column"], calibration["quantiles"],
+                           measure = calibration.get("measure", "v_mean"), profile = calibration.get("profile"),
+                           chunk_size = chunk_size, capacity = capacity)
+        save_thresholds(thresholds, name, result)
+
+        cut_points = ", ".join(str(round(x, 4)) for x in result["thresholds"])
+        print(name + ": " + result["column"] + " is cut at " + cut_points + " (from " + str(result["rows"]) +
+              " rows, within " + str(round(result["rank_error"] * 100, 3)) + "% of the rows)")
+
+    print("Saved the thresholds to " + thresholds)
@@ -1,26 +1,14 @@
-# imports pandas and numpy, two important libraries for data manipulation
+# imports numpy, an important library for data manipulation
 import numpy as np
-import pandas as pd
+# imports the result reader, which reads the Data Collector's output with every value in its own column
+from color_cluster_kit import iter_results, read_results
+# imports the threshold loader, which reads the thresholds the Calibrator worked out
+from color_cluster_kit import load_thresholds
 
-# Create a function to parse the Kmeans Data
-# As the data is output in the csv file, its a string, formatted as "[number, number, number]"
-# This function takes the string as the data argument and uses the place to return the corresponding number
-# For example, if the data = "[1, 2, 3]" and the place = 0, the function will return 1
-def parse_data (data, place):
-    
-    # If the data column didn't pick up flowers, just return 0 for the values
-    if data == "no flowers":
-        return 0
-
-    # Use splicing to get rid of square brackets and split by a comma and space
-    data = data[1:-1].split(", ")
-
-    # return an item from the list, based on the specified index
-    return float(data[place])
-    
 # Define a function to make an assignment 
 # This function assumes a simple single variable classification
-# data is the number to compare
+# data is the number to compare. It can be a single number or a whole column of a dataframe, in which case every
+# row is classified at once (much quicker than going row by row)
 # the lower_bin is the lower value of the color bin
 # the upper_bin is the upper value of the color bin
 # If the data is lower than the lower_bin, it classifies as light
@@ -29,21 +17,49 @@ def parse_data (data, place):
 # For example if data = 5, lower_bin = 4, upper_bin = 6, the functions will return "medium"
 def classify (data, lower_bin, upper_bin):
     
-     # If the data column didn't pick up flowers, just return 0 for the values
-    if data == 0:
-        return 0
-    
+    data = np.asarray(data)
+
+    # Start by assuming everything is between the upper and lower bounds, so it's medium
+    result = np.full(data.shape, "medium", dtype = object)
+
     # If the data is lower than the lower bin, it's light
-    if data < lower_bin:
-        return "light"
+    result[data < lower_bin] = "light"
     # If the data is higher than the upper bin, it's dark
-    elif data > upper_bin: 
-        return "dark"
-    # If it's neither of those cases, the color must be between the upper and lower bounds, so it's medium
-    else:
-        return "medium"
-        
-# Read data from a CSV file and stores it into a dataframe
+    result[data > upper_bin] = "dark"
+    # If the data column didn't pick up flowers, just return 0 for the values
+    result[data == 0] = 0
+
+    # A single number gives back a single classification
+    return result if result.ndim else result.item()
+
+# The lower and upper bins are read from the thresholds file written by the Calibrator (the terciles of the
+# saturation). Until the Calibrator has been run, the example values below are used: the upper and lower bounds of
+# the saturation for Geranium
+lower_bin, upper_bin = load_thresholds("thresholds.json", "Geranium", default = [70.5828523, 92.75856618])
+
+# Adds the Saturation and Classification columns to a dataframe of results and returns it
+# The whole file or just a chunk of its rows, it's classified the same way
+def add_classification(df):
+
+    # This creates a new column in the dataframe with the saturation value from the K-Means Clustering data
+    # If the data column didn't pick up flowers (or the image couldn't be read), the saturation is 0
+    df["Saturation"] = df["s_mean"].where(df["status"] == "ok", 0)
+
+    # This creates a new column in the dataframe that classifies each observation as "light", "medium", and "dark"
+    # based on the rules described in the function. The whole column is classified in one go
+    # Images that couldn't be read are marked as "error"
+    df["Classification"] = classify(df["Saturation"], lower_bin, upper_bin)
+    df.loc[df["status"] == "error", "Classification"] = "error"
+
+    return df
+
+# Set chunk_size to a number of rows (e.g. 100000) to classify the results file a chunk of rows at a time instead
+# of reading it all at once. Each chunk is read, classified and added to the end of the output file before the next
+# one is read, so the memory used stays the same however big the file is. The output file is exactly the same
+# either way. None reads the whole file at once
+chunk_size = None
+
+# The Data Collector's results file, which is read into a dataframe
 # Like the destination, an "r" should be added in front path
 # This may be either an absolute path (recommended for beginners) or a relative path, depending on how the file is saved
 # Note: most of the time, no further arguments are required. Sometimes, though, there will be encoding issues
@@ -52,17 +68,22 @@ def classify (data, lower_bin, upper_bin):
 # encoding = 'latin1', 
 # encoding = 'iso-8859-1',
 # encoding = 'cp1252'
-df = pd.read_csv(r"C:\Users\Example\FlowerClassification\YourSaveFile.csv")
-
-# This creates a new column in the dataframe that extracts the saturation value from the K-Means Clustering data
-df["Saturation"] = df["KMeansData"].apply(lambda x: parse_data(x, 1))
-
-# This creates a new column in the dataframe that classifies each observation as "light", "medium", and "dark"
-# based on the rules described in the function
-# Note that the example values are the upper and lower bounds of the saturation for Geranium
-df["Classification"] = df["Saturation"].apply(lambda x: classify(x, 70.5828523, 92.75856618))
+# read_results() reads csv, Parquet (.parquet) and Arrow (.feather) files from the Data Collector
+# For a file from Data Collector (Profiles), add profile = "Geranium" to read_results() and iter_results() below to
+# read just this species' columns (and the same goes for encoding)
+# Older csv files, where the K-Means Clustering data is a single "KMeansData" column of text like "[1, 2, 3]",
+# are split into the same h_mean, s_mean, v_mean and status columns on the way in
+results = r"C:\Users\Example\FlowerClassification\YourSaveFile.csv"
 
 # Finally, the code is saved to a csv file locally
 # Use just a file name to save it in the same directoty
 # Use an absolute path to save it to some other location in the system
-df.to_csv("FlowerClassifications(Geranium).csv")
\ No newline at end of file
+output = "FlowerClassifications(Geranium).csv"
+
+if chunk_size is None:
+    df = add_classification(read_results(results, measure = "v_mean"))
+    df.to_csv(output)
+else:
+    # The first chunk starts the output file with the column names, and every other chunk is added to its end
+    for i, chunk in enumerate(iter_results(results, measure = "v_mean", chunk_size = chunk_size)):
+        add_classification(chunk).to_csv(output, mode = "w" if i == 0 else "a", header = i == 0)
\ No newline at end of file
@@ -1,39 +1,53 @@
-# imports pandas and numpy, two important libraries for data manipulation
+# imports numpy, an important library for data manipulation
 import numpy as np
-import pandas as pd
+# imports the result reader, which reads the Data Collector's output with every value in its own column
+from color_cluster_kit import iter_results, read_results
+# imports the threshold loader, which reads the threshold the Calibrator worked out
+from color_cluster_kit import load_thresholds
 
-# Create a function to parse the Kmeans Data
-# As the data is output in the csv file, its a string, formatted as "[number, number, number]"
-# This function takes the string as the data argument and uses the place to return the corresponding number
-# For example, if the data = "[1, 2, 3]" and the place = 0, the function will return 1
-def parse_data (data, place):
-    
-    # If the data column didn't pick up flowers, just return 0 for the values
-    if data == "no flowers":
-        return 0
-
-    # Use splicing to get rid of square brackets and split by a comma and space
-    data = data[1:-1].split(", ")
-
-    # return an item from the list, based on the specified index
-    return float(data[place])
-    
 # Define a function to make an assignment 
 # This function assumes a simple single variable classification
-# pixels are the number of pixels detected in the data
+# pixels are the number of pixels detected in the data. It can be a single number or a whole column of a
+# dataframe, in which case every row is classified at once (much quicker than going row by row)
 # threshold is the number of pixels detected in order to be classified in a certain group
 # Note that because this dataset assumes there is an flower in each image, there's no consideration
 # for images with no flowers
 def classify(pixels, threshold):
     
     # If less than the threshold number of blue pixels are detected (or none are), then the image is assumed white
-    if pixels <= threshold:
-        return "White"
     # If more than the threshold number of bluw pixels are detected, then the image is classified as blue
-    else:
-        return "Blue"
-        
-# Read data from a CSV file and stores it into a dataframe
+    result = np.where(np.asarray(pixels) <= threshold, "White", "Blue").astype(object)
+
+    # A single number gives back a single classification
+    return result if result.ndim else result.item()
+
+# The threshold is read from the thresholds file written by the Calibrator. Until the Calibrator has been run, the
+# example threshold of 3000 pixels is used
+threshold = load_thresholds("thresholds.json", "Sandblossom", default = [3000])[0]
+
+# Adds the pixels and Classification columns to a dataframe of results and returns it
+# The whole file or just a chunk of its rows, it's classified the same way
+def add_classification(df):
+
+    # This creates a new column in the dataframe with the number of pixels from the K-Means Clustering data
+    # If the data column didn't pick up flowers (or the image couldn't be read), the number of pixels is 0
+    df["pixels"] = df["num_points"].where(df["status"] == "ok", 0)
+
+    # This creates a new column in the dataframe that classifies each observation as "White" or "Blue"
+    # based on the rules described in the function. The whole column is classified in one go
+    # Images that couldn't be read are marked as "error"
+    df["Classification"] = classify(df["pixels"], threshold)
+    df.loc[df["status"] == "error", "Classification"] = "error"
+
+    return df
+
+# Set chunk_size to a number of rows (e.g. 100000) to classify the results file a chunk of rows at a time instead
+# of reading it all at once. Each chunk is read, classified and added to the end of the output file before the next
+# one is read, so the memory used stays the same however big the file is. The output file is exactly the same
+# either way. None reads the whole file at once
+chunk_size = None
+
+# The Data Collector's results file, which is read into a dataframe
 # Like the destination, an "r" should be added in front path
 # This may be either an absolute path (recommended for beginners) or a relative path, depending on how the file is saved
 # Note: most of the time, no further arguments are required. Sometimes, though, there will be encoding issues
@@ -42,17 +56,22 @@ def classify(pixels, threshold):
 # encoding = 'latin1', 
 # encoding = 'iso-8859-1',
 # encoding = 'cp1252'
-df = pd.read_csv(r"C:\Users\Example\FlowerClassification\YourSaveFile.csv")
-
-# This creates a new column in the dataframe that extracts the number of pixels from the K-Means Clustering data
-df["pixels"] = df["KMeansData"].apply(lambda x: parse_data(x, 2))
-
-# This creates a new column in the dataframe that classifies each observation as "White" or "Blue"
-# based on the rules described in the function
-# Note that the example threshold is 3000 pixels
-df["Classification"] = df["pixels"].apply(lambda x: classify(x, 3000))
+# read_results() reads csv, Parquet (.parquet) and Arrow (.feather) files from the Data Collector
+# For a file from Data Collector (Profiles), add profile = "Sandblossom" to read_results() and iter_results() below to
+# read just this species' columns (and the same goes for encoding)
+# Older csv files, where the K-Means Clustering data is a single "KMeansData" column of text like "[1, 2, 3]",
+# are split into the same h_mean, s_mean, num_points and status columns on the way in
+results = r"C:\Users\Example\FlowerClassification\YourSaveFile.csv"
 
 # Finally, the code is saved to a csv file locally
 # Use just a file name to save it in the same directoty
 # Use an absolute path to save it to some other location in the system
-df.to_csv("FlowerClassifications(Sandblossom).csv")
\ No newline at end of file
+output = "FlowerClassifications(Sandblossom).csv"
+
+if chunk_size is None:
+    df = add_classification(read_results(results, measure = "num_points"))
+    df.to_csv(output)
+else:
+    # The first chunk starts the output file with the column names, and every other chunk is added to its end
+    for i, chunk in enumerate(iter_results(results, measure = "num_points", chunk_size = chunk_size)):
+        add_classification(chunk).to_csv(output, mode = "w" if i == 0 else "a", header = i == 0)
\ No newline at end of file
@@ -1,6 +1,4 @@
-# All the imports from the sklearn module are statistical tools to help perform K-Means Clustering
-from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import normalize
+# The import from the sklearn module is the statistical tool that performs K-Means Clustering
 from sklearn.cluster import KMeans
 # Imports the webbrowser module which will open a new tab
 import webbrowser
@@ -11,102 +9,114 @@ import numpy as np
 import cv2
 # imports os, or operating system which will help perform system specific operations
 import os
+# imports partial, which fixes some of a function's arguments ahead of time (used for the gallery below)
+from functools import partial
+# imports the per-cluster statistics shared by the Data Collectors and the Visualizer, and the gallery helpers
+from color_cluster_kit import cluster_color_histogram, cluster_stats, read_results, run_batch, scale_features
+# imports the automatic choice of k (see auto_k below)
+from color_cluster_kit import MIN_EXPLAINED, choose_k
+# imports the image loader, which shrinks large images to a pixel budget the same way the Data Collectors do and
+# converts them to HSV, or reads them from a Data Collector's image store (see store below)
+from color_cluster_kit import MAX_PIXELS, load_hsv
+from color_cluster_kit import image_folders, thumbnail, write_gallery
+# imports the downloader, for results files that only have the images' urls (see get_summary_gallery below)
+from color_cluster_kit import fetch
 
 # A function that receives an image path and number of clusters k and returns a dictionary of clusters and values
-def image_summary(image_source, k):
+# quantize is optional and clusters the image's color histogram instead of every pixel (see the Data Collectors)
+# The cluster images are saved in output_dir (the current directory by default). If thumbnail_width is set, they
+# are shrunk to at most that many pixels wide before they're saved
+# max_pixels is the pixel budget: larger images are shrunk to about that many pixels as they're loaded, exactly like
+# in the Data Collectors, so the clusters shown here match theirs. None keeps the full size
+# auto_k is optional and is a list of candidate values of k. The smallest one whose clusters explain at least
+# min_explained of the image's color variance is used instead of k, the same way as in the Data Collectors
+# store is optional and is the folder of a Data Collector's image store. If the image is in it, its HSV pixels are
+# read from there instead of decoding the image (see color_cluster_kit/store.py)
+# image_hsv is optional and is the image already loaded with load_hsv() (the gallery loads it anyway for the
+# thumbnail), so it isn't decoded a second time
+def image_summary(image_source, k, quantize = None, output_dir = "", thumbnail_width = None, max_pixels = MAX_PIXELS,
+                  auto_k = None, min_explained = MIN_EXPLAINED, store = None, image_hsv = None):
     
-    # Load image
-    image = cv2.imread(image_source)
-        
-    # Convert image to the HSV color space
-    image_hsv = cv2.cvtColor(image,cv2.COLOR_BGR2HSV)
-
-    # By default, images are stored as 3D objects with a width and height defined by the image resolution
-    # In addition, each pixel stores three pieces of information pertaining to color, in this case, H, S, and V
-    # Mathematrical operations on this 3D object is cumbersome and inefficient, so the flatten() method
-    # turns it into a 2D array for quicker operations.
-    # The first three values in the 2D array correspond with the 3 color values in the top-left pixel
-    # The next three values correspond with the 3 color values in next pixel to the right, etc.
-    # For example, the data structure of an image typically look like this:
-    # [[[1,2,3], [4,5,6]],
-    # [[7,8,9], [10,11,12]]
-    # The flatten argument transforms it to this:
-    # [1,2,3,4,5,6,7,8,9,10,11,12]
-    image_flat = image_hsv.flatten()
-
-    # Because of how the image is flatten, we know that the H, S, and V values reoccur at every third pixel
-    # at a slight different index i.e. All H values are at the 0th place, 3rd place, 6th place, 9th place and so on
-    # We take advantage of this to collect all the H, S, and V values into single variables
-    
-    # The h-channel. Takes every 3rd value from flatten image starting at 0th place
-    h = image_flat[0::3]
-    # The s-channel. Takes every 3rd value from flatten image starting at 1st place
-    s = image_flat[1::3]
-    # The v-channel. Takes every 3rd value from flatten image starting at 2nd place
-    v = image_flat[2::3]
-
-    # Create a dataframe from the pixel values
-    df = pd.DataFrame(data = h, columns = ["h"])
-    df['s'] = s
-    df['v'] = v
-
-    # H, S, and V values are at different scales. H values vary from 0-179 and S and V vary from 0-255
-    # Consequently, any clustering based on a geometric distance will be skewed
-    # To remedy this, the StandScaler() function brings everything onto a standard scale
-    
-    # initialize scaler
-    scaler = StandardScaler()
-
-    # Scaled features
-    scaler.fit(df)
-    df_scaled = scaler.transform(df)
-
-    # These two lines actually perform the K-Means clustering. Note that k is the same k passed in the initial argument
-    kmeans = KMeans(n_clusters = k)
-    kmeans.fit(df_scaled)
-
-    # Create a new column in the dataframe for the labels
-    # The labels themselves are simple numeric values that denote which pixels go into which cluster
-    # (ie, all pixels labeled as 1 are in the same cluster)
-    df["cluster"] = kmeans.labels_
+    # Load the image and convert it to the HSV color space, or read it from the store already converted
+    if image_hsv is None:
+        image_hsv = load_hsv(image_source, max_pixels, store)
+
+    # With auto_k, k is picked on a small sample of the image's pixels, and K-Means starts from the centers found
+    # while picking it (start is None otherwise, and K-Means picks its own starting centers)
+    start = None
+    if auto_k:
+        k, start, explained = choose_k(image_hsv.reshape(-1, 3), auto_k, min_explained = min_explained)
+
+    # If quantize is set, K-Means is run on the image's distinct colors (rounded to multiples of quantize) instead
+    # of on every pixel. Each color counts as many times as it appears, so the result is nearly the same for a
+    # fraction of the work. The cluster of every pixel is still returned, because the masks below need it
+    if quantize:
+        stats, labels = cluster_color_histogram(image_hsv.reshape(-1, 3), k, quantize = quantize, return_labels = True,
+                                                init = start)
+    else:
+
+        # By default, images are stored as 3D objects with a width and height defined by the image resolution
+        # In addition, each pixel stores three pieces of information pertaining to color, in this case, H, S, and V
+        # K-Means needs one row per pixel instead, and reshape(-1, 3) lines the pixels up that way without copying
+        # them. For example, the data structure of an image typically look like this:
+        # [[[1,2,3], [4,5,6]],
+        # [[7,8,9], [10,11,12]]
+        # The reshape turns it into this:
+        # [[1,2,3], [4,5,6], [7,8,9], [10,11,12]]
+        pixels = image_hsv.reshape(-1, 3)
+
+        # H, S, and V values are at different scales. H values vary from 0-179 and S and V vary from 0-255
+        # Consequently, any clustering based on a geometric distance will be skewed
+        # To remedy this, scale_features() brings everything onto a standard scale, the same way StandardScaler
+        # does but in float32 and without a DataFrame, exactly like the Data Collectors
+        features, mean, scale = scale_features(pixels)
+
+        # These lines actually perform the K-Means clustering. Note that k is the same k passed in the initial argument
+        # The starting centers from auto_k are scaled the same way as the pixels, and one start is enough
+        # copy_x = False saves KMeans a copy of the features (they're already centered)
+        if start is None:
+            kmeans = KMeans(n_clusters = k, copy_x = False)
+        else:
+            kmeans = KMeans(n_clusters = k, init = (start - mean) / scale, n_init = 1, copy_x = False)
+        kmeans.fit(features)
+        labels = kmeans.labels_
+
+        # Work out the pixel count and average H, S and V values of every cluster in one pass over the labels
+        # The labels themselves are simple numeric values that denote which pixels go into which cluster
+        # (ie, all pixels labeled as 1 are in the same cluster)
+        # pixels holds the real H, S and V values in the same order as the labels
+        stats = cluster_stats(labels, pixels, k)
 
     # create an empty dictionary to store summary values
     colors = {}
 
-    # Iterate through the clusters, calculates the summary stats, and saves a masked image
-    for i in range(k):
+    # Reshape the labels into the dimensions of the picture, so every pixel holds the number of its cluster.
+    # This "label image" is all the masks at once: the mask of cluster i is just the pixels equal to i
+    dims = image_hsv.shape
+    label_image = np.asarray(labels).reshape(dims[0], dims[1])
 
-        # filter the dataframe by cluster
-        df_filter = df[df["cluster"] == i]
+    # Convert the whole image back to BGR once for better visualization. Masked out pixels are black in both
+    # color spaces, so masking the converted image gives the same pictures as converting every masked image,
+    # without k full-image conversions
+    image_bgr = cv2.cvtColor(image_hsv, cv2.COLOR_HSV2BGR)
 
-        # Calculates the summary stats. By default, the average is taken. If these need to change, this is the 
-        # place to do it. Note that using the numpy library for calulations generally yield faster results
-        # The summary states are then stored in the dictionary.
-        colors["cluster " + str(i)] = [
-            np.mean(df_filter["h"]), 
-            np.mean(df_filter["s"]), 
-            np.mean(df_filter["v"])
-        ]
+    # Iterate through the clusters, stores the summary stats, and saves a masked image
+    for i in range(k):
+
+        # Stores the summary stats. By default, the average is taken. If these need to change, this is the 
+        # place to do it (the "sums" and "counts" from cluster_stats() are also available)
+        colors["cluster " + str(i)] = stats["means"][i].tolist()
 
         # create a "mask" based on the labels. This is basically the array that will dictate whether or not a pixel
-        # will be displayed in the image
-        detect = np.array([1 if x == i else 0 for x in kmeans.labels_], dtype='uint8')
-        
-        # reshape the mask into the dimensions of the picture
-        dims = image_hsv.shape
-        detect = detect.reshape(dims[0], dims[1])
-        
-        # Create a copy of the image
-        image_copy = image_hsv
-        
+        # will be displayed in the image. The comparison runs over the whole label image at once in numpy
+        # (1 where the pixel is in cluster i and 0 everywhere else), rather than one pixel at a time in Python
+        detect = (label_image == i).view(np.uint8)
+
         # create the masked image
-        output = cv2.bitwise_and(image_copy, image_copy, mask = detect)
-        
-        # Convert back to rgb for better visualization
-        output = cv2.cvtColor(output, cv2.COLOR_HSV2BGR)
-        
+        output = cv2.bitwise_and(image_bgr, image_bgr, mask = detect)
+
         # save the image locally
-        cv2.imwrite("image_cluster_" + str(i) + ".jpg", output)
+        cv2.imwrite(os.path.join(output_dir, "image_cluster_" + str(i) + ".jpg"), thumbnail(output, thumbnail_width))
 
     # Finally return the colors dictionary
     return colors
@@ -136,14 +146,14 @@ def hsv_to_rgb(hsv_vals):
     # Because openCV stores it as a BGR, the reverse is stored in a list and returned for the traditional RGB format
     return [pixel[2], pixel[1], pixel[0]]
     
-# takes a path and number of clusters k and creates an html file with the summary statistics and sample color 
+# takes a path and number of clusters k (and optionally quantize, max_pixels, auto_k and store) and creates an html file with the summary statistics and sample color 
 # Note that a html file is the basic bare-bones component to a static website. This provides a useful frame work
 # for displaying data and information in an organized way. If running this on Jupyter Notebooks, the web browswer
 # will be open anyway and will open a new tab to render the html file
-def get_summary_visual(path, k):
+def get_summary_visual(path, k, quantize = None, max_pixels = MAX_PIXELS, auto_k = None, store = None):
     
     # Get the photo data
-    summary = image_summary(path, k)
+    summary = image_summary(path, k, quantize, max_pixels = max_pixels, auto_k = auto_k, store = store)
     
     # write the start of the html file
     start = """
@@ -203,6 +213,106 @@ def get_summary_visual(path, k):
     # open the html file in the webbrowser
     webbrowser.open(path, new=2)
     
+# Summarizes one image for the gallery and returns its gallery entry (see color_cluster_kit/gallery.py)
+# item holds the image path, the name shown in the gallery, the image's own folder and any extra lines of text
+# Everything is saved in that folder inside dest, so images never overwrite each other's pictures
+# If download is True, the image's source is a url, and the image is downloaded first
+def gallery_entry(item, k, dest, quantize = None, thumbnail_width = 320, max_pixels = MAX_PIXELS, auto_k = None,
+                  store = None, download = False):
+
+    source, name, folder, details = item
+    entry = {"name": name, "details": details}
+
+    try:
+        output_dir = os.path.join(dest, folder)
+        os.makedirs(output_dir, exist_ok = True)
+
+        # The downloaded bytes are read just like a file would be
+        if download:
+            source = fetch(source)
+
+        # A thumbnail of the image itself (converted back from HSV if it's read from the store)
+        image_hsv = load_hsv(source, max_pixels, store)
+        if image_hsv is None:
+            raise ValueError("the file is missing or isn't an image")
+        image = cv2.cvtColor(image_hsv, cv2.COLOR_HSV2BGR)
+        cv2.imwrite(os.path.join(output_dir, "image.jpg"), thumbnail(image, thumbnail_width))
+        entry["image"] = folder + "/image.jpg"
+
+        # The image is clustered from the pixels loaded above instead of being decoded again
+        summary = image_summary(source, k, quantize, output_dir = output_dir, thumbnail_width = thumbnail_width,
+                                max_pixels = max_pixels, auto_k = auto_k, store = store, image_hsv = image_hsv)
+
+        # The same details as the single image summary: the average HSV values, a color swatch and the cluster image
+        entry["clusters"] = [
+            {
+                "label": key,
+                "hsv": summary[key],
+                "rgb": [int(x) for x in hsv_to_rgb(summary[key])],
+                "image": folder + "/image_cluster_" + key[8:] + ".jpg"
+            }
+            for key in summary
+        ]
+
+    except Exception as error:
+        entry["error"] = "Could not summarize " + str(item[0]) + ": " + str(error)
+
+    return entry
+
+# takes many images and a number of clusters k and writes a gallery of their summaries into the dest folder
+# images is either a list of image paths, or the path of a file with a "path" column such as a Data Collector's
+# data file or results file (csv, .parquet or .feather). For a results file, the result columns are shown on each card
+# A file without a "path" column (e.g. the results of a Data Collector run with stream = True) is shown from its
+# "image_url" column instead, downloading every image
+# Images are summarized in parallel (processes works the same way as in the Data Collectors), and the gallery is
+# split into pages of per_page images with small thumbnails, so a few thousand images are still quick to browse
+# The first page opens in the web browser when it's done, unless open_browser is False
+def get_summary_gallery(images, k, dest = "gallery", quantize = None, processes = None, per_page = 50,
+                        thumbnail_width = 320, max_pixels = MAX_PIXELS, open_browser = True, auto_k = None,
+                        store = None):
+
+    # Work out the path, name and extra details of every image
+    download = False
+    if isinstance(images, str):
+        df = read_results(images)
+        if "path" in df.columns:
+            sources = df["path"].tolist()
+        elif "image_url" in df.columns:
+            sources, download = df["image_url"].tolist(), True
+        else:
+            raise ValueError(images + " has no \"path\" or \"image_url\" column, so there are no images to show")
+        names = df["id"].tolist() if "id" in df.columns else [os.path.basename(x) for x in sources]
+        columns = [c for c in ["status", "h_mean", "s_mean", "v_mean", "num_points"] if c in df.columns]
+        details = [
+            [", ".join(c + ": " + str(row[c]) for c in columns if pd.notna(row[c]))] if columns else []
+            for _, row in df.iterrows()
+        ]
+    else:
+        sources = list(images)
+        names = [os.path.basename(x) for x in sources]
+        details = [[] for _ in sources]
+
+    # Every image gets its own folder inside dest, named after the image
+    folders = image_folders(names)
+    items = list(zip(sources, names, folders, details))
+
+    # Summarize every image, several at a time
+    entry = partial(gallery_entry, k = k, dest = dest, quantize = quantize, thumbnail_width = thumbnail_width,
+                    max_pixels = max_pixels, auto_k = auto_k, store = store, download = download)
+    entries = run_batch(entry, items, processes = processes)
+
+    # If a worker crashed on an image, its result is just an error message, so turn it into an entry
+    for i, result in enumerate(entries):
+        if not isinstance(result, dict):
+            entries[i] = {"name": names[i], "details": details[i], "error": str(result)}
+
+    # Write the pages and open the first one
+    first_page = write_gallery(entries, dest, per_page = per_page, thumbnail_width = thumbnail_width)
+    if open_browser:
+        webbrowser.open(os.path.abspath(first_page), new=2)
+
+    return first_page
+
 # This is the point where user input is required!!
 
 # All the code above supports this single line
@@ -212,4 +322,26 @@ def get_summary_visual(path, k):
 # The second argument is K, used for K-Means clustering
 # Depending on the size of the image and the value k, this may take several minutes to complete
 # Generally, larger images and larger values of K take longer to complete
-get_summary_visual(r"C:\Users\Example\FlowerClassification\Observations\123.jpg", 5)
+
+# To review many images at once, set gallery to a list of image paths or to the path of a file with a "path"
+# column (e.g. the Data Collector's results file). The summaries are saved in the gallery_folder folder, one
+# folder per image, and the gallery pages open in the web browser. None summarizes just the one image below
+gallery = None
+gallery_folder = "gallery"
+
+# Set auto_k to a list of candidate values of k (e.g. [2, 3, 4, 5, 6, 8, 10, 12, 15]) to pick k for every image on
+# its own instead of using the k below (see image_summary())
+auto_k = None
+
+# Set store to the folder of a Data Collector's image store (e.g. "pixels.store") to read the images from it instead
+# of decoding them again. Images that aren't in the store are loaded as usual
+store = None
+
+# The code below only runs when this file is run directly. The gallery's worker processes import this file to
+# find gallery_entry(), and this check stops each of them from running the summary too
+if __name__ == "__main__":
+    if gallery is None:
+        get_summary_visual(r"C:\Users\Example\FlowerClassification\Observations\123.jpg", 5, auto_k = auto_k,
+                           store = store)
+    else:
+        get_summary_gallery(gallery, 5, dest = gallery_folder, auto_k = auto_k, store = store)
@@ -0,0 +1,47 @@
+# imports pandas, which reads the data file with the images' paths
+import pandas as pd
+# imports the backend comparison, which times the K-Means fit with each backend (see color_cluster_kit/benchmark.py)
+from color_cluster_kit.benchmark import compare_backends
+# imports the backends and the default pixel budget of the Data Collectors
+from color_cluster_kit import BACKENDS, MAX_PIXELS
+
+# This script compares the K-Means backends the Data Collectors can use (the backend setting in each of them)
+# Every image is clustered with every backend, and for each one it prints how long the fit took and how closely its
+# clusters match the first backend's: how far the cluster averages moved in H, S and V, and the share of the pixels
+# that ended up in another cluster ("count_shift"). If a faster backend barely moves them, it's safe to switch to it
+# The full table is also saved to a csv file
+
+# The data file the Data Collectors read (with a "path" column of downloaded images), and how many of its images to
+# compare on. Add an "r" in front of the path. Set data to None to use a few synthetic flower images instead
+data = None
+n_images = 10
+
+# The backends to compare. The first one is the reference the others are compared with
+backends = list(BACKENDS)
+
+# The values of k to compare, e.g. 5 for Geranium and 15 for Sandblossom
+ks = [5, 15]
+
+# Images with more pixels than max_pixels are shrunk first, just like in the Data Collectors
+max_pixels = MAX_PIXELS
+
+# How many times each fit is run. The median time is kept. Every fit uses the same seed
+repeats = 3
+seed = 0
+
+# Where the full table is saved
+output = "backend_comparison.csv"
+
+if __name__ == "__main__":
+
+    images = None
+    if data:
+        images = pd.read_csv(data)["path"].dropna().head(n_images).tolist()
+
+    comparison = compare_backends(images, ks, backends, seed = seed, repeats = repeats, max_pixels = max_pixels)
+    comparison.to_csv(output, index = False)
+
+    # The average of every image, per k and backend
+    columns = ["seconds", "speedup", "drift_h", "drift_s", "drift_v", "count_shift"]
+    print(comparison.groupby(["k", "backend"], sort = False)[columns].mean().round(4).to_string())
+    print("Saved the full comparison to " + output)
@@ -0,0 +1,357 @@
+# This Data Collector runs several species at once. Each species is a "profile" in a config file (profiles.json
+# by default) with its own k, lower_bound, upper_bound and measure, the settings that used to need a separate copy
+# of the Data Collector per species. Every image is loaded once and clustered once for every distinct k, and then
+# every profile's bounds are applied to those same clusters, so adding a species to a run costs almost nothing
+# Profiles that use the same k share one clustering, and with auto_k every profile shares the same one
+# imports pandas, an important library for data manipulation
+import pandas as pd
+# partial fixes some of a function's arguments ahead of time, so image_summary can be handed to the batch runner
+from functools import partial
+# imports sys, which lets the script stop early (after merging shards)
+import sys
+# imports the species profiles: reading them from the config file and applying their bounds to an image's clusters
+from color_cluster_kit import load_profiles, profile_measures, profiles_summary
+# imports the clustering of one image shared by the Data Collectors, and the settings that identify it in the cache
+from color_cluster_kit import cluster_hsv, cluster_settings
+# imports the default for the automatic choice of k (see auto_k below)
+from color_cluster_kit import MIN_EXPLAINED
+# imports the check of the mode and sample_size settings (see mode below)
+from color_cluster_kit import check_mode
+# imports the default pixel budget (see max_pixels below)
+from color_cluster_kit import MAX_PIXELS
+# imports the image store, which keeps every image's HSV pixels ready in one file (see store below), and the loader
+# that reads an image from the store, or else from its path or downloaded bytes, shrunk to the pixel budget
+from color_cluster_kit import build_store, load_hsv, open_store
+# imports the memory budget helpers (see worker_memory_mb below)
+from color_cluster_kit import fit_pixel_budget, processes_for_memory
+# imports the planner that splits the cores between processes and threads (see threads below)
+from color_cluster_kit import describe_plan, plan_workers
+# imports the streaming pipeline, which downloads and clusters images at the same time without saving them first
+from color_cluster_kit import run_pipeline
+# imports the cache, which remembers the clusters of images that were already processed
+from color_cluster_kit import open_cache
+# imports the checkpointed runner, which spreads image_summary across all the cores of the machine and saves the
+# results as it goes, so an interrupted run can pick up where it left off
+from color_cluster_kit import run_checkpointed
+# imports the helpers that split a run across several machines and merge their outputs (see the end of this file)
+from color_cluster_kit import merge_shards, select_shard, shard_arguments, shard_output
+# imports the duplicate finder (see duplicate_distance below)
+from color_cluster_kit import duplicate_ids
+# imports the telemetry helpers, which record how long each step takes for every image (see telemetry below)
+from color_cluster_kit import finish_record, lap, note, note_error, pop_note, start_record
+
+# Receives an image path and the profiles and returns a dictionary with the result of every profile, e.g.
+# {"Geranium": [140.1, 80.5, 201.3], "Sandblossom": "no flowers"}
+# Each result is exactly what that species' own Data Collector returns for the image
+# The image_source argument is a path to the image, or the raw bytes of a downloaded image
+# profiles is the dictionary returned by load_profiles()
+# mode, sample_size, random_state, quantize, max_pixels, auto_k, min_explained, backend, cache and telemetry work the
+# same way as in the other Data Collectors. The cache is shared with them too: an image one of them already clustered
+# with the same k and settings isn't clustered again here. store is optional and is the folder of an image store,
+# which the image's HSV pixels are read from without decoding it (see color_cluster_kit/store.py)
+# If the image can't be read (or anything else goes wrong), "An error occured" is returned for the whole image
+def image_summary(image_source, profiles, mode = "full", sample_size = 20000, random_state = None, quantize = None,
+                  max_pixels = MAX_PIXELS, auto_k = None, min_explained = MIN_EXPLAINED, backend = "sklearn",
+                  cache = None, store = None, telemetry = False):
+
+    if telemetry:
+        start_record()
+
+    try:
+        # Every distinct k is clustered once, however many profiles use it. With auto_k, k is picked for the image
+        # itself, so a single clustering is shared by every profile
+        ks = sorted({profile["k"] for profile in profiles.values()})
+        if auto_k:
+            ks = ks[:1]
+
+        image_hsv = None
+        clusters = {}
+        hits = 0
+        for k in ks:
+
+            # If a cache file is given, look this clustering up in it first (see the other Data Collectors)
+            stats = None
+            if cache:
+                cluster_cache = open_cache(cache)
+                settings = cluster_settings(k, mode, sample_size, random_state, quantize, max_pixels,
+                                            auto_k = auto_k, min_explained = min_explained, backend = backend)
+                key = cluster_cache.key(image_source, settings, store)
+                stats = cluster_cache.get(key)
+                hits += stats is not None
+                note(cache_hits = hits)
+                lap("cache")
+
+            # If it isn't in the cache, cluster it. The image is only loaded the first time it's needed (from the store,
+            # if it's in there)
+            if stats is None:
+                if image_hsv is None:
+                    image_hsv = load_hsv(image_source, max_pixels, store)
+                    if image_hsv is None:
+                        raise ValueError("the image is missing or couldn't be read")
+
+                stats = cluster_hsv(image_hsv, k, mode, sample_size, random_state, quantize, auto_k = auto_k,
+                                      min_explained = min_explained, backend = backend)
+
+                # Every fit notes its K-Means iterations (and, with quantize, its number of colors) under the same
+                # name, so each one is moved to a name per profile that uses this k (e.g. kmeans_iterations_Geranium)
+                # before the next k's fit overwrites it. With auto_k, this one fit is every profile's
+                for field in ("kmeans_iterations", "distinct_colors"):
+                    value = pop_note(field)
+                    if value is not None:
+                        note(**{field + "_" + name: value for name, profile in profiles.items()
+                                if auto_k or profile["k"] == k})
+
+                if cache:
+                    cluster_cache.put(key, stats)
+
+            clusters[k] = stats
+
+        # With auto_k, the one clustering stands in for every profile's k
+        if auto_k:
+            clusters = {profile["k"]: clusters[ks[0]] for profile in profiles.values()}
+
+        # Merge the clusters within each profile's bounds, the same way the single species Data Collectors do
+        result = profiles_summary(clusters, profiles)
+
+        # With auto_k, the k the image was clustered with is added to every profile's result, which is saved in the
+        # profile's "k" column (e.g. Geranium_k)
+        if auto_k:
+            k = len(clusters[ks[0]]["counts"])
+            result = {name: value + [k] if isinstance(value, list) else value for name, value in result.items()}
+        lap("summary")
+
+    except Exception as error:
+        note_error(error)
+        result = "An error occured"
+
+    if telemetry:
+        return result, finish_record()
+    return result
+
+# The config file with the species profiles. See profiles.json next to this file for an example: every profile has
+# a name, a k, a lower_bound and upper_bound (H, S and V) and a measure, which is the third value saved for it
+# ("v_mean" for the average V like the Geranium collector, or "num_points" for the number of pixels in range like
+# the Sandblossom collector)
+profiles = "profiles.json"
+
+# The number of images to process at the same time. None lets the plan decide (see threads), which is one per core
+# unless the images are huge
+# Lower this if the machine runs out of memory on very large images
+processes = None
+
+# How many threads each of those processes may use. K-Means, numpy and OpenCV each start one thread per core in
+# every process unless they're told otherwise, so a run with one process per core ends up with far more threads
+# than cores and the machine slows to a crawl. "auto" looks at the sizes of the images and the number of cores and
+# picks between many single-threaded processes (the usual case) and fewer processes with several threads each (huge
+# images, e.g. with max_pixels = None), within the free memory. A number fixes the threads per process, and None
+# leaves the libraries to start as many as they like. Unless it's None, processes x threads is kept within the
+# cores. The plan is printed at the start of the run and the throughput it achieved (images per second) at the end
+# (see color_cluster_kit/scheduler.py)
+threads = "auto"
+
+# Set schedule_log to a file name (e.g. "schedule.jsonl") to also save every run's plan and throughput to it as a
+# line of JSON, to compare the plans of different runs and machines. None doesn't save them
+schedule_log = None
+
+# How K-Means is fit on each image
+# "full" fits on every pixel. This is the default
+# "sample" and "stratified" fit on sample_size pixels and then assign every pixel to its nearest cluster. They're
+# much faster, but the clusters change a little. sample_size has to be at least the largest k of the profiles
+# "minibatch" fits mini-batch K-Means, which looks at a few thousand pixels at a time. It still goes over every
+# pixel and wasn't faster than "full" when it was measured (see color_cluster_kit/clustering.py)
+mode = "full"
+sample_size = 20000
+
+# Which K-Means implementation does the fitting: "sklearn" (the default), "minibatch" or "opencv" (which doesn't
+# work with quantize). See the other Data Collectors, and Compare Backends.py to compare them on your images
+backend = "sklearn"
+
+# Set quantize to a number (e.g. 1, 2 or 4) to cluster each image's distinct colors instead of every pixel
+# Colors are rounded down to a multiple of quantize first. This overrides mode. None clusters every pixel
+# It changes the results, and an image can end up with quite different clusters (see cluster_color_histogram() in
+# color_cluster_kit/clustering.py)
+quantize = None
+
+# Images with more pixels than max_pixels are shrunk to about that many pixels (keeping their shape) before they're
+# clustered, which is much faster and barely changes the cluster colors. Set this to None to cluster every image at
+# its full size
+max_pixels = MAX_PIXELS
+
+# Set worker_memory_mb to how much memory (in MB) each worker process may use, e.g. 1000 for about 1 GB
+# Images are shrunk further if clustering them would need more than that, and no more processes are started than
+# fit in the machine's free memory. None sets no limit
+worker_memory_mb = None
+
+# Set stream to True to download and cluster the images in one go, straight from the "image_url" column
+# Images are downloaded in the background while others are being clustered, and they're never written to disk
+# unless save_images is set to a folder. The Downloader doesn't need to be run first and no "path" column is needed
+stream = False
+download_workers = 16
+save_images = None
+
+# Set auto_k to a list of candidate values of k (e.g. [2, 3, 4, 5, 6, 8, 10, 12, 15]) to pick k for every image on
+# its own. The profiles' own k is then ignored, and every profile shares one clustering of each image. The k picked for
+# each image is saved in every profile's "k" column
+auto_k = None
+min_explained = MIN_EXPLAINED
+
+# Set cache to a file name (e.g. "clusters.db") to remember the clusters of every image between runs
+# When the same images are run again with the same k and clustering settings, K-Means is skipped and only the
+# profiles' bounds are re-applied, so tuning them takes seconds instead of hours
+# cache_size is the most the cache file can grow to, in bytes. The images used least recently are dropped first
+cache = None
+cache_size = 256 * 1024 ** 2
+
+# Results are saved to a checkpoint file (the output file name plus a code made from the settings and .checkpoint,
+# e.g. YourSaveFile.csv.3fa2c61b.checkpoint) every checkpoint_every images
+# If the run stops for any reason, just run this file again: the images that already have a result are skipped, and
+# the ones that failed are tried again. Changing the profiles or any other setting starts a new checkpoint file
+# Delete the checkpoint file to start over
+checkpoint_every = 100
+
+# Set store to a folder name (e.g. "pixels.store") to decode every image only once. The first run shrinks every image
+# to max_pixels, converts it to HSV and saves the pixels in that folder, and every later run (e.g. while tuning k,
+# the bounds or the mode) reads them straight from there without decoding a single JPEG. New images in the data
+# file are added at the start of each run. The folder needs about 3 MB per image at the default max_pixels, and
+# has to be deleted (and built again) if max_pixels changes. It doesn't work with stream = True
+store = None
+
+# Set duplicate_distance to a number (e.g. 4) to cluster duplicate images only once. Re-uploads and near-identical
+# photos are found with a quick perceptual hash of every image before the run: images whose hashes differ in at
+# most duplicate_distance bits (0 means identical-looking, 4 to 6 also catches resized and re-compressed copies)
+# are clustered once, and the others get a copy of that result. The output then has a "duplicate_of" column with
+# the id each copied result came from (empty for the rest). It doesn't work with stream = True. None clusters
+# every image
+duplicate_distance = None
+
+# Set telemetry to a file name (e.g. "YourSaveFile.telemetry.jsonl") to save a record of every image as a line of
+# JSON: how long each step took, the peak memory, the image size and the type of error for images that failed
+telemetry = None
+
+# Where the results are saved. Use just a file name to save it in the same directoty, or an absolute path to save
+# it to some other location in the system
+# Every profile gets its own columns, named after it: e.g. Geranium_h_mean, Geranium_s_mean, Geranium_v_mean and
+# Geranium_status, then Sandblossom_h_mean, Sandblossom_s_mean, Sandblossom_num_points and Sandblossom_status
+# The Classifiers read one profile's columns with read_results(..., profile = "Geranium")
+# A file name ending in .parquet (or .feather) saves a Parquet (or Arrow) file instead of a csv file. It needs the
+# pyarrow package (pip install pyarrow) and doesn't work with stream = True, which always writes a csv file
+output = "YourSaveFile.csv"
+
+# The code below only runs when this file is run directly. Worker processes import this file to find
+# image_summary(), and this check stops each of them from starting its own copy of the whole run
+if __name__ == "__main__":
+
+    # Read the profiles. A mistake in the config file (a missing setting, a typo, ...) stops the run right here,
+    # before any image is processed
+    species = load_profiles(profiles)
+    print("Profiles:", ", ".join(name + " (k = " + str(profile["k"]) + ")" for name, profile in species.items()))
+
+    # Read data from a CSV file and stores it into a dataframe
+    # Like the destination, an "r" should be added in front path
+    # This may be either an absolute path (recommended for beginners) or a relative path, depending on how the file is saved
+    # Note: most of the time, no further arguments are required. Sometimes, though, there will be encoding issues
+    # The most common fix is to add an argument, "encoding", using either:
+    # encoding = 'utf-8'
+    # encoding = 'latin1',
+    # encoding = 'iso-8859-1',
+    # encoding = 'cp1252'
+    df = pd.read_csv(r"C:\Users\Example\FlowerClassification\data.csv")
+
+    # This file can also be run from the command line with one of these options (run it with --help to see them):
+    #   --shard i/n   processes only the i-th of n shards of the data, so n machines can share a big data set. Every
+    #                 machine needs the same data file, settings and images. Each shard is saved to its own file,
+    #                 e.g. YourSaveFile.shard-2-of-4.csv (see color_cluster_kit/shards.py)
+    #   --merge n     combines the outputs of all n shards (copied next to each other) into the output file, the
+    #                 same file a run on one machine would have written, and checks that no observation is missing
+    #                 or was done twice
+    args = shard_arguments()
+    if args.merge:
+        merge_shards(df, output, args.merge)
+        print("Merged", args.merge, "shards into", output)
+        sys.exit()
+
+    # Fit the pixel budget and the number of processes to the memory budget of each worker
+    if worker_memory_mb:
+        max_pixels = fit_pixel_budget(max_pixels, worker_memory_mb)
+        processes = processes_for_memory(worker_memory_mb, processes)
+        print("Memory budget:", processes or "one per core", "processes, images of up to", max_pixels, "pixels")
+
+    # Check the mode and sample_size once, so a wrong setting stops the run here instead of failing every image
+    # Every profile's k is checked (with auto_k, every image can get the largest candidate k instead)
+    check_mode(max(auto_k) if auto_k else max(profile["k"] for profile in species.values()), mode, sample_size)
+
+    # The profiles and settings are fixed ahead of time with partial()
+    summary = partial(image_summary, profiles = species, mode = mode, sample_size = sample_size, quantize = quantize,
+                      max_pixels = max_pixels, auto_k = auto_k, min_explained = min_explained, cache = cache,
+                      store = store, backend = backend)
+
+    # Open the cache here to set its size limit (it's saved in the cache file, so the workers follow it too)
+    if cache:
+        open_cache(cache, cache_size).reset_counters()
+
+    # The measure of every profile, which decides the columns each profile's results are saved in
+    measures = profile_measures(species)
+
+    # With duplicate_distance, find the duplicates in the whole data file first, so every machine finds the same
+    # groups of duplicates and each group is kept together in one shard. That way the merged shards are the same as
+    # a run on one machine
+    duplicates = None
+    if duplicate_distance is not None and not stream:
+        duplicates = duplicate_ids(df, duplicate_distance, processes = processes)
+
+    # With --shard, only this machine's share of the observations is processed. Which share an observation is in
+    # only depends on its id (or on the id of the first image of its group of duplicates), so the machines don't
+    # need to talk to each other
+    if args.shard:
+        df = select_shard(df, *args.shard, groups = duplicates)
+        output = shard_output(output, *args.shard)
+        if telemetry:
+            telemetry = shard_output(telemetry, *args.shard)
+        print("Shard", "/".join(str(x) for x in args.shard) + ":", len(df), "observations, saved to", output)
+
+    # Add the images that aren't in the store yet (all of them on the first run). From then on the images are read
+    # from the store instead of being decoded
+    if store and not stream:
+        failed = build_store(store, df["path"], max_pixels, processes)
+        print("Image store:", len(open_store(store)), "images in", store + ",", failed, "couldn't be read")
+
+    # Plan how many images to process at the same time and how many threads each of them may use, from the sizes
+    # of the images (their headers are enough) and the number of cores. Streamed images aren't downloaded yet, so
+    # they're planned as max_pixels pixels each
+    plan = plan_workers(None if stream else df["path"].tolist(), max_pixels, processes, threads)
+    print("Plan:", describe_plan(plan))
+
+    # All that code above supports these final lines
+    # NOTE: Depending on the size of the data set and the values of k, this may take some time to complete
+    if stream:
+
+        # This downloads every "image_url", clusters it and writes its row to the save file as soon as it's done
+        # Images that fail to download are listed in FailedDownloads.csv
+        run_pipeline(
+            summary,
+            df,
+            output,
+            measure = measures,
+            with_k = bool(auto_k),
+            plan = plan,
+            schedule_log = schedule_log,
+            download_workers = download_workers,
+            save_dir = save_images,
+            manifest = "FailedDownloads.csv",
+            telemetry = telemetry
+        )
+
+    else:
+
+        # This adds every profile's result columns to the dataframe and saves it
+        # This assumes there is already a column in the dataframe called "path" which has the path to the image
+        # and a column called "id" that identifies each observation
+        df = run_checkpointed(summary, df, output, measure = measures, flush_every = checkpoint_every,
+                              plan = plan, schedule_log = schedule_log, telemetry = telemetry,
+                              duplicates = duplicates, with_k = bool(auto_k))
+
+    # How often the cache had the image already
+    if cache:
+        print(open_cache(cache).counters())
+
+    print('Done!')
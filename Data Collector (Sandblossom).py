@@ -1,17 +1,45 @@
-# All the imports from the sklearn module are statistical tools to help perform K-Means Clustering
-from sklearn.preprocessing import StandardScaler
-from sklearn.preprocessing import normalize
-from sklearn.cluster import KMeans
 # imports pandas and numpy, two important libraries for data manipulation
 import pandas as pd
 import numpy as np
-# imports cv2, a computer vision library to help manipulate images
-import cv2
+# partial fixes some of a function's arguments ahead of time, so image_summary can be handed to the batch runner
+from functools import partial
+# imports sys, which lets the script stop early (after merging shards)
+import sys
+# imports the clusters-within-bounds summary shared by the Data Collectors
+from color_cluster_kit import in_range_summary
+# imports the clustering of one image shared by the Data Collectors, and the settings that identify it in the cache
+from color_cluster_kit import cluster_hsv, cluster_settings
+# imports the check that compares a fast mode to a full fit
+from color_cluster_kit import drift_report
+# imports the default for the automatic choice of k (see auto_k below)
+from color_cluster_kit import MIN_EXPLAINED
+# imports the check of the mode and sample_size settings (see mode below)
+from color_cluster_kit import check_mode
+# imports the default pixel budget (see max_pixels below)
+from color_cluster_kit import MAX_PIXELS
+# imports the image store, which keeps every image's HSV pixels ready in one file (see store below), and the loader
+# that reads an image from the store, or else from its path or downloaded bytes, shrunk to the pixel budget
+from color_cluster_kit import build_store, load_hsv, open_store
+# imports the memory budget helpers (see worker_memory_mb below)
+from color_cluster_kit import fit_pixel_budget, processes_for_memory
+# imports the planner that splits the cores between processes and threads (see threads below)
+from color_cluster_kit import describe_plan, plan_workers
+# imports the streaming pipeline, which downloads and clusters images at the same time without saving them first
+from color_cluster_kit import run_pipeline
+# imports the cache, which remembers the clusters of images that were already processed
+from color_cluster_kit import open_cache
+# imports the checkpointed runner, which spreads image_summary across all the cores of the machine and saves the
+# results as it goes, so an interrupted run can pick up where it left off
+from color_cluster_kit import run_checkpointed
+# imports the helpers that split a run across several machines and merge their outputs (see the end of this file)
+from color_cluster_kit import merge_shards, select_shard, shard_arguments, shard_output
+# imports the duplicate finder (see duplicate_distance below)
+from color_cluster_kit import duplicate_ids
+# imports the codebook, a set of cluster centers fitted once for the whole dataset (see codebook below)
+from color_cluster_kit import ensure_codebook, fetch, open_codebook
+# imports the telemetry helpers, which record how long each step takes for every image (see telemetry below)
+from color_cluster_kit import finish_record, lap, note, note_error, start_record
 
-# write a utlity function to determine if a number is in a range. This makes the code less cumbersome later
-def is_between (lower, num, upper):
-    return lower <= num <= upper
-    
 # While averages are used as the default, some utility functions were returned to help with other, more advanced
 # summary statistics which may help in some situations the above_nth() and below_nth() functions in particular return
 # an array above or below a percentile. This may be helpful when trying to isolate a relatively dark or light part of 
@@ -47,164 +75,365 @@ def percent_pix (np_array, image_dim_1, image_dim_2):
 # Receives an image path and number of clusters k and returns a dictionary of clusters and values
 # This function works very similarly to the function of the same name in the Image Summary Visualizer,
 # but there's a key difference in how it aggregates clusters within a defined color range
-# The image_source argument is a path to the image
+# The image_source argument is a path to the image, or the raw bytes of a downloaded image
 # k is the k for K-Means Clustering
 # lower_bound is the lower bound of the HSV values
 # upper_bound is the upper bound of the HSV values
-def image_summary(image_source, k, lower_bound, upper_bound):
-    
-    # Load image
-    image = cv2.imread(image_source)
-    
+# mode, sample_size and random_state pick how K-Means is fit (see fit_clusters() in color_cluster_kit/clustering.py)
+# quantize clusters the image's color histogram instead of every pixel (see cluster_color_histogram())
+# backend picks the K-Means implementation (see color_cluster_kit/backends.py)
+# How the image is clustered is shared by every Data Collector, and lives in cluster_hsv() in
+# color_cluster_kit/summary.py
+# max_pixels is the pixel budget: larger images are shrunk to about that many pixels as they're loaded (see
+# load_image() in color_cluster_kit/images.py). None clusters every image at its full size
+# codebook is optional and is the path of a saved codebook (e.g. "codebook.npz"). warm_start picks how it's used
+# (see cluster_hsv())
+# auto_k is optional and is a list of candidate values of k to pick from for every image, and min_explained is how
+# good the pick has to be (see choose_k()). k is then only used if auto_k is None
+# cache is optional and is the path of a cache file (e.g. "clusters.db"). Images that were already clustered with
+# the same settings are read from it instead of being clustered again (see color_cluster_kit/cache.py)
+# store is optional and is the folder of an image store (e.g. "pixels.store"). Images in it are read from there as
+# HSV pixels, without decoding them (see color_cluster_kit/store.py)
+# If return_stats is True, the per-cluster stats are returned alongside the result, which drift_report() needs
+# If telemetry is True, a record of the image (the time of each step, peak memory, image size, K-Means iterations
+# and the error, if any) is returned alongside the result instead (see color_cluster_kit/telemetry.py)
+def image_summary(image_source, k, lower_bound, upper_bound, mode = "full", sample_size = 20000, random_state = None,
+                  quantize = None, max_pixels = MAX_PIXELS, codebook = None, warm_start = False, auto_k = None,
+                  min_explained = MIN_EXPLAINED, backend = "sklearn", cache = None, store = None,
+                  return_stats = False, telemetry = False):
+
+    if telemetry:
+        start_record()
+
     try:
+        # If a cache file is given, look the image up in it first. The key is made from the contents of the image
+        # and every setting that changes the clustering. The bounds aren't part of it, so a run that only changes
+        # the bounds finds every image in the cache. For an image in the store, the store already knows the hash of
+        # its contents, so its file isn't read
+        stats = None
+        codebook = open_codebook(codebook, k) if codebook else None
+        if cache:
+            cluster_cache = open_cache(cache)
+            settings = cluster_settings(k, mode, sample_size, random_state, quantize, max_pixels, codebook,
+                                        warm_start, auto_k, min_explained, backend)
+            key = cluster_cache.key(image_source, settings, store)
+            stats = cluster_cache.get(key)
+            note(cache_hit = stats is not None)
+            lap("cache")
+
+        # If it isn't in the cache, load the image's HSV pixels (from the store, if it's in there) and cluster them.
+        # cluster_hsv() is the slow part: it fits K-Means on the pixels (see color_cluster_kit/summary.py)
+        if stats is None:
+            image_hsv = load_hsv(image_source, max_pixels, store)
+            if image_hsv is None:
+                raise ValueError("the image is missing or couldn't be read")
+
+            stats = cluster_hsv(image_hsv, k, mode, sample_size, random_state, quantize, codebook, warm_start, auto_k,
+                                  min_explained, backend)
+
+            if cache:
+                cluster_cache.put(key, stats)
+
+        # Merge the clusters whose average H and S values are within the upper and lower bounds and return
+        # [h_mean, s_mean, num_points], or "no flowers" if there's no clusters in range. V isn't checked
+        # The number of pixels in the blue range is the total number of pixels in those clusters
+        # if you want to change which measure to evaluate, here's the place to choose
+        result = in_range_summary(stats, lower_bound, upper_bound, measure = "num_points")
+
+        # With auto_k, the k this image was clustered with (its number of clusters) is added as a fourth value,
+        # which is saved in the "k" column
+        if auto_k and isinstance(result, list):
+            result = result + [len(stats["counts"])]
+        lap("summary")
+
+    except Exception as error:
+        note_error(error)
+        result, stats = "An error occured", None
+
+    if telemetry:
+        return result, finish_record()
+    if return_stats:
+        return result, stats
+    return result
         
-        # Very large images take a lot of time to process, so if it has a width of over 1500, the image is resized to 
-        # @ 1/4th of its original size
-        if image.shape[0] > 1500:
-            image = cv2.resize(image, (int(image.shape[0]/4), int(image.shape[1]/4)))
-
-        # Convert image to HSV
-        image_hsv = cv2.cvtColor(image,cv2.COLOR_BGR2HSV)
-
-        # By default, images are stored as 3D objects with a width and height defined by the image resolution
-        # In addition, each pixel stores three pieces of information pertaining to color, in this case, H, S, and V
-        # Mathematrical operations on this 3D object is cumbersome and inefficient, so the flatten() method
-        # turns it into a 2D array for quicker operations.
-        # The first three values in the 2D array correspond with the 3 color values in the top-left pixel
-        # The next three values correspond with the 3 color values in next pixel to the right, etc.
-        # For example, the data structure of an image typically look like this:
-        # [[[1,2,3], [4,5,6]],
-        # [[7,8,9], [10,11,12]]
-        # The flatten argument transforms it to this:
-        # [1,2,3,4,5,6,7,8,9,10,11,12]
-        # Flatten the image for more efficient processing
-        image_flat = image_hsv.flatten()
-        
-        # Because of how the image is flatten, we know that the H, S, and V values reoccur at every third pixel
-        # at a slight different index i.e. All H values are at the 0th place, 3rd place, 6th place, 9th place and so on
-        # We take advantage of this to collect all the H, S, and V values into single variables
-
-        # the h-channel. Takes every 3rd value from flatten image starting at 0th place
-        h = image_flat[0::3]
-        # the s-channel. Takes every 3rd value from flatten image starting at 1st place
-        s = image_flat[1::3]
-        # the v-channel. Takes every 3rd value from flatten image starting at 2nd place
-        v = image_flat[2::3]
-
-        # Create a dataframe from the pixel values
-        df = pd.DataFrame(data = h, columns = ["h"])
-        df['s'] = s
-        df['v'] = v
-        
-        # H, S, and V values are at different scales. H values vary from 0-179 and S and V vary from 0-255
-        # Consequently, any clustering based on a geometric distance will be skewed
-        # To remedy this, the StandScaler() function brings everything onto a standard scale
+# define upper and lower bounds. You will need to define your color space here.
+lower_bound = (112, 26, 0)
+upper_bound = (155, 165, 255)
+
+# The number of images to process at the same time. None lets the plan decide (see threads), which is one per core
+# unless the images are huge
+# Lower this if the machine runs out of memory on very large images
+processes = None
+
+# How many threads each of those processes may use. K-Means, numpy and OpenCV each start one thread per core in
+# every process unless they're told otherwise, so a run with one process per core ends up with far more threads
+# than cores and the machine slows to a crawl. "auto" looks at the sizes of the images and the number of cores and
+# picks between many single-threaded processes (the usual case) and fewer processes with several threads each (huge
+# images, e.g. with max_pixels = None), within the free memory. A number fixes the threads per process, and None
+# leaves the libraries to start as many as they like. Unless it's None, processes x threads is kept within the
+# cores. The plan is printed at the start of the run and the throughput it achieved (images per second) at the end
+# (see color_cluster_kit/scheduler.py)
+threads = "auto"
+
+# Set schedule_log to a file name (e.g. "schedule.jsonl") to also save every run's plan and throughput to it as a
+# line of JSON, to compare the plans of different runs and machines. None doesn't save them
+schedule_log = None
+
+# How K-Means is fit on each image
+# "full" fits on every pixel. This is the default
+# "sample" and "stratified" fit on sample_size pixels and then assign every pixel to its nearest cluster. They're
+# much faster, but the clusters change a little, so check them with check_drift first. sample_size has to be at
+# least k
+# "minibatch" fits mini-batch K-Means, which looks at a few thousand pixels at a time. It still goes over every
+# pixel and wasn't faster than "full" when it was measured (see color_cluster_kit/clustering.py)
+mode = "full"
+sample_size = 20000
+
+# Which K-Means implementation does the fitting. The results are close but not identical, so use Compare Backends.py
+# to see how fast each one is on your images and how closely they agree before switching
+# "sklearn" is scikit-learn's KMeans. This is the default
+# "minibatch" is scikit-learn's MiniBatchKMeans. It isn't faster on every machine, so compare before using it
+# "opencv" is OpenCV's cv2.kmeans. It doesn't work with quantize
+backend = "sklearn"
 
-        # initialize scaler
-        scaler = StandardScaler()
+# Set quantize to a number (e.g. 1, 2 or 4) to cluster each image's distinct colors instead of every pixel
+# Colors are rounded down to a multiple of quantize first. This overrides mode. None clusters every pixel
+# It changes the results, and an image can end up with quite different clusters (see cluster_color_histogram() in
+# color_cluster_kit/clustering.py), so check it with check_drift first
+quantize = None
 
-        # Scaled features
-        scaler.fit(df)
-        df_scaled = scaler.transform(df)
+# Images with more pixels than max_pixels are shrunk to about that many pixels (keeping their shape) before they're
+# clustered, which is much faster and barely changes the cluster colors. Large JPEG files are decoded straight at a
+# smaller size, so they're never fully decoded. Set this to None to cluster every image at its full size
+max_pixels = MAX_PIXELS
 
-        # These two lines actually perform the K-Means clustering. Note that k is the same k passed in the initial argument
-        kmeans = KMeans(n_clusters = k)
-        kmeans.fit(df_scaled)
+# Set worker_memory_mb to how much memory (in MB) each worker process may use, e.g. 1000 for about 1 GB
+# Images are shrunk further if clustering them would need more than that, and no more processes are started than
+# fit in the machine's free memory. That way a machine with many cores but little memory can still use most of
+# them, and one with plenty of memory isn't held back. None sets no limit
+# With telemetry turned on, "peak_memory_mb" shows how much memory each image really needed
+worker_memory_mb = None
 
-        # Create a new column in the dataframe for the labels
-        # The labels themselves are simple numeric values that denote which pixels go into which cluster
-        # (ie, all pixels labeled as 1 are in the same cluster)
-        df["cluster"] = kmeans.labels_
+# Set this to True to check a fast mode (or the codebook) against a full fit on a few images before the full run
+# It prints how far the cluster averages and the output values moved. If they barely move, the fast mode
+# won't change any classifications
+check_drift = False
 
-        # create an empty dictionary to store summary values
-        colors = {}
+# Set stream to True to download and cluster the images in one go, straight from the "image_url" column
+# Images are downloaded in the background while others are being clustered, and they're never written to disk
+# unless save_images is set to a folder. The Downloader doesn't need to be run first and no "path" column is needed
+# Each row is written to the save file as soon as its image is done, so rows come out in the order they finish
+stream = False
+download_workers = 16
+save_images = None
 
-        # Iterates through the clusters, calculates the summary statistics (if they're in the upper and lower bounds)
-        for i in range(k):
+# Set codebook to a file name (e.g. "codebook.npz") to fit one set of k cluster centers on pixels sampled from
+# codebook_images images of the whole data set, and use it for every image instead of fitting K-Means on each one
+# Every pixel then just goes to its nearest center, which takes a fraction of the time of a fit. The clusters are
+# the same for every image, so check a few results against a normal run (or with check_drift) before relying on it
+# Set codebook_warm_start to True to still fit K-Means on every image, but starting from the codebook centers,
+# which needs fewer iterations and only one start
+# The codebook is saved to that file the first time and reused afterwards. Delete the file to fit a new one
+codebook = None
+codebook_warm_start = False
+codebook_images = 200
 
-            # filter the dataframe by cluster
-            df_filter = df[df["cluster"] == i]
+# Set auto_k to a list of candidate values of k (e.g. [2, 3, 4, 5, 6, 8, 10, 12, 15]) to pick k for every image on
+# its own instead of using the same k for all of them. Simple images (a flower on a plain background) then get a
+# small k and are clustered much faster, while busy images still get a large one. The pick is the smallest k whose
+# clusters explain at least min_explained (90%) of the image's color variance, tried on a small sample of pixels
+# The k picked for each image is saved in its own "k" column, and with telemetry on, so is how long picking it took
+# ("choose_k")
+auto_k = None
+min_explained = MIN_EXPLAINED
 
-            # Find the mean of h
-            h_mean = np.mean(df_filter["h"])
+# Set cache to a file name (e.g. "clusters.db") to remember the clusters of every image between runs
+# When the same images are run again with the same k and clustering settings, K-Means is skipped and only the
+# bounds are re-applied, so tuning lower_bound and upper_bound takes seconds instead of hours
+# cache_size is the most the cache file can grow to, in bytes. The images used least recently are dropped first
+cache = None
+cache_size = 256 * 1024 ** 2
 
-            # Find out if h_mean is within range. If not, the loop moves to the next iteration
-            # If it does it moves to the next item to calculate. This method should speed up the code
-            # because it doesn't need to calculate everything every time. The drawback is that more 
-            # than a handful of calculations make the code cumbersome/hard to read
-            if is_between(lower_bound[0], h_mean, upper_bound[0]):
+# Results are saved to a checkpoint file (the output file name plus a code made from the settings and .checkpoint,
+# e.g. YourSaveFile.csv.3fa2c61b.checkpoint) every checkpoint_every images
+# If the run stops for any reason, just run this file again: the images that already have a result are skipped, and
+# the ones that failed are tried again. Changing k, the bounds or any other setting starts a new checkpoint file
+# Delete the checkpoint file to start over
+checkpoint_every = 100
 
-                # Find the mean of s
-                s_mean = np.mean(df_filter["s"])
+# Set store to a folder name (e.g. "pixels.store") to decode every image only once. The first run shrinks every image
+# to max_pixels, converts it to HSV and saves the pixels in that folder, and every later run (e.g. while tuning k,
+# the bounds or the mode) reads them straight from there without decoding a single JPEG. New images in the data
+# file are added at the start of each run. The folder needs about 3 MB per image at the default max_pixels, and
+# has to be deleted (and built again) if max_pixels changes. It doesn't work with stream = True
+store = None
 
-                # Next comparison
-                if is_between(lower_bound[1], s_mean, upper_bound[1]):
+# Set duplicate_distance to a number (e.g. 4) to cluster duplicate images only once. Re-uploads and near-identical
+# photos are found with a quick perceptual hash of every image before the run: images whose hashes differ in at
+# most duplicate_distance bits (0 means identical-looking, 4 to 6 also catches resized and re-compressed copies)
+# are clustered once, and the others get a copy of that result. The output then has a "duplicate_of" column with
+# the id each copied result came from (empty for the rest). It doesn't work with stream = True. None clusters
+# every image
+duplicate_distance = None
 
-                    # find the number of pixels in the blue range, using the H-values. It could have been calculated
-                    # using either H-, S-, or V-values, since no pixel will be lacking any of these values
-                    num_points = len(df_filter["h"])
+# Set telemetry to a file name (e.g. "YourSaveFile.telemetry.jsonl") to save a record of every image as a line of
+# JSON: how long each step took, the peak memory, the image size, the K-Means iterations and the type of error for
+# images that failed. Read it with read_telemetry() from color_cluster_kit to find the slowest images and the most
+# common failures. The peak memory is read from the operating system, so recording costs next to nothing
+telemetry = None
 
-                    # store ONLY the averages that fit in range in the dictionary
-                    colors[i] = [h_mean, s_mean, num_points]
+# Where the results are saved. Use just a file name to save it in the same directoty, or an absolute path to save
+# it to some other location in the system
+# Each result is saved in its own columns: h_mean, s_mean, num_points and status ("ok", "no flowers" or "error")
+# A file name ending in .parquet (or .feather) saves a Parquet (or Arrow) file instead of a csv file, which is
+# smaller and much quicker to read back for big runs. It needs the pyarrow package (pip install pyarrow) and
+# doesn't work with stream = True, which always writes a csv file
+output = "YourSaveFile.csv"
 
-        # If there's no clusters in range, then return "no flowers"
-        if len(colors) == 0:
-            return "no flowers"
-        # If there's only 1 cluster in range, just return the values as is
-        elif len(colors) == 1:
-            return list(colors.values())[0]
-        # If there are multiple clusters in range, they need to be combined and their summary stats re-calculated
+# The code below only runs when this file is run directly. Worker processes import this file to find
+# image_summary(), and this check stops each of them from starting its own copy of the whole run
+if __name__ == "__main__":
+
+    # Read data from a CSV file and stores it into a dataframe
+    # Like the destination, an "r" should be added in front path
+    # This may be either an absolute path (recommended for beginners) or a relative path, depending on how the file is saved
+    # Note: most of the time, no further arguments are required. Sometimes, though, there will be encoding issues
+    # The most common fix is to add an argument, "encoding", using either:
+    # encoding = 'utf-8'
+    # encoding = 'latin1', 
+    # encoding = 'iso-8859-1',
+    # encoding = 'cp1252'
+    df = pd.read_csv(r"C:\Users\Example\FlowerClassification\data.csv")
+
+    # This file can also be run from the command line with one of these options (run it with --help to see them):
+    #   --shard i/n   processes only the i-th of n shards of the data, so n machines can share a big data set. Every
+    #                 machine needs the same data file, settings and images. Each shard is saved to its own file,
+    #                 e.g. YourSaveFile.shard-2-of-4.csv (see color_cluster_kit/shards.py)
+    #   --merge n     combines the outputs of all n shards (copied next to each other) into the output file, the
+    #                 same file a run on one machine would have written, and checks that no observation is missing
+    #                 or was done twice
+    args = shard_arguments()
+    if args.merge:
+        merge_shards(df, output, args.merge)
+        print("Merged", args.merge, "shards into", output)
+        sys.exit()
+
+    # Fit the pixel budget and the number of processes to the memory budget of each worker
+    if worker_memory_mb:
+        max_pixels = fit_pixel_budget(max_pixels, worker_memory_mb)
+        processes = processes_for_memory(worker_memory_mb, processes)
+        print("Memory budget:", processes or "one per core", "processes, images of up to", max_pixels, "pixels")
+
+    # Check the mode and sample_size once, so a wrong setting stops the run here instead of failing every image
+    # With auto_k, every image can get the largest candidate k
+    check_mode(max(auto_k) if auto_k else 15, mode, sample_size)
+
+    # The k, lower_bound and upper_bound arguments are fixed ahead of time with partial(). k is for K-Means
+    # clustering, and the bounds are the lower and upper bound for HSV values, already defined in other variables
+    summary = partial(image_summary, k = 15, lower_bound = lower_bound, upper_bound = upper_bound, mode = mode,
+                      sample_size = sample_size, quantize = quantize, max_pixels = max_pixels, codebook = codebook,
+                      warm_start = codebook_warm_start, auto_k = auto_k, min_explained = min_explained, cache = cache,
+                      store = store, backend = backend)
+
+    # Fit the codebook on a sample of the images, unless it was already saved by an earlier run
+    # When streaming, the sampled images are downloaded for this (and then downloaded again for the run itself)
+    if codebook:
+        if stream:
+            ensure_codebook(codebook, df["image_url"], 15, n_images = codebook_images, max_pixels = max_pixels,
+                            read = fetch)
         else:
+            ensure_codebook(codebook, df["path"], 15, n_images = codebook_images, max_pixels = max_pixels)
 
-            # Create a list of dataframes to combine
-            df_combine = [df[df["cluster"] == key] for key in colors.keys()]
-
-            # Concatenate the dataframes into one, bigger, dataframe
-            df_result = pd.concat(df_combine)
-
-            # return a list of values
-            # if you want to change which measure to evaluate, here's the place to choose. Using Numpy's built-in
-            # functions are recommended as they're usually quicker
-            result = [
-                np.mean(df_result["h"]), 
-                np.mean(df_result["s"]), 
-                len(df_result["h"])
-            ]
-            
-            return result
-    
-    except:
-        return "An error occured"
-        
-# define upper and lower bounds. You will need to define your color space here.
-lower_bound = (112, 26, 0)
-upper_bound = (155, 165, 255)
+    # Open the cache here to set its size limit (it's saved in the cache file, so the workers follow it too)
+    if cache:
+        open_cache(cache, cache_size).reset_counters()
+
+    # Optional check of the fast mode before committing to it. When streaming, the sampled images are downloaded
+    # for it (there's no "path" column then)
+    if check_drift and (mode != "full" or quantize or codebook or auto_k or backend != "sklearn"):
+        drift = drift_report(
+            partial(image_summary, k = 15, lower_bound = lower_bound, upper_bound = upper_bound,
+                    max_pixels = max_pixels),
+            df["image_url"] if stream else df["path"],
+            read = fetch if stream else None,
+            mode = mode,
+            sample_size = sample_size,
+            quantize = quantize,
+            codebook = codebook,
+            warm_start = codebook_warm_start,
+            auto_k = auto_k,
+            min_explained = min_explained,
+            backend = backend
+        )
+        print(drift)
+        print(drift.describe())
+
+    # With duplicate_distance, find the duplicates in the whole data file first, so every machine finds the same
+    # groups of duplicates and each group is kept together in one shard. That way the merged shards are the same as
+    # a run on one machine
+    duplicates = None
+    if duplicate_distance is not None and not stream:
+        duplicates = duplicate_ids(df, duplicate_distance, processes = processes)
+
+    # With --shard, only this machine's share of the observations is processed. Which share an observation is in
+    # only depends on its id (or on the id of the first image of its group of duplicates), so the machines don't
+    # need to talk to each other. The codebook above is still fitted on the whole data set, so every machine uses
+    # the same one
+    if args.shard:
+        df = select_shard(df, *args.shard, groups = duplicates)
+        output = shard_output(output, *args.shard)
+        if telemetry:
+            telemetry = shard_output(telemetry, *args.shard)
+        print("Shard", "/".join(str(x) for x in args.shard) + ":", len(df), "observations, saved to", output)
+
+    # Add the images that aren't in the store yet (all of them on the first run). From then on the images are read
+    # from the store instead of being decoded
+    if store and not stream:
+        failed = build_store(store, df["path"], max_pixels, processes)
+        print("Image store:", len(open_store(store)), "images in", store + ",", failed, "couldn't be read")
+
+    # Plan how many images to process at the same time and how many threads each of them may use, from the sizes
+    # of the images (their headers are enough) and the number of cores. Streamed images aren't downloaded yet, so
+    # they're planned as max_pixels pixels each
+    plan = plan_workers(None if stream else df["path"].tolist(), max_pixels, processes, threads)
+    print("Plan:", describe_plan(plan))
+
+    # All that code above supports these final lines
+    # NOTE: Depending on the size of the data set and the number k selected, this may take some time to complete
+    # Every core works on its own image, so the run time shrinks roughly with the number of processes
+    # If an image crashes its worker, only that row gets "An error occured" and the rest of the batch carries on
+    if stream:
+
+        # This downloads every "image_url", clusters it and writes its row (with the new result columns) to the
+        # save file as soon as it's done. Images that fail to download are listed in FailedDownloads.csv
+        run_pipeline(
+            summary,
+            df,
+            output,
+            measure = "num_points",
+            with_k = bool(auto_k),
+            plan = plan,
+            schedule_log = schedule_log,
+            download_workers = download_workers,
+            save_dir = save_images,
+            manifest = "FailedDownloads.csv",
+            telemetry = telemetry
+        )
+
+    else:
+
+        # This adds the result columns to the dataframe and saves it
+        # This assumes there is already a column in the dataframe called "path" which has the path to the image
+        # and a column called "id" that identifies each observation
+        # run_checkpointed() calls image_summary() on every path, several images at a time, and saves the results
+        # to the checkpoint file as it goes. Once every image is done, the dataframe is saved with the results in the
+        # same order as its rows
+        df = run_checkpointed(summary, df, output, measure = "num_points", flush_every = checkpoint_every,
+                              plan = plan, schedule_log = schedule_log, telemetry = telemetry,
+                              duplicates = duplicates, with_k = bool(auto_k))
+
+    # How often the cache had the image already
+    if cache:
+        print(open_cache(cache).counters())
 
-# Read data from a CSV file and stores it into a dataframe
-# Like the destination, an "r" should be added in front path
-# This may be either an absolute path (recommended for beginners) or a relative path, depending on how the file is saved
-# Note: most of the time, no further arguments are required. Sometimes, though, there will be encoding issues
-# The most common fix is to add an argument, "encoding", using either:
-# encoding = 'utf-8'
-# encoding = 'latin1', 
-# encoding = 'iso-8859-1',
-# encoding = 'cp1252'
-df = pd.read_csv(r"C:\Users\Example\FlowerClassification\data.csv")
-
-# All that code above supports these final lines
-# This creates a new column in the dataframe called "KMeansData"
-# This assumes there is already a column in the dataframe called "path" which has the path to the image
-# In the image_summary() function, the first argument is always x, because in this case, x will take 
-# the value of the path to the image
-# The second argument is k for K-Means clustering
-# The third and fourth arguments are the lower and upper bound for HSV values, already defined in other variables
-# NOTE: Depending on the size of the data set and the number k selected, this may take some time to complete
-# In smaller datasets with a low k, this may take 30 minutes to an hour
-# For larger datasets with larger k, this may run overnight or longer
-df["KMeansData"] = df["path"].apply(lambda x: image_summary(x, 15, lower_bound, upper_bound))
-
-# Finally, the code is saved to a csv file locally
-# Use just a file name to save it in the same directoty
-# Use an absolute path to save it to some other location in the system
-df.to_csv("YourSaveFile.csv")
-print('Done!')
\ No newline at end of file
+    print('Done!')
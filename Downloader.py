@@ -1,7 +1,7 @@
-# imports the URL libary, which helps download images from websites
-import urllib.request
 # imports the pandas library, which stores data into spreadsheet-like objects
 import pandas as pd
+# imports the downloader, which downloads many images at once and retries the ones that fail
+from color_cluster_kit import download_images
 
 # the dest (short for "destination") is the path to the file where all the images will be downloaded
 # Note that "\" is a break character that interferes with how strings of text are read
@@ -9,6 +9,18 @@ import pandas as pd
 # This may be either an absolute path (recommended for beginners) or a relative path, depending on how the file is saved
 dest = r"C:\Users\Example\FlowerClassification\Observations"
 
+# The number of images to download at the same time
+# Image hosts tend to slow down or block clients that open too many connections, so a few dozen is usually plenty
+workers = 16
+
+# How many times to retry an image that failed (e.g. bad internet connection, server busy)
+# The wait before each retry doubles, starting from backoff seconds
+retries = 3
+backoff = 0.5
+
+# Every image that still fails is listed in this file, with its id, url and the reason it failed
+manifest = "FailedDownloads.csv"
+
 # Read data from a CSV file and stores it into a dataframe
 # Like the destination, an "r" should be added in front path
 # This may be either an absolute path (recommended for beginners) or a relative path, depending on how the file is saved
@@ -20,21 +32,16 @@ dest = r"C:\Users\Example\FlowerClassification\Observations"
 # encoding = 'cp1252'
 df = pd.read_csv(r"C:\Users\Example\FlowerClassification\data.csv")
 
-# This for loop iterates through every image url in the dataframe and downloads it locally to the destination
-for i in range(0,len(df.index)):
-    # The "try" tells the program to attempt the below code. If it fails for whatever reason, it moves to the "except"
-    try:
-        # A single line to invisibly visit the image url and download it to the preselected destination
-        # Note 1: that it is assumed that the dataframe as a column labeled "image_url" and "id"
-        # Note 2: Images are saved under their id as a jpg
-        urllib.request.urlretrieve(df['image_url'][i], dest + str(df['id'][i]) + '.jpg')
-    # If the code fails, "continue" is called so that the program continues to run. This means if there is an error,
-    # (e.g. url is no longer available, incorrect url, bad internet connection, etc.) the loop moves to the next 
-    # item and the image is not downloaded
-    except:
-        continue
-    
-    # This is a really rough progress bar. Essentially, whenever an image downloads, a line will print telling how
-    # many images have been downloaded so far out of the total. For example, if 20 images download out of 40 total,
-    # the line will read "20/40"
-    print(str(i + 1) + "/" + str(len(df.index)))
\ No newline at end of file
+# This line downloads every image url in the dataframe to the destination, several images at a time
+# Note 1: that it is assumed that the dataframe as a column labeled "image_url" and "id"
+# Note 2: Images are saved under their id as a jpg, inside the destination folder
+# Note 3: Images that are already in the destination folder are skipped, so if the run is interrupted, just
+# run this again to pick up where it left off
+# If an image can't be downloaded (e.g. url is no longer available, incorrect url, bad internet connection, etc.),
+# it's retried a few times and then written to the manifest, and the rest of the images carry on
+# While it runs, a progress line shows how many images are done out of the total. For example, if 20 images
+# download out of 40 total, the line will read "20/40"
+failures = download_images(df['id'], df['image_url'], dest, workers = workers, retries = retries, backoff = backoff,
+                           manifest = manifest)
+
+print(str(len(failures)) + " images failed to download. See " + manifest + " for the details")
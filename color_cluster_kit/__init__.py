@@ -0,0 +1,32 @@
+# Shared helpers used by the Color Cluster Kit scripts
+# The scripts in the top folder (Data Collector, Classifier, Visualizer, Downloader) are the entry points that
+# most people will edit and run. The heavier machinery they share lives in this folder so each script doesn't
+# have to keep its own copy of it.
+# To use it, keep this folder next to the scripts (python always looks in the script's own folder for imports)
+
+from color_cluster_kit.backends import BACKENDS, assign_labels, kmeans_fit
+from color_cluster_kit.batch import iter_batch, run_batch
+from color_cluster_kit.cache import ClusterCache, open_cache
+from color_cluster_kit.calibration import (DEFAULT_CAPACITY, QuantileSketch, calibrate, load_thresholds,
+                                           save_thresholds)
+from color_cluster_kit.checkpoint import Checkpoint, checkpoint_path, failed_result, run_checkpointed
+from color_cluster_kit.clustering import (MIN_EXPLAINED, check_mode, choose_k, cluster_color_histogram,
+                                          color_histogram, drift_report, fit_clusters, scale_features)
+from color_cluster_kit.codebook import Codebook, ensure_codebook, fit_codebook, open_codebook
+from color_cluster_kit.download import DownloadError, download_images, fetch
+from color_cluster_kit.duplicates import (duplicate_groups, duplicate_ids, find_duplicates, hash_images,
+                                          image_hash)
+from color_cluster_kit.gallery import image_folders, thumbnail, write_gallery
+from color_cluster_kit.images import MAX_PIXELS, fit_to_budget, load_image
+from color_cluster_kit.memory import available_memory_mb, fit_pixel_budget, processes_for_memory
+from color_cluster_kit.pipeline import run_pipeline, stream_summaries
+from color_cluster_kit.profiles import load_profiles, profile_measures, profiles_summary
+from color_cluster_kit.results import (expand_results, iter_results, output_columns, output_row, read_results,
+                                       write_results)
+from color_cluster_kit.scheduler import describe_plan, limit_threads, log_throughput, plan_workers, usable_cores
+from color_cluster_kit.shards import merge_shards, select_shard, shard_arguments, shard_of, shard_output
+from color_cluster_kit.stats import cluster_stats, in_range_clusters, in_range_summary, merge_clusters, stats_from_sums
+from color_cluster_kit.store import PixelStore, build_store, check_max_pixels, content_id, load_hsv, open_store
+from color_cluster_kit.summary import CLUSTER_SETTINGS, cluster_hsv, cluster_image, cluster_settings
+from color_cluster_kit.telemetry import (Progress, TelemetryLog, finish_record, lap, note, note_error, pop_note,
+                                         read_telemetry, start_record)
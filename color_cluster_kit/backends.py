@@ -0,0 +1,106 @@
+# The K-Means implementations the clustering step can run on
+# Every backend takes the same features (one row per pixel, or per color with weights) and returns the same thing,
+# so fit_clusters() and cluster_color_histogram() can switch between them with one setting:
+# "sklearn" is scikit-learn's KMeans (the default, and what the collectors have always used)
+# "minibatch" is scikit-learn's MiniBatchKMeans, which looks at batch_size rows at a time, with slightly less exact
+#   centers. It isn't faster on every machine: on a 1 megapixel image and one core it took 1.2 to 4.7 seconds
+#   against 0.9 to 1.2 for "sklearn"
+# "opencv" is OpenCV's own cv2.kmeans, written in C++. OpenCV is already needed to read the images, so it costs
+#   nothing extra. It took about as long as "sklearn" (1.0 to 1.2 seconds on the same image). It can't weight rows,
+#   so it doesn't work with quantize (which clusters weighted colors)
+# Use compare_backends() in color_cluster_kit/benchmark.py (or Compare Backends.py) to see how fast each one is on
+# a set of images and how closely its clusters match the others
+import cv2
+import numpy as np
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+# The backends kmeans_fit() understands
+BACKENDS = ("sklearn", "minibatch", "opencv")
+
+# cv2.kmeans stops when the centers move less than this (in the units of the features), or after this many rounds,
+# the same limits KMeans uses by default
+OPENCV_TOLERANCE = 1e-4
+OPENCV_MAX_ITER = 300
+
+
+# scikit-learn's KMeans. Returns (labels, centers, iterations)
+def _fit_sklearn(features, k, random_state, init, sample_weight, batch_size):
+
+    # copy_x=False lets KMeans center the features in place (and undo it afterwards) instead of copying them.
+    # Features from scale_features() are centered already, so this only saves memory
+    start = {} if init is None else {"init": init, "n_init": 1}
+    kmeans = KMeans(n_clusters=k, random_state=random_state, copy_x=False, **start)
+    kmeans.fit(features, sample_weight=sample_weight)
+
+    return kmeans.labels_, kmeans.cluster_centers_, int(kmeans.n_iter_)
+
+
+# scikit-learn's MiniBatchKMeans. Returns (labels, centers, iterations)
+def _fit_minibatch(features, k, random_state, init, sample_weight, batch_size):
+
+    start = {} if init is None else {"init": init, "n_init": 1}
+    kmeans = MiniBatchKMeans(n_clusters=k, batch_size=batch_size, random_state=random_state, **start)
+    kmeans.fit(features, sample_weight=sample_weight)
+
+    return kmeans.labels_, kmeans.cluster_centers_, int(kmeans.n_iter_)
+
+
+# OpenCV's cv2.kmeans. Returns (labels, centers, None), since OpenCV doesn't report the number of rounds
+def _fit_opencv(features, k, random_state, init, sample_weight, batch_size):
+
+    if sample_weight is not None:
+        raise ValueError("The opencv backend can't weight rows, so it doesn't work with quantize. Use the sklearn "
+                         "or minibatch backend instead")
+
+    data = np.ascontiguousarray(features, dtype=np.float32)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, OPENCV_MAX_ITER, OPENCV_TOLERANCE)
+
+    # OpenCV has one global random generator. Seeding it makes the k-means++ starting centers repeatable
+    if random_state is not None:
+        cv2.setRNGSeed(int(random_state))
+
+    # cv2.kmeans can't start from given centers, but it can start from given labels, which comes to the same thing:
+    # every row starts in the cluster of its nearest starting center
+    if init is None:
+        _, labels, centers = cv2.kmeans(data, k, None, criteria, 1, cv2.KMEANS_PP_CENTERS)
+    else:
+        start = assign_labels(data, init).astype(np.int32).reshape(-1, 1)
+        _, labels, centers = cv2.kmeans(data, k, start, criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS)
+
+    return labels.ravel(), centers, None
+
+
+_FITS = {"sklearn": _fit_sklearn, "minibatch": _fit_minibatch, "opencv": _fit_opencv}
+
+
+# Runs K-Means on features with one of the BACKENDS and returns (labels, centers, iterations)
+# labels holds the cluster of every row, centers the k centroids in the same units as features, and iterations the
+# number of rounds the fit took (None if the backend doesn't say)
+# init is optional and holds k centers to start from, in which case the fit starts once from them
+# sample_weight is optional and holds a weight for every row (e.g. the pixel count of each color)
+# batch_size is only used by the minibatch backend
+def kmeans_fit(features, k, backend="sklearn", random_state=None, init=None, sample_weight=None, batch_size=4096):
+
+    if backend not in _FITS:
+        raise ValueError("backend must be one of " + ", ".join(BACKENDS) + ", not " + repr(backend))
+
+    if init is not None:
+        init = np.asarray(init, dtype=float)
+
+    return _FITS[backend](features, k, random_state, init, sample_weight, batch_size)
+
+
+# Returns the number of the nearest center for every row of features, chunk_size rows at a time
+# This is what KMeans.predict() does, for centers from any backend. The squared distance is worked out as
+# |x|^2 - 2 x.c + |c|^2, and |x|^2 is the same for every center, so it can be left out
+def assign_labels(features, centers, chunk_size=1000000):
+
+    centers = np.asarray(centers, dtype=np.float32)
+    half_norms = (centers ** 2).sum(axis=1) / 2
+
+    labels = np.empty(len(features), dtype=np.int64)
+    for i in range(0, len(features), chunk_size):
+        chunk = np.asarray(features[i:i + chunk_size], dtype=np.float32)
+        labels[i:i + chunk_size] = np.argmax(chunk @ centers.T - half_norms, axis=1)
+
+    return labels
@@ -0,0 +1,138 @@
+# Runs a function (usually image_summary) over many inputs at once using a pool of worker processes
+# K-Means on a single image only keeps one core busy, so a big CSV of observations spends most of its time
+# waiting on one image after another. Spreading the images across processes lets every core work on its own image.
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from color_cluster_kit.scheduler import limit_threads
+
+# The value stored for an input whose worker raised an error or crashed. This matches the string image_summary
+# already returns on failure, so the rest of the pipeline doesn't need a new special case
+ERROR_VALUE = "An error occured"
+
+
+# Takes (index, item) pairs from the jobs iterator, runs them on a fresh pool and yields (index, result) as each
+# one completes
+# Only max_in_flight items are taken from jobs at a time, so jobs can be a generator that produces items on demand
+# (e.g. images that are still downloading) and a 50k-row CSV doesn't create 50k futures up front
+# If a worker process dies (e.g. a corrupt image crashes the decoder), the pool becomes unusable. When that
+# happens the function stops and puts the items that were still running into suspects (any of them could be the
+# culprit). Whatever is left in jobs is untouched, so a new pool can carry on from there
+def _run_pool(func, jobs, processes, max_in_flight, error_value, suspects, threads=None):
+
+    running = {}
+    # The item being handed to the pool, which isn't in running yet if submit() fails
+    submitting = None
+
+    with ProcessPoolExecutor(max_workers=processes, initializer=limit_threads, initargs=(threads,)) as pool:
+        try:
+            for submitting in jobs:
+                running[pool.submit(func, submitting[1])] = submitting
+                submitting = None
+                if len(running) >= max_in_flight:
+                    break
+
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    index, item = running.pop(future)
+                    error = future.exception()
+
+                    # A broken pool means a worker died, not that this input raised. Stop and report what was running
+                    if isinstance(error, BrokenProcessPool):
+                        suspects[index] = item
+                        suspects.update(running.values())
+                        return
+
+                    yield index, (error_value if error is not None else future.result())
+
+                    # Top the queue back up
+                    for submitting in jobs:
+                        running[pool.submit(func, submitting[1])] = submitting
+                        submitting = None
+                        break
+
+        except BrokenProcessPool:
+            # submit() itself can raise once the pool is broken. The item it was given never ran, but it's already
+            # taken from jobs, so it goes with the suspects to be run again
+            suspects.update(running.values())
+            if submitting is not None:
+                suspects[submitting[0]] = submitting[1]
+
+
+# Runs the suspects of a crash (see _run_pool()) again and yields (index, result) for each of them. Any of them
+# could have crashed the pool, and usually only one did. They're split in half and each half runs on a pool of its
+# own, so the inputs that are fine finish side by side, and only a half that crashes again is split further, until
+# the input that takes its worker down is on its own and gets error_value. That takes about 2 x log2(n) pools for n
+# suspects, instead of one pool per suspect
+def _retry_suspects(func, suspects, processes, error_value, threads):
+
+    groups = [sorted(suspects.items())]
+    while groups:
+        group = groups.pop()
+
+        # A single suspect left over from a crash is run once more alone, in case it only crashed because of
+        # another input (e.g. the machine ran out of memory)
+        if len(group) == 1:
+            crashed = {}
+            yield from _run_pool(func, iter(group), 1, 1, error_value, crashed, threads)
+            if crashed:
+                yield group[0][0], error_value
+            continue
+
+        middle = len(group) // 2
+        for half in (group[:middle], group[middle:]):
+            crashed = {}
+            yield from _run_pool(func, iter(half), min(processes, len(half)), len(half), error_value, crashed,
+                                 threads)
+
+            if crashed and len(half) == 1:
+                yield half[0][0], error_value
+            elif crashed:
+                groups.append(sorted(crashed.items()))
+
+
+# Yields (index, result) pairs in the order the work finishes. index is the position of the input in items,
+# so results can be written back to the right row even though they arrive out of order
+# func must be importable by the worker processes: a function defined at the top level of a module or of a
+# script guarded by `if __name__ == "__main__":`, optionally wrapped in functools.partial to fix its other arguments
+# items can be any iterable, including a generator. It's only read as fast as the workers can take new work
+# processes is the number of worker processes (defaults to the number of cores)
+# error_value is stored for any input that raised an error or that crashed its worker
+# threads is how many threads every worker may use for OpenMP, BLAS and OpenCV (see plan_workers() in
+# color_cluster_kit/scheduler.py). None leaves each library to start one thread per core
+# Inputs that were running when a worker crashed are retried in smaller and smaller groups (see _retry_suspects()),
+# so a single bad image only costs its own result instead of the whole batch, and the rest carries on in a new pool
+def iter_batch(func, items, processes=None, error_value=ERROR_VALUE, max_in_flight=None, threads=None):
+
+    processes = processes or os.cpu_count() or 1
+    max_in_flight = max_in_flight or processes * 4
+
+    jobs = enumerate(items)
+
+    # Keep going until a pool gets through the rest of the jobs without a crash
+    while True:
+        suspects = {}
+        yield from _run_pool(func, jobs, processes, max_in_flight, error_value, suspects, threads)
+
+        if not suspects:
+            return
+
+        # Find the suspects that crash their worker. They get the error value, and the rest their results
+        yield from _retry_suspects(func, suspects, processes, error_value, threads)
+
+
+# Same as iter_batch(), but waits for everything to finish and returns a list of results in input order
+# This is a drop-in replacement for df["path"].apply(lambda x: image_summary(x, ...)), e.g.
+# df["KMeansData"] = run_batch(partial(image_summary, k=5, lower_bound=lower_bound, upper_bound=upper_bound), df["path"])
+def run_batch(func, items, processes=None, error_value=ERROR_VALUE, max_in_flight=None, threads=None):
+
+    items = list(items)
+    results = [error_value] * len(items)
+
+    for index, result in iter_batch(func, items, processes, error_value, max_in_flight, threads):
+        results[index] = result
+
+    return results
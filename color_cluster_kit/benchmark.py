@@ -0,0 +1,292 @@
+# Times each stage of clustering an image, so a change to image_summary() can be checked for speed
+# The images are synthetic "flowers" (a few purple blobs on a green and brown background) made from a fixed seed,
+# so every run times exactly the same pixels. Each stage mirrors the matching step of the Data Collectors and the
+# Visualizer and is timed on its own: decode, resize, BGR-to-HSV, scaling into float32 features, K-Means fit,
+# per-cluster stats, mask rendering and the HTML write
+# Results are plain dictionaries saved as JSON, and compare_results() lists the stages that got slower than a
+# saved baseline by more than a threshold
+# compare_backends() times the K-Means fit alone with each backend (see color_cluster_kit/backends.py) on the same
+# images, and measures how closely each backend's clusters match the first one's
+import json
+import os
+import platform
+import tempfile
+import time
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+import pandas as pd
+import sklearn
+from scipy.optimize import linear_sum_assignment
+
+from color_cluster_kit.backends import BACKENDS
+from color_cluster_kit.clustering import centroid_drift, fit_clusters, scale_features
+from color_cluster_kit.gallery import write_gallery
+from color_cluster_kit.images import MAX_PIXELS, decode_image, fit_to_budget
+from color_cluster_kit.stats import cluster_stats
+from color_cluster_kit.store import load_hsv
+
+# The stages in the order they run
+STAGES = ["decode", "resize", "bgr_to_hsv", "scaling", "kmeans", "stats", "masks", "html"]
+
+# The default image sizes (height, width) and k values. The largest size is over the default pixel budget, so
+# it's decoded at a reduced size and then resized
+SIZES = [(240, 320), (600, 800), (1800, 2400)]
+KS = [5, 15]
+
+
+# Makes a synthetic flower-like BGR image. The same height, width and seed always give the same image
+def synthetic_flower(height, width, seed=0):
+
+    rng = np.random.default_rng(seed)
+
+    # A noisy green and brown background, like leaves and soil
+    hsv = np.empty((height, width, 3), dtype=np.uint8)
+    hsv[..., 0] = rng.choice([20, 45, 60], size=(height, width)) + rng.integers(0, 8, size=(height, width))
+    hsv[..., 1] = rng.integers(60, 200, size=(height, width))
+    hsv[..., 2] = rng.integers(40, 180, size=(height, width))
+
+    # A few purple flowers of different shades and sizes
+    rows, cols = np.ogrid[:height, :width]
+    for _ in range(6):
+        center_row = rng.integers(0, height)
+        center_col = rng.integers(0, width)
+        radius = rng.integers(min(height, width) // 12, min(height, width) // 5 + 2)
+        inside = (rows - center_row) ** 2 + (cols - center_col) ** 2 <= radius ** 2
+        count = int(inside.sum())
+        hsv[inside, 0] = rng.integers(125, 155) + rng.integers(-3, 4, size=count)
+        hsv[inside, 1] = np.clip(rng.integers(40, 220) + rng.integers(-20, 21, size=count), 0, 255)
+        hsv[inside, 2] = np.clip(rng.integers(120, 250) + rng.integers(-20, 21, size=count), 0, 255)
+
+    return cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
+
+
+# Adds the time spent inside the with block to times[name]
+@contextmanager
+def _timed(times, name):
+
+    start = time.perf_counter()
+    yield
+    times[name] = times.get(name, 0.0) + time.perf_counter() - start
+
+
+# Runs every stage once on an encoded image and returns how long each one took, in seconds
+def _run_stages(encoded, k, seed, folder, max_pixels):
+
+    times = {}
+
+    # The same two steps as load_image(): a JPEG over the pixel budget is decoded at a reduced size, and then
+    # shrunk the rest of the way to the budget
+    with _timed(times, "decode"):
+        image = decode_image(encoded, max_pixels)
+
+    with _timed(times, "resize"):
+        image = fit_to_budget(image, max_pixels)
+
+    with _timed(times, "bgr_to_hsv"):
+        image_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+    with _timed(times, "scaling"):
+        pixels = image_hsv.reshape(-1, 3)
+        features, _, _ = scale_features(pixels)
+
+    with _timed(times, "kmeans"):
+        labels, _ = fit_clusters(features, k, random_state=seed)
+
+    with _timed(times, "stats"):
+        stats = cluster_stats(labels, pixels, k)
+
+    # The Visualizer's rendering: one masked picture per cluster, saved as a jpg
+    with _timed(times, "masks"):
+        label_image = labels.reshape(image_hsv.shape[:2])
+        image_bgr = cv2.cvtColor(image_hsv, cv2.COLOR_HSV2BGR)
+        for i in range(k):
+            output = cv2.bitwise_and(image_bgr, image_bgr, mask=(label_image == i).view(np.uint8))
+            cv2.imwrite(os.path.join(folder, "image_cluster_" + str(i) + ".jpg"), output)
+
+    with _timed(times, "html"):
+        clusters = [
+            {"label": "cluster " + str(i), "hsv": stats["means"][i].tolist(), "rgb": [0, 0, 0],
+             "image": "image_cluster_" + str(i) + ".jpg"}
+            for i in range(k)
+        ]
+        write_gallery([{"name": "benchmark", "clusters": clusters}], folder)
+
+    return times
+
+
+# Times every stage for one image size and k. Each stage's time is the median of repeats runs, which is steadier
+# than a single run or the average when something else on the machine gets busy for a moment
+# max_pixels is the pixel budget images are shrunk to, as in the Data Collectors
+def benchmark_case(height, width, k, seed=0, repeats=3, max_pixels=MAX_PIXELS):
+
+    image = synthetic_flower(height, width, seed)
+    encoded = cv2.imencode(".jpg", image)[1].tobytes()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as folder:
+        for _ in range(repeats):
+            runs.append(_run_stages(encoded, k, seed, folder, max_pixels))
+
+    stages = {stage: float(np.median([run[stage] for run in runs])) for stage in STAGES}
+
+    return {"height": height, "width": width, "k": k, "stages": stages, "total": sum(stages.values())}
+
+
+# Runs benchmark_case() for every size and k and returns the results with a note of the machine and versions
+# The name of each case is "heightxwidth k=k", e.g. "600x800 k=5"
+def run_benchmarks(sizes=SIZES, ks=KS, seed=0, repeats=3, max_pixels=MAX_PIXELS, progress=True):
+
+    cases = {}
+    for height, width in sizes:
+        for k in ks:
+            name = "%dx%d k=%d" % (height, width, k)
+            cases[name] = benchmark_case(height, width, k, seed, repeats, max_pixels)
+            if progress:
+                print("%-20s %.3fs" % (name, cases[name]["total"]))
+
+    return {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "sklearn": sklearn.__version__,
+        },
+        "seed": seed,
+        "repeats": repeats,
+        "max_pixels": max_pixels,
+        "cases": cases,
+    }
+
+
+def save_results(results, path):
+
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+
+
+def load_results(path):
+
+    with open(path) as file:
+        return json.load(file)
+
+
+# Returns a table (a dataframe) of each stage's time per case, with a column per stage, for printing
+def results_table(results):
+
+    rows = {name: dict(case["stages"], total=case["total"]) for name, case in results["cases"].items()}
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+# Compares results with a baseline (both from run_benchmarks()) and returns a list of the stages that slowed down
+# A stage counts as a regression when it's more than threshold slower (0.25 is 25%) than in the baseline and
+# also at least min_seconds slower, so stages that take a fraction of a millisecond don't fail on timer noise
+# Only cases and stages found in both results are compared
+def compare_results(results, baseline, threshold=0.25, min_seconds=0.005):
+
+    regressions = []
+    for name, case in results["cases"].items():
+        if name not in baseline["cases"]:
+            continue
+
+        before_stages = baseline["cases"][name]["stages"]
+        for stage, after in case["stages"].items():
+            before = before_stages.get(stage)
+            if before is None:
+                continue
+
+            if after > before * (1 + threshold) and after - before >= min_seconds:
+                regressions.append({
+                    "case": name,
+                    "stage": stage,
+                    "baseline": before,
+                    "current": after,
+                    "ratio": after / before if before else float("inf"),
+                })
+
+    return regressions
+
+
+# Pairs up the clusters of two fits of the same image like centroid_drift() does, and returns the share of the
+# pixels that moved to another cluster as far as the counts can tell: half the total difference between the paired
+# cluster counts (plus the counts of clusters left without a pair), over the number of pixels. 0 means every pair
+# of clusters holds exactly as many pixels in both fits
+def count_shift(stats_a, stats_b):
+
+    keep_a = stats_a["counts"] > 0
+    keep_b = stats_b["counts"] > 0
+    counts_a = stats_a["counts"][keep_a].astype(float)
+    counts_b = stats_b["counts"][keep_b].astype(float)
+
+    distance = np.linalg.norm(stats_a["means"][keep_a][:, None, :] - stats_b["means"][keep_b][None, :, :], axis=2)
+    rows, cols = linear_sum_assignment(distance)
+
+    paired = np.abs(counts_a[rows] - counts_b[cols]).sum()
+    unpaired = counts_a.sum() - counts_a[rows].sum() + counts_b.sum() - counts_b[cols].sum()
+
+    return (paired + unpaired) / 2 / counts_a.sum()
+
+
+# Fits K-Means with every backend in backends on the same images and returns a table (a dataframe) with one row per
+# image, k and backend:
+# - "seconds": the median time of repeats fits, on features that were already scaled, so only the fit is timed
+# - "speedup": how many times faster than the first backend in backends (the reference)
+# - "drift_h/s/v": how far the cluster averages are from the reference's (see centroid_drift())
+# - "count_shift": the share of the pixels that are in another cluster than with the reference (see count_shift())
+# images is a list of image paths, loaded and shrunk to max_pixels like in the Data Collectors. None uses the
+# synthetic flowers of run_benchmarks() at each size in sizes instead
+# A full K-Means fit isn't exactly repeatable either, so every fit uses the same seed
+def compare_backends(images=None, ks=KS, backends=BACKENDS, sizes=SIZES, seed=0, repeats=3, max_pixels=MAX_PIXELS,
+                     progress=True):
+
+    if images is None:
+        sources = {"%dx%d" % size: cv2.cvtColor(fit_to_budget(synthetic_flower(*size, seed), max_pixels),
+                                                cv2.COLOR_BGR2HSV) for size in sizes}
+    else:
+        sources = {str(source): source for source in images}
+
+    rows = []
+    for name, source in sources.items():
+        image_hsv = load_hsv(source, max_pixels) if isinstance(source, str) else source
+        if image_hsv is None:
+            if progress:
+                print("Skipped " + name + ", it couldn't be read")
+            continue
+
+        pixels = image_hsv.reshape(-1, 3)
+        features, _, _ = scale_features(pixels)
+
+        for k in ks:
+            reference = None
+            for backend in backends:
+
+                times = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    labels, _ = fit_clusters(features, k, random_state=seed, backend=backend)
+                    times.append(time.perf_counter() - start)
+
+                stats = cluster_stats(labels, pixels, k)
+                row = {"image": name, "k": k, "backend": backend, "seconds": float(np.median(times))}
+
+                if reference is None:
+                    reference = (row["seconds"], stats)
+                row["speedup"] = reference[0] / row["seconds"]
+
+                drift = centroid_drift(reference[1], stats)
+                for c, channel in enumerate("hsv"):
+                    row["drift_" + channel] = drift[c]
+                row["count_shift"] = count_shift(reference[1], stats)
+                rows.append(row)
+
+                if progress:
+                    print("%-30s k=%-3d %-10s %.3fs  count shift %.2f%%" % (name[-30:], k, backend, row["seconds"],
+                                                                             row["count_shift"] * 100))
+
+    return pd.DataFrame(rows)
+
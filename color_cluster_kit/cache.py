@@ -0,0 +1,182 @@
+# An on-disk cache of clustering results, so re-running a collector doesn't redo K-Means for images it has seen
+# Results are stored in a SQLite file under a key made from the image's contents and every setting that changes
+# the clustering (k, mode, quantize, ...). The lower and upper bounds are NOT part of the key: the cache holds the
+# per-cluster stats of the whole image, and the bounds are applied afterwards. Tuning the bounds therefore only
+# re-runs the cheap in-range check and never the K-Means fit
+# The stats store each cluster's pixel count and the sums of its pixels' real H, S and V values, so the averages are
+# the averages of the pixels in each cluster, exactly what a fresh run computes. Those are only the fitted centroids
+# for a full fit on every pixel. In the other modes (a sample, mini-batches, quantize or a codebook) the centroids
+# come from other points, and which cluster each pixel ends up in depends on the mode. So every setting that changes
+# the fit is part of the key (see cluster_settings() in color_cluster_kit/summary.py), and a hit replayed with new
+# bounds gives what a fresh run with the same settings would (with a fixed random_state, which makes it repeatable)
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+from color_cluster_kit.stats import stats_from_sums
+from color_cluster_kit.store import content_id, open_store
+
+# The size limit of a new cache file. The stats of one image take 32 bytes per cluster, so this holds
+# millions of images
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+# Every process keeps one open connection per cache file, see open_cache()
+_open_caches = {}
+
+
+# Returns the raw bytes behind an image source: the file contents for a path, the bytes themselves for downloaded
+# bytes, or the pixel data (and shape) for an image that's already been decoded
+def source_bytes(image_source):
+
+    if isinstance(image_source, np.ndarray):
+        return str(image_source.shape).encode() + np.ascontiguousarray(image_source).tobytes()
+
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        return bytes(image_source)
+
+    with open(image_source, "rb") as file:
+        return file.read()
+
+
+# A cache of per-cluster stats stored in a SQLite file
+# path is the cache file (created if it doesn't exist). Several processes can share the same file
+# max_bytes is the size limit. When it's exceeded, the images that were used least recently are dropped
+# The limit is saved in the file, so it only has to be given once (e.g. by the main process) and every other
+# process that opens the file without one follows it. A new file starts at DEFAULT_MAX_BYTES
+class ClusterCache:
+
+    def __init__(self, path, max_bytes=None):
+
+        self.path = path
+
+        # Worker processes write at the same time, so wait for each other rather than fail, and use the
+        # write-ahead log so readers never block writers
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS clusters "
+            "(key TEXT PRIMARY KEY, k INTEGER, stats BLOB, size INTEGER, last_used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS clusters_last_used ON clusters (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER)")
+        self.db.execute("INSERT OR IGNORE INTO settings VALUES ('max_bytes', ?)", (DEFAULT_MAX_BYTES,))
+
+        if max_bytes is not None:
+            self.db.execute("UPDATE settings SET value = ? WHERE name = 'max_bytes'", (max_bytes,))
+
+    # The size limit of the cache file, in bytes
+    @property
+    def max_bytes(self):
+
+        return self.db.execute("SELECT value FROM settings WHERE name = 'max_bytes'").fetchone()[0]
+
+    # Returns the cache key of an image: a hash of its content id (a hash of its contents, see content_id() in
+    # color_cluster_kit/store.py) plus the clustering settings
+    # settings is a dictionary of everything that changes the clustering, e.g. {"k": 5, "mode": "full", ...}
+    # store is optional and is the folder of an image store. If the image is in it, the content id recorded there is
+    # used, so the image file isn't read at all. It's the same id either way, so runs with and without the store
+    # share their cache entries
+    def key(self, image_source, settings, store=None):
+
+        content = open_store(store).content_id(image_source) if store else None
+        if content is None:
+            content = content_id(source_bytes(image_source))
+
+        digest = hashlib.blake2b(content.encode(), digest_size=20)
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+
+        return digest.hexdigest()
+
+    # Returns the stats stored under key, or None (a miss) if the image hasn't been clustered with these settings
+    def get(self, key):
+
+        row = self.db.execute("SELECT k, stats FROM clusters WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            self._count("misses")
+            return None
+
+        self._count("hits")
+        self.db.execute("UPDATE clusters SET last_used = ? WHERE key = ?", (time.time(), key))
+
+        table = np.frombuffer(row[1], dtype=np.float64).reshape(row[0], 4)
+        return stats_from_sums(table[:, 0], table[:, 1:])
+
+    # Stores the stats of an image under key, then makes room if the cache is over its size limit
+    def put(self, key, stats):
+
+        blob = np.column_stack([stats["counts"], stats["sums"]]).astype(np.float64).tobytes()
+
+        self.db.execute(
+            "INSERT OR REPLACE INTO clusters VALUES (?, ?, ?, ?, ?)",
+            (key, len(stats["counts"]), blob, len(blob) + len(key), time.time())
+        )
+
+        self.evict()
+
+    # Drops the least recently used images until the cache is back under 90% of its size limit
+    # (a little headroom, so the next few puts don't each have to evict again)
+    def evict(self):
+
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM clusters").fetchone()[0]
+        max_bytes = self.max_bytes
+        if total <= max_bytes:
+            return
+
+        target = total - int(max_bytes * 0.9)
+        removed = 0
+        freed = 0
+        for key, size in self.db.execute("SELECT key, size FROM clusters ORDER BY last_used").fetchall():
+            if freed >= target:
+                break
+            self.db.execute("DELETE FROM clusters WHERE key = ?", (key,))
+            freed += size
+            removed += 1
+
+        self._count("evictions", removed)
+
+    def _count(self, name, amount=1):
+
+        self.db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (amount, name))
+
+    # Returns a dictionary with the hit, miss and eviction counters, plus the number of images and bytes stored
+    # The counters add up across every process and every run that used this cache file
+    def counters(self):
+
+        counts = dict(self.db.execute("SELECT name, value FROM counters").fetchall())
+        counts["entries"], counts["bytes"] = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM clusters"
+        ).fetchone()
+
+        return counts
+
+    # Sets the hit, miss and eviction counters back to 0 (the cached results are kept)
+    def reset_counters(self):
+
+        self.db.execute("UPDATE counters SET value = 0")
+
+    def close(self):
+
+        self.db.close()
+
+
+# Returns this process's ClusterCache for path, opening it the first time
+# image_summary() runs in many worker processes. Passing it the path of the cache (a plain string) and opening it
+# here means each worker opens the file once instead of once per image
+# If max_bytes is given, it becomes the cache file's new size limit
+def open_cache(path, max_bytes=None):
+
+    key = (os.path.abspath(path), os.getpid())
+    if key not in _open_caches:
+        _open_caches[key] = ClusterCache(path, max_bytes)
+    elif max_bytes is not None:
+        _open_caches[key].db.execute("UPDATE settings SET value = ? WHERE name = 'max_bytes'", (max_bytes,))
+
+    return _open_caches[key]
@@ -0,0 +1,153 @@
+# Calibrating the Classifiers' thresholds from a Data Collector's results, in one pass with bounded memory
+# The Classifiers split observations at cut points such as the terciles of the saturation (Geranium) or a pixel
+# count (Sandblossom). Working those out used to mean loading the whole results file into a notebook, which stops
+# working at tens of millions of rows. Here the file is read a chunk at a time (see iter_results()) and every value
+# goes into a QuantileSketch, which keeps a few thousand values however many go in. The cut points are read off
+# the sketch and saved to a thresholds file (e.g. "thresholds.json") that the Classifiers load
+import json
+import os
+
+import numpy as np
+
+from color_cluster_kit.results import STATUS_OK, iter_results
+
+# How many values each level of a QuantileSketch keeps. The sketch's rank error is at most about
+# log2(rows / capacity) / capacity, e.g. 0.3% of the rows for 50 million rows (and much less when the values are
+# added in big chunks, as calibrate() does, since every halving then covers more values at once)
+DEFAULT_CAPACITY = 4096
+
+
+# An approximate quantile sketch (a "merge and reduce" sketch) with a guaranteed error bound
+# Values go into level 0, where each value stands for 1 row. When a level holds more than capacity values, they're
+# sorted and every other one moves up to the next level, where each value stands for twice as many rows. So the
+# sketch never holds more than about capacity values per level, and the number of levels only grows with the
+# logarithm of the number of rows
+# Each of those halvings can move the rank of any value by at most the weight of that level, and the sketch adds
+# them up as it goes. rank_error() is therefore not an estimate but a bound: the value returned for the quantile q
+# has a true rank between q - rank_error() and q + rank_error()
+class QuantileSketch:
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+
+        self.capacity = capacity
+        self.levels = []
+        self.count = 0
+
+        # The most any rank can be off by, in rows
+        self.error = 0
+
+        # Which half (the even or the odd positions) each level keeps next. Taking turns keeps the sketch from
+        # always leaning towards the smaller (or larger) values
+        self.offsets = []
+
+    # Adds values (a number, a list, a numpy array or a column of a dataframe). Missing values (NaN) are skipped
+    def update(self, values):
+
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self._add(0, values)
+
+    def _add(self, level, values):
+
+        while len(self.levels) <= level:
+            self.levels.append(np.zeros(0))
+            self.offsets.append(0)
+
+        values = np.concatenate([self.levels[level], values])
+        if len(values) <= self.capacity:
+            self.levels[level] = values
+            return
+
+        # Halve the level: sort it, keep one value back if there's an odd number, and move every other value up
+        values.sort()
+        kept = values[:len(values) % 2]
+        paired = values[len(values) % 2:]
+
+        self.levels[level] = kept
+        self.error += 2 ** level
+        self._add(level + 1, paired[self.offsets[level]::2])
+        self.offsets[level] = 1 - self.offsets[level]
+
+    # Returns the largest possible error of a quantile, as a fraction of the rows (e.g. 0.001 is 0.1%). On top of the
+    # halvings, a value can't be more precise than the number of rows it stands for (the weight of the top level)
+    def rank_error(self):
+
+        return (self.error + 2 ** (len(self.levels) - 1)) / self.count if self.count else 0.0
+
+    # Returns the value at each quantile in quantiles (numbers between 0 and 1, e.g. [1 / 3, 2 / 3] for the terciles)
+    # Raises ValueError if no values were added
+    def quantiles(self, quantiles):
+
+        if not self.count:
+            raise ValueError("The sketch is empty, so it has no quantiles")
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** i) for i, level in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values, ranks = values[order], np.cumsum(weights[order])
+
+        positions = np.searchsorted(ranks, np.asarray(quantiles, dtype=float) * self.count, side="left")
+        return values[np.minimum(positions, len(values) - 1)].tolist()
+
+
+# Works out the cut points of one column of a results file in a single pass and returns them as a dictionary, ready
+# for save_thresholds():
+# {"column": "s_mean", "quantiles": [0.333, 0.667], "thresholds": [70.6, 92.8], "rows": 120000, "rank_error": 0.0002}
+# Only rows whose status is "ok" are used (the others have no values). measure and profile work as in read_results()
+# and chunk_size is how many rows are read at a time. capacity sets the size (and accuracy) of the sketch
+def calibrate(path, column, quantiles, measure="v_mean", profile=None, chunk_size=100000,
+              capacity=DEFAULT_CAPACITY, **options):
+
+    sketch = QuantileSketch(capacity)
+
+    for chunk in iter_results(path, measure, profile, chunk_size, **options):
+        if column not in chunk.columns:
+            raise ValueError(path + " has no " + repr(column) + " column")
+        sketch.update(chunk.loc[chunk["status"] == STATUS_OK, column])
+
+    if not sketch.count:
+        raise ValueError(path + " has no rows with a status of 'ok' to calibrate " + column + " on")
+
+    return {
+        "column": column,
+        "quantiles": [float(q) for q in quantiles],
+        "thresholds": sketch.quantiles(quantiles),
+        "rows": sketch.count,
+        "rank_error": sketch.rank_error(),
+    }
+
+
+# Saves a calibration (see calibrate()) under name in the thresholds file at path, e.g. "Geranium", keeping every
+# other name's thresholds that are already in the file
+def save_thresholds(path, name, calibration):
+
+    thresholds = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            thresholds = json.load(file)
+
+    thresholds[name] = calibration
+
+    # Written to a temporary file first, so a crash can't leave a half-written file behind
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        json.dump(thresholds, file, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+# Returns the thresholds saved under name in the thresholds file at path, as a list (e.g. [70.6, 92.8])
+# If the file doesn't exist or has nothing for name, default is returned instead, so a Classifier still runs with
+# its old fixed values before anything was calibrated. Without a default, that raises ValueError
+def load_thresholds(path, name, default=None):
+
+    thresholds = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as file:
+            thresholds = json.load(file)
+
+    if name in thresholds:
+        return thresholds[name]["thresholds"]
+    if default is not None:
+        return list(default)
+
+    raise ValueError("No thresholds for " + repr(name) + " in " + path + ". Run the Calibrator first")
@@ -0,0 +1,243 @@
+# Saves results to disk as a run goes, so a crash (or a reboot, or Ctrl+C) doesn't throw away hours of work
+# Every finished image is added to a checkpoint file in batches of flush_every rows. When the same run is started
+# again, the observations that already have a result are skipped, and only the rest are processed. Once every
+# observation has a result, the usual output file is written in the original row order, exactly as an
+# uninterrupted run would have written it
+import csv
+import functools
+import hashlib
+import json
+import os
+import time
+
+from color_cluster_kit.batch import iter_batch
+from color_cluster_kit.duplicates import DUPLICATE_COLUMN, duplicate_ids
+from color_cluster_kit.results import STATUS_ERROR, STATUS_NO_FLOWERS, expand_results, result_status, write_results
+from color_cluster_kit.scheduler import log_throughput
+from color_cluster_kit.telemetry import Progress, TelemetryLog, split_result
+
+# The first line of a checkpoint file records the settings of the run that made it
+SETTINGS_PREFIX = "# settings: "
+
+
+# Returns the settings that identify a run of func, used to make sure a checkpoint belongs to the same run
+# For a functools.partial (the usual way image_summary is passed around), these are its fixed keyword arguments
+def run_settings(func):
+
+    if isinstance(func, functools.partial):
+        return {"function": func.func.__name__, **func.keywords}
+    return {"function": getattr(func, "__name__", repr(func))}
+
+
+# Returns the default checkpoint file of a run with these settings, the output file name plus a short code made
+# from the settings, e.g. "YourSaveFile.csv.3fa2c61b.checkpoint"
+# A run with other settings (e.g. new bounds) gets a checkpoint file of its own and starts over, instead of
+# stopping on the old one. With a cache (see color_cluster_kit/cache.py), that only re-applies the new bounds
+def checkpoint_path(output, settings):
+
+    code = hashlib.blake2b(json.dumps(settings, sort_keys=True, default=str).encode(), digest_size=4).hexdigest()
+    return output + "." + code + ".checkpoint"
+
+
+# Returns True if the text of a result in a checkpoint is a failure (for a multi-profile result, if any profile
+# failed). Those observations are run again when the run is resumed
+def failed_result(text):
+
+    if text.startswith("{"):
+        return result_status(json.loads(text)) == STATUS_ERROR
+    return not text.startswith("[") and text != STATUS_NO_FLOWERS
+
+
+# The results of a run so far, backed by a csv file of (id, result) rows
+# path is the checkpoint file. If it exists, the results in it are loaded, and new ones are appended to it
+# settings describes the run (k, bounds, ...). Resuming from a checkpoint made with different settings would mix
+# results from two different runs, so that raises a ValueError instead
+# Results are written to the file every flush_every rows, and on flush(). A result that's added again (e.g. an
+# observation that failed and was retried) is appended too, and the last one counts when the file is loaded
+class Checkpoint:
+
+    def __init__(self, path, settings, flush_every=100):
+
+        self.path = path
+        self.flush_every = flush_every
+        self.settings = json.dumps(settings, sort_keys=True, default=str)
+        self.results = {}
+        self.pending = []
+
+        if os.path.exists(path):
+            self._load()
+        else:
+            with open(path, "w", newline="") as file:
+                file.write(SETTINGS_PREFIX + self.settings + "\n")
+                csv.writer(file).writerow(["id", "result"])
+
+    # Reads the results already in the file
+    def _load(self):
+
+        with open(self.path, "rb") as file:
+            data = file.read()
+
+        # A crash in the middle of a write can leave half a row at the end. Cut it off so new rows start cleanly
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) < len(data):
+            with open(self.path, "wb") as file:
+                file.write(complete)
+
+        lines = complete.decode().splitlines()
+        if not lines or not lines[0].startswith(SETTINGS_PREFIX):
+            raise ValueError(self.path + " is not a checkpoint file")
+
+        if lines[0][len(SETTINGS_PREFIX):] != self.settings:
+            raise ValueError(
+                self.path + " was made by a run with different settings. Delete it (or pick another checkpoint "
+                "file) to start over with the new settings"
+            )
+
+        for row in csv.reader(lines[2:]):
+            if len(row) == 2:
+                self.results[row[0]] = row[1]
+
+    # Records the result of an observation. Results are kept as text, exactly as they'll appear in the csv file
+    # Multi-profile results (dictionaries) are kept as JSON, so they can be read back exactly
+    def add(self, id, result):
+
+        text = json.dumps(result) if isinstance(result, dict) else str(result)
+        self.results[str(id)] = text
+        self.pending.append((str(id), text))
+
+        if len(self.pending) >= self.flush_every:
+            self.flush()
+
+    # Appends the results that haven't been written yet to the file, and makes sure they're really on disk
+    def flush(self):
+
+        if not self.pending:
+            return
+
+        with open(self.path, "a", newline="") as file:
+            csv.writer(file).writerows(self.pending)
+            file.flush()
+            os.fsync(file.fileno())
+
+        self.pending = []
+
+
+# Runs summary_func over df[source_column] like run_batch(), checkpointing the results as they come in, and then
+# writes df with the results to output
+# If measure is given ("v_mean" or "num_points"), the results are written as typed columns (h_mean, s_mean,
+# measure and status, see expand_results()) and output can also be a .parquet or .feather file. Otherwise the
+# whole result goes in result_column as text, like the collectors used to write it
+# For a multi-profile summary_func, measure is a dictionary {profile name: measure} (see profile_measures())
+# If the run is stopped and started again with the same settings, observations that already have a result in
+# the checkpoint are skipped. Observations whose result is an error are run again. id_column has to identify each
+# observation
+# checkpoint is the checkpoint file. By default it sits next to output and is named after the settings (see
+# checkpoint_path()), so changing a setting starts a new checkpoint instead of resuming the old one
+# It's kept after the run finishes. Delete it to redo the whole run
+# If telemetry is a path, summary_func is called with telemetry=True and must then return (result, record), like
+# image_summary() does. Each record is appended to that JSON lines file with the observation's id and source
+# (see color_cluster_kit/telemetry.py). If progress is True, a progress line with the rate and ETA is printed
+# If duplicate_distance is a number, every image is given a perceptual hash first, and of every group of images
+# within duplicate_distance bits of each other only the first one is clustered (see color_cluster_kit/duplicates.py).
+# The others get a copy of its result, and the id it was copied from in a "duplicate_of" column
+# duplicates can be given instead, as the ids from duplicate_ids() (worked out over the whole data file when df is
+# one shard of it). Every representative has to be in df
+# plan is optional and comes from plan_workers() (see color_cluster_kit/scheduler.py). Its processes and threads
+# are used instead of processes, and the throughput of the run is printed with it at the end (and appended to the
+# JSON lines file schedule_log, if given)
+# with_k is for a summary_func with auto_k, whose results end with the k each image was clustered with. With a
+# measure, that k gets a "k" column of its own (see expand_results())
+# Returns df with the new columns
+def run_checkpointed(summary_func, df, output, checkpoint=None, source_column="path", id_column="id",
+                     result_column="KMeansData", measure=None, flush_every=100, processes=None, telemetry=None,
+                     progress=True, duplicate_distance=None, plan=None, schedule_log=None, duplicates=None,
+                     with_k=False):
+
+    settings = run_settings(summary_func)
+    checkpoint = Checkpoint(checkpoint or checkpoint_path(output, settings), settings, flush_every)
+
+    threads = None
+    if plan is not None:
+        processes, threads = plan["processes"], plan["threads"]
+
+    ids = df[id_column].astype(str).tolist()
+    sources = df[source_column].tolist()
+
+    if duplicates is None and duplicate_distance is not None:
+        duplicates = duplicate_ids(df, duplicate_distance, source_column, id_column, processes)
+
+    # representatives[row] is the row whose result this row gets, which is the row itself unless it's a duplicate
+    if duplicates is None:
+        representatives = list(range(len(ids)))
+    else:
+        rows = {}
+        for row, id in enumerate(ids):
+            rows.setdefault(id, row)
+
+        representatives = []
+        for representative in duplicates.reindex(df.index).astype(str):
+            if representative not in rows:
+                raise ValueError("The representative " + representative + " of a duplicate isn't in the data. Work "
+                                 "the duplicates out before splitting the data into shards (see select_shard())")
+            representatives.append(rows[representative])
+
+        copies = sum(representative != row for row, representative in enumerate(representatives))
+        print("Duplicates: " + str(copies) + " of " + str(len(ids)) + " images are copies of another one and "
+              "won't be clustered")
+
+    unique = [row for row, representative in enumerate(representatives) if representative == row]
+    todo = [row for row in unique if ids[row] not in checkpoint.results]
+    done = [row for row in unique if ids[row] in checkpoint.results]
+    retried = [row for row in done if failed_result(checkpoint.results[ids[row]])]
+
+    if len(todo) < len(unique):
+        print("Resuming: " + str(len(done) - len(retried)) + " of " + str(len(unique)) +
+              " observations are already done" +
+              (", and " + str(len(retried)) + " that failed before will be run again" if retried else ""))
+
+    todo = sorted(todo + retried)
+
+    func = summary_func if telemetry is None else functools.partial(summary_func, telemetry=True)
+    log = TelemetryLog(telemetry) if telemetry is not None else None
+    meter = Progress(len(unique), skipped=len(unique) - len(todo)) if progress else None
+
+    start = time.perf_counter()
+    try:
+        for position, result in iter_batch(func, (sources[row] for row in todo), processes, threads=threads):
+            row = todo[position]
+
+            if log is not None:
+                result, record = split_result(result)
+                log.write({"id": ids[row], "source": str(sources[row]), "status": result_status(result), **record})
+
+            checkpoint.add(ids[row], result)
+
+            if meter is not None:
+                meter.update(failed=int(result_status(result) == STATUS_ERROR))
+    finally:
+        # Whatever happens, keep the results that came in since the last flush
+        checkpoint.flush()
+        if log is not None:
+            log.close()
+        if meter is not None:
+            meter.close()
+
+    if plan is not None:
+        log_throughput(plan, len(todo), time.perf_counter() - start, schedule_log)
+
+    results = [checkpoint.results[ids[representative]] for representative in representatives]
+
+    if measure is None:
+        df[result_column] = results
+    else:
+        values = expand_results(results, measure, with_k)
+        values.index = df.index
+        df = df.join(values)
+
+    if duplicates is not None:
+        df[DUPLICATE_COLUMN] = [ids[representative] if representative != row else None
+                                for row, representative in enumerate(representatives)]
+
+    write_results(df, output)
+
+    return df
@@ -0,0 +1,347 @@
+# The K-Means fit itself, with optional modes that fit on fewer pixels
+# The collectors only need the average color and pixel count of each cluster. The sample modes fit K-Means on a few
+# thousand pixels and then assign EVERY pixel to its nearest centroid, so the counts still cover the whole image.
+# The centroids aren't the same as a fit on every pixel would find, so the averages and counts change too (check
+# how much with drift_report()). Only the sample modes do less work: mini-batch K-Means still goes over every pixel
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+
+from color_cluster_kit.backends import assign_labels, kmeans_fit
+from color_cluster_kit.stats import cluster_stats
+from color_cluster_kit.telemetry import note
+
+# The clustering modes fit_clusters() understands
+# "full" fits K-Means on every pixel (the original behaviour)
+# "sample" fits on a random sample of sample_size pixels
+# "stratified" fits on a sample of sample_size pixels drawn evenly from coarse color cells, so small patches of
+# color (e.g. a few petals in a big green photo) are still represented in the sample
+# "minibatch" fits mini-batch K-Means on all of the pixels, batch_size pixels at a time. It isn't faster than "full":
+# on a 1 megapixel synthetic_flower() image (see color_cluster_kit/benchmark.py) and one core, "full" took 0.9 to 1.2
+# seconds, "minibatch" 1.2 to 4.7, "sample" 0.1 and "stratified" 0.35
+MODES = ("full", "sample", "stratified", "minibatch")
+
+
+# Raises a ValueError if mode isn't one of MODES, or if a sample mode would fit k clusters on fewer than k pixels
+# fit_clusters() checks this on every image. The Data Collectors also check it once before a run, so a wrong setting
+# stops the run straight away instead of failing every image with "An error occured"
+def check_mode(k, mode="full", sample_size=20000):
+
+    if mode not in MODES:
+        raise ValueError("mode must be one of " + ", ".join(MODES) + ", not " + repr(mode))
+
+    if mode in ("sample", "stratified") and sample_size < k:
+        raise ValueError("sample_size (" + str(sample_size) + ") must be at least k (" + str(k) + "), since K-Means "
+                         "can't find more clusters than there are pixels in the sample")
+
+
+# Returns the row numbers of a random sample of size rows out of n
+def random_sample(n, size, rng):
+
+    if size >= n:
+        return np.arange(n)
+
+    return np.sort(rng.choice(n, size, replace=False))
+
+
+# Returns the row numbers of a stratified sample of roughly size rows
+# Each feature's range is cut into bins equal-width bins, which splits the pixels into color cells. Every cell
+# gets its fair share of the sample (and at least one pixel), so rare colors aren't lost to random chance
+def stratified_sample(features, size, rng, bins=8):
+
+    n = len(features)
+    if size >= n:
+        return np.arange(n)
+
+    # Find the cell of every pixel
+    low = features.min(axis=0)
+    width = (features.max(axis=0) - low) / bins
+    width[width == 0] = 1
+    cell_index = np.minimum(((features - low) / width).astype(np.int64), bins - 1)
+    cells = np.ravel_multi_index(cell_index.T, (bins,) * features.shape[1])
+
+    # How many pixels each cell contributes
+    counts = np.bincount(cells)
+    quota = np.maximum(np.floor(counts * size / n), (counts > 0)).astype(np.int64)
+
+    # Shuffle, group by cell, and keep the first quota[cell] pixels of each cell
+    order = rng.permutation(n)
+    order = order[np.argsort(cells[order], kind="stable")]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    rank = np.arange(n) - starts[cells[order]]
+
+    return np.sort(order[rank < quota[cells[order]]])
+
+
+# Turns pixels (one row per pixel, H, S and V, e.g. image_hsv.reshape(-1, 3)) into the features K-Means is fit on
+# Each channel has its mean taken off and is divided by its standard deviation, exactly like StandardScaler does,
+# but without a DataFrame or any float64 copy of the image: the pixels are copied once into float32 and scaled in
+# place. For a 12 megapixel image that's 144 MB instead of the several hundred MB of the DataFrame and StandardScaler
+# Returns (features, mean, scale). (centers - mean) / scale puts HSV centers (e.g. from a codebook) in the same units
+def scale_features(pixels, chunk_size=1000000):
+
+    features = np.asarray(pixels).reshape(-1, 3).astype(np.float32)
+
+    # The mean and variance are added up in float64 so they stay exact on large images, chunk_size rows at a time
+    # so no float64 copy of the whole image is ever made
+    mean = features.mean(axis=0, dtype=np.float64)
+    features -= mean.astype(np.float32)
+
+    variance = np.zeros(3)
+    for i in range(0, len(features), chunk_size):
+        chunk = features[i:i + chunk_size]
+        variance += np.einsum("ij,ij->j", chunk, chunk, dtype=np.float64)
+    scale = np.sqrt(variance / max(len(features), 1))
+    scale[scale == 0] = 1
+
+    features /= scale.astype(np.float32)
+
+    return features, mean, scale
+
+
+# Runs K-Means on features (one row per pixel) and returns (labels, centers)
+# labels holds the cluster of every pixel, centers holds the k centroids in the same units as features
+# In every mode other than "full", the model is fit on a subset and then every pixel is assigned to its nearest
+# centroid, so labels still covers the whole image
+# random_state makes the sampling and the fit repeatable. None gives a different result every run, like KMeans()
+# init is optional and holds k centers to start from, in the same units as features (e.g. a codebook's centers, see
+# color_cluster_kit/codebook.py). The fit then starts once from them instead of from several random starts
+# backend picks the K-Means implementation the fit runs on ("sklearn", "minibatch" or "opencv", see
+# color_cluster_kit/backends.py). The mode "minibatch" is the same as the minibatch backend on every pixel
+def fit_clusters(features, k, mode="full", sample_size=20000, batch_size=4096, random_state=None, init=None,
+                 backend="sklearn"):
+
+    check_mode(k, mode, sample_size)
+
+    if mode == "minibatch":
+        mode, backend = "full", "minibatch"
+
+    if mode == "full":
+        labels, centers, iterations = kmeans_fit(features, k, backend, random_state, init, batch_size=batch_size)
+        note(kmeans_iterations=iterations)
+        return labels, centers
+
+    rng = np.random.default_rng(random_state)
+    if mode == "sample":
+        rows = random_sample(len(features), sample_size, rng)
+    else:
+        rows = stratified_sample(features, sample_size, rng)
+
+    _, centers, iterations = kmeans_fit(features[rows], k, backend, random_state, init, batch_size=batch_size)
+    note(kmeans_iterations=iterations)
+
+    # Assign every pixel to its nearest centroid
+    return assign_labels(features, centers), centers
+
+
+# The share of the pixel variance the chosen k has to explain by default (see choose_k())
+MIN_EXPLAINED = 0.9
+
+
+# Picks k for one image: the smallest of the candidates whose clusters explain at least min_explained of the
+# variance of the pixels (1 - the K-Means inertia / the total sum of squares). Simple images (a few flat colors)
+# get a small k, busy ones a larger k, and if no candidate is good enough the largest one is used
+# To keep this cheap, every candidate is fit on the same random sample of sample_size pixels, smallest k first,
+# and it stops at the first k that's good enough. Each fit also starts from the previous one: it keeps the
+# previous centers and adds new ones at pixels picked the way k-means++ picks them (the further a pixel is from
+# its nearest center, the more likely it's picked), so only one short K-Means run is needed per candidate
+# pixels is one row per pixel (H, S, V). They're scaled like StandardScaler does before fitting
+# Returns (k, centers, explained): the chosen k, its centers in HSV (a good place to start the fit on every pixel,
+# see the init argument of fit_clusters()) and a dictionary of the explained share of every candidate tried
+def choose_k(pixels, candidates, min_explained=MIN_EXPLAINED, sample_size=5000, random_state=None):
+
+    candidates = sorted(set(candidates))
+    if sample_size < candidates[-1]:
+        raise ValueError("sample_size (" + str(sample_size) + ") must be at least the largest candidate k (" +
+                         str(candidates[-1]) + ")")
+    rng = np.random.default_rng(random_state)
+
+    pixels = np.asarray(pixels).reshape(-1, 3)
+    sample = pixels[random_sample(len(pixels), sample_size, rng)].astype(float)
+
+    mean = sample.mean(axis=0)
+    scale = sample.std(axis=0)
+    scale[scale == 0] = 1
+    features = (sample - mean) / scale
+    total = ((features - features.mean(axis=0)) ** 2).sum()
+
+    explained = {}
+    kmeans = None
+    for k in candidates:
+        if kmeans is None:
+            kmeans = KMeans(n_clusters=min(k, len(features)), random_state=random_state)
+        else:
+            # The squared distance of every pixel to its nearest center so far
+            distance = kmeans.transform(features).min(axis=1) ** 2
+            extra = min(k - kmeans.n_clusters, np.count_nonzero(distance))
+            if extra == 0:
+                # Every pixel already sits on a center, so more clusters can't explain anything more
+                break
+            rows = rng.choice(len(features), size=extra, replace=False, p=distance / distance.sum())
+            init = np.vstack([kmeans.cluster_centers_, features[rows]])
+            kmeans = KMeans(n_clusters=len(init), init=init, n_init=1, random_state=random_state)
+
+        kmeans.fit(features)
+        explained[k] = float(1 - kmeans.inertia_ / total) if total > 0 else 1.0
+
+        if explained[k] >= min_explained:
+            break
+
+    chosen = kmeans.n_clusters
+    centers = kmeans.cluster_centers_ * scale + mean
+
+    return chosen, centers, explained
+
+
+# Pairs up the clusters of two fits of the same image and returns how far apart the paired cluster averages are
+# Cluster numbers are arbitrary (cluster 0 of one fit can be cluster 3 of another), so clusters are paired to
+# minimise the total distance between their average H, S and V values. Empty clusters are ignored
+# Returns the H, S and V distances averaged over the pairs, weighted by how many pixels each pair covers, so a
+# tiny cluster that was split differently doesn't drown out the clusters that make up most of the image
+def centroid_drift(stats_a, stats_b):
+
+    keep_a = stats_a["counts"] > 0
+    keep_b = stats_b["counts"] > 0
+    a = stats_a["means"][keep_a]
+    b = stats_b["means"][keep_b]
+
+    distance = np.linalg.norm(a[:, None, :] - b[None, :, :], axis=2)
+    rows, cols = linear_sum_assignment(distance)
+
+    weights = stats_a["counts"][keep_a][rows] + stats_b["counts"][keep_b][cols]
+
+    return np.average(np.abs(a[rows] - b[cols]), axis=0, weights=weights)
+
+
+# Checks how much a fast mode changes the results before trusting it on a whole dataset
+# summary_func is the collector's image_summary (usually wrapped in functools.partial with k and the bounds). It
+# has to accept the mode options as keyword arguments and return_stats=True, in which case it returns
+# (result, stats) where stats comes from cluster_stats()
+# A sample of n_images images is summarised twice, once with mode="full" and once with the fast options, e.g.
+# drift_report(partial(image_summary, k=5, lower_bound=lower_bound, upper_bound=upper_bound), df["path"], mode="sample")
+# Returns a dataframe with one row per image:
+# - "centroid_drift_h/s/v": how far the cluster averages moved in H, S and V (see centroid_drift())
+# - "output_drift_0/1/2": the change of each value the collector outputs (e.g. h_mean, s_mean, num_points)
+# - "status_changed": True when one fit found flowers and the other didn't (or one failed)
+# Keep in mind a full fit isn't exactly repeatable either, so pass a fixed random_state to compare like with like
+# read is an optional function that turns a source into something summary_func can read, e.g. fetch() to download
+# urls. Only the sampled images are read, once each
+def drift_report(summary_func, image_sources, n_images=20, random_state=0, read=None, **fast_options):
+
+    # imported here so the clustering code itself doesn't depend on pandas
+    import pandas as pd
+
+    image_sources = list(image_sources)
+    rng = np.random.default_rng(random_state)
+    picked = random_sample(len(image_sources), n_images, rng)
+
+    rows = []
+    for i in picked:
+        source = image_sources[i]
+        image = read(source) if read is not None else source
+        full, full_stats = summary_func(image, mode="full", random_state=random_state, return_stats=True)
+        fast, fast_stats = summary_func(image, random_state=random_state, return_stats=True, **fast_options)
+
+        row = {"image": source}
+
+        if full_stats is not None and fast_stats is not None:
+            drift = centroid_drift(full_stats, fast_stats)
+            for c, channel in enumerate("hsv"):
+                row["centroid_drift_" + channel] = drift[c]
+
+        numeric = isinstance(full, list) and isinstance(fast, list)
+        for j in range(3):
+            row["output_drift_" + str(j)] = abs(full[j] - fast[j]) if numeric else np.nan
+        row["status_changed"] = not numeric and full != fast
+
+        rows.append(row)
+
+    return pd.DataFrame(rows)
+
+
+# color_histogram() counts colors with a lookup table when there are at most this many possible colors
+# (quantize >= 2 always fits), and falls back to sorting for the full 180 x 256 x 256 color space
+HISTOGRAM_TABLE_SIZE = 2 ** 22
+
+
+# Collapses an image into its distinct colors
+# pixels is one row per pixel (H, S, V), e.g. image_hsv.reshape(-1, 3)
+# quantize rounds every channel down to a multiple of quantize first, so nearby colors share a bin. 1 keeps
+# every distinct color
+# Returns (colors, counts, inverse):
+# - colors: the average H, S and V of the real pixels in each bin, one row per bin
+# - counts: how many pixels fell in each bin
+# - inverse: the bin of every pixel, so colors[inverse] rebuilds the (binned) image
+def color_histogram(pixels, quantize=1):
+
+    pixels = np.asarray(pixels).reshape(-1, 3)
+    binned = pixels // quantize if quantize > 1 else pixels
+
+    # Pack the three channels into one number per pixel, so finding distinct colors means finding distinct numbers
+    dims = binned.max(axis=0).astype(np.int64) + 1
+    keys = np.ravel_multi_index(binned.T.astype(np.int64), dims)
+
+    if np.prod(dims) <= HISTOGRAM_TABLE_SIZE:
+        # Few enough possible colors to count them all in a table, which takes one pass instead of a sort
+        table = np.bincount(keys, minlength=np.prod(dims))
+        present = np.flatnonzero(table)
+        lookup = np.zeros(len(table), dtype=np.int64)
+        lookup[present] = np.arange(len(present))
+        inverse = lookup[keys]
+        counts = table[present]
+    else:
+        _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+
+    # The average real color of each bin (for quantize=1 this is just the color itself)
+    colors = np.empty((len(counts), 3))
+    for c in range(3):
+        colors[:, c] = np.bincount(inverse, weights=pixels[:, c], minlength=len(counts)) / counts
+
+    return colors, counts, inverse
+
+
+# Clusters an image through its color histogram instead of pixel by pixel
+# A photo has millions of pixels but usually only tens of thousands of distinct HSV colors (far fewer once they
+# are quantized), so K-Means is run on the distinct colors with each one weighted by its pixel count
+# Returns the same stats as cluster_stats(), and with return_labels=True also the cluster of every pixel (only
+# needed for masks, as in the Visualizer)
+# How close this gets to clustering every pixel:
+# - quantize=1 clusters exactly the same points (a color that appears n times is one point of weight n)
+# - quantize=q moves each pixel by less than q in each channel for the fit only. The averages are still taken over
+#   the real pixel values, so only pixels near the edge of a cluster can end up on a different side
+# quantize does change the results. Started from the same centers (init), on the synthetic_flower() images of
+# color_cluster_kit/benchmark.py (600 x 800 pixels, k=5) the cluster averages moved by at most 0.05 units of H, S
+# or V and 0.05% of the pixels changed cluster with quantize=2, 0.5 units and 0.6% with 4, and 1.3 units and 1% with
+# 8 (tests/test_clustering.py checks bounds like these). Without init, the fit starts from other random centers
+# than the per-pixel fit would and can settle on other clusters altogether. On the same images, two per-pixel fits
+# with different random_state values already differed by 14 to 27 units and 10 to 22% of the pixels, and quantize=4
+# differed from the per-pixel fit with the same random_state by up to 38 units and 35%. Check a dataset with
+# drift_report(..., quantize=q) before switching it over
+# init is optional and holds k centers in HSV to start the fit from (e.g. a codebook's centers), as in fit_clusters()
+# backend picks the K-Means implementation, as in fit_clusters(). The opencv backend can't weight the colors, so it
+# can't be used here
+def cluster_color_histogram(pixels, k, quantize=1, random_state=None, return_labels=False, init=None,
+                            backend="sklearn"):
+
+    colors, counts, inverse = color_histogram(pixels, quantize)
+
+    # Scale the colors the same way StandardScaler scales the pixels, by weighting each color by its count
+    scaler = StandardScaler()
+    features = scaler.fit_transform(colors, sample_weight=counts)
+
+    # An image can have fewer distinct colors than k. The extra clusters are simply left empty (and the starting
+    # centers can't be used, since there are more of them than colors)
+    start = None
+    if init is not None and len(colors) >= k:
+        start = scaler.transform(np.asarray(init, dtype=float))
+    labels, _, iterations = kmeans_fit(features, min(k, len(colors)), backend, random_state, start,
+                                       sample_weight=counts)
+    note(kmeans_iterations=iterations, distinct_colors=len(colors))
+
+    stats = cluster_stats(labels, colors, k, weights=counts)
+
+    if return_labels:
+        return stats, labels[inverse]
+    return stats
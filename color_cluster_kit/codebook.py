@@ -0,0 +1,164 @@
+# A color codebook fitted once for a whole dataset, instead of a K-Means fit from scratch for every image
+# The photos of one species share much the same palette (the same flowers, leaves and soil), so the clusters of one
+# image are very close to the clusters of the next. A codebook is k cluster centers fitted once on a sample of
+# pixels drawn from many images of the dataset. It can then be used in two ways:
+# - assign: every pixel of an image just goes to its nearest codebook center, with no K-Means fit at all. The
+#   per-cluster stats are still worked out from the image's own pixels, so the bounds are applied exactly as before
+# - warm start: each image still gets its own K-Means fit, but starting from the codebook centers instead of
+#   random ones, so it only has to adjust them a little (one start instead of several, and fewer iterations)
+# The codebook is saved to a .npz file, so reruns (e.g. with new bounds) reuse it instead of fitting it again
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import pairwise_distances_argmin
+
+from color_cluster_kit.clustering import color_histogram
+from color_cluster_kit.images import MAX_PIXELS, load_image
+from color_cluster_kit.stats import cluster_stats
+
+# Loaded codebooks, one per file per process (see open_codebook())
+_open_codebooks = {}
+
+
+# k cluster centers in HSV, and the scaling they were fitted with
+# Like in the Data Collectors, H, S and V are put on the same scale before measuring distances (each channel has
+# its mean taken off and is divided by its standard deviation). The mean and scale come from the whole sample,
+# so every image is measured with the same ruler
+class Codebook:
+
+    def __init__(self, centers, mean, scale, settings=None):
+
+        self.centers = np.asarray(centers, dtype=float)
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+        self.settings = dict(settings or {})
+
+    @property
+    def k(self):
+        return len(self.centers)
+
+    # A short code that changes whenever the centers or the scaling change (used in cache keys)
+    def fingerprint(self):
+
+        digest = hashlib.blake2b(digest_size=8)
+        for array in (self.centers, self.mean, self.scale):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    # Returns the nearest codebook center of every pixel (one row per pixel, H, S and V)
+    def assign(self, pixels):
+
+        scaled = (np.asarray(pixels, dtype=np.float32) - self.mean) / self.scale
+        return pairwise_distances_argmin(scaled, ((self.centers - self.mean) / self.scale).astype(np.float32))
+
+    # Returns the per-cluster stats of an image (see cluster_stats()), with every pixel in the cluster of its
+    # nearest codebook center
+    # Each distinct color only has to be assigned once, so this works through the image's color histogram. The
+    # counts and averages are exactly the same as assigning every pixel
+    # With return_labels=True the cluster of every pixel is returned too
+    def cluster(self, pixels, return_labels=False):
+
+        colors, counts, inverse = color_histogram(pixels)
+        labels = self.assign(colors)
+        stats = cluster_stats(labels, colors, self.k, weights=counts)
+
+        if return_labels:
+            return stats, labels[inverse]
+        return stats
+
+    def save(self, path):
+
+        # Write to a temporary file first, so a crash never leaves half a codebook behind
+        # (np.savez adds .npz to names that don't end in it, so the temporary name ends in .npz too)
+        temporary = path + ".part.npz"
+        np.savez(temporary, centers=self.centers, mean=self.mean, scale=self.scale,
+                 settings=json.dumps(self.settings, sort_keys=True, default=str))
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+
+        with np.load(path) as data:
+            return cls(data["centers"], data["mean"], data["scale"], json.loads(str(data["settings"])))
+
+
+# Loads images and draws up to pixels_per_image random pixels (in HSV) from each of them
+# sources are image paths or downloaded bytes. read is an optional function that turns a source into something
+# load_image() can read, e.g. fetch() to download urls. Images that can't be read are skipped
+def sample_pixels(sources, pixels_per_image=2000, max_pixels=MAX_PIXELS, random_state=0, read=None):
+
+    rng = np.random.default_rng(random_state)
+    samples = []
+
+    for source in sources:
+        try:
+            image = load_image(read(source) if read is not None else source, max_pixels)
+        except Exception:
+            image = None
+        if image is None:
+            continue
+
+        pixels = cv2.cvtColor(image, cv2.COLOR_BGR2HSV).reshape(-1, 3)
+        rows = rng.choice(len(pixels), size=min(pixels_per_image, len(pixels)), replace=False)
+        samples.append(pixels[rows])
+
+    if not samples:
+        raise ValueError("None of the images could be read, so there are no pixels to fit a codebook on")
+
+    return np.concatenate(samples)
+
+
+# Fits a codebook of k centers on pixels sampled from n_images of the sources, picked at random (all of them when
+# there are fewer). The other arguments go to sample_pixels()
+def fit_codebook(sources, k, n_images=200, pixels_per_image=2000, max_pixels=MAX_PIXELS, random_state=0, read=None):
+
+    sources = list(sources)
+    rng = np.random.default_rng(random_state)
+    if len(sources) > n_images:
+        sources = [sources[i] for i in sorted(rng.choice(len(sources), size=n_images, replace=False))]
+
+    pixels = sample_pixels(sources, pixels_per_image, max_pixels, random_state, read).astype(float)
+
+    # The same scaling as StandardScaler, over the whole sample
+    mean = pixels.mean(axis=0)
+    scale = pixels.std(axis=0)
+    scale[scale == 0] = 1
+
+    kmeans = KMeans(n_clusters=k, random_state=random_state)
+    kmeans.fit((pixels - mean) / scale)
+
+    settings = {"k": k, "n_images": len(sources), "pixels_per_image": pixels_per_image, "max_pixels": max_pixels,
+                "random_state": random_state}
+
+    return Codebook(kmeans.cluster_centers_ * scale + mean, mean, scale, settings)
+
+
+# Returns the codebook saved at path, loading each file only once per process (the workers call this for every
+# image). Raises ValueError if the saved codebook doesn't have k centers
+def open_codebook(path, k=None):
+
+    key = (os.path.abspath(path), os.path.getmtime(path), os.getpid())
+    if key not in _open_codebooks:
+        _open_codebooks[key] = Codebook.load(path)
+
+    codebook = _open_codebooks[key]
+    if k is not None and codebook.k != k:
+        raise ValueError(path + " has " + str(codebook.k) + " clusters but k is " + str(k) + ". Delete it (or "
+                         "use another file name) to fit a new codebook")
+
+    return codebook
+
+
+# Returns the codebook saved at path, fitting it on sources and saving it there first if the file doesn't exist
+# yet. Any other keyword arguments go to fit_codebook()
+# Delete the file to fit a new codebook (e.g. for a new dataset)
+def ensure_codebook(path, sources, k, **options):
+
+    if not os.path.exists(path):
+        fit_codebook(sources, k, **options).save(path)
+
+    return open_codebook(path, k)
@@ -0,0 +1,239 @@
+# Downloads observation images many at a time
+# Downloading is mostly waiting on the network, so a pool of threads keeps many requests in flight at once.
+# Each thread keeps its connection to each host open between images (instead of opening a new one per image like
+# urllib.request.urlretrieve), failed requests are retried with a growing pause in between, and every image
+# that still fails is written to a manifest with the reason, instead of silently disappearing
+# Proxies are honored the same way urlretrieve honors them (see _proxy())
+import base64
+import csv
+import http.client
+import os
+import random
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote, urljoin, urlsplit
+
+from color_cluster_kit.telemetry import Progress
+
+# HTTP status codes that usually mean "try again later" rather than "this image doesn't exist"
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# How many redirects to follow before giving up on a URL
+MAX_REDIRECTS = 5
+
+# Some image hosts refuse requests without a user agent
+HEADERS = {"User-Agent": "Color-Cluster-Kit", "Accept": "image/*"}
+
+# Every thread keeps its own open connections, one per host
+_local = threading.local()
+
+
+# Raised when an image can't be downloaded. The message is the reason that ends up in the failure manifest
+class DownloadError(Exception):
+    pass
+
+
+# Returns the proxy that requests to a host go through, as (proxy host, headers for the proxy), or None to connect
+# to the host directly
+# The proxies are read with urllib.request.getproxies(), the same as urlretrieve does: the HTTP_PROXY and
+# HTTPS_PROXY environment variables (or the system's proxy settings on Windows and macOS), and NO_PROXY lists the
+# hosts that skip the proxy. A user name and password in the proxy's URL are sent to it as Proxy-Authorization
+def _proxy(scheme, host):
+
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+
+    parts = urlsplit(proxy if "://" in proxy else "http://" + proxy)
+    headers = {}
+    if parts.username is not None:
+        credentials = unquote(parts.username) + ":" + unquote(parts.password or "")
+        headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode("ascii")
+
+    return parts.netloc.rpartition("@")[2], headers
+
+
+# Returns this thread's open connection to the host of a URL, opening one if there isn't one yet, as
+# (connection, proxy headers)
+# Behind a proxy, the connection goes to the proxy instead. An https connection asks the proxy for a tunnel to the
+# host (CONNECT), so the request itself is the same as without a proxy. A plain http request is sent to the proxy
+# with the full URL and the proxy headers, which is what the proxy headers returned here are for (None otherwise)
+def _connection(scheme, host, timeout):
+
+    if not hasattr(_local, "connections"):
+        _local.connections = {}
+
+    key = (scheme, host)
+    if key not in _local.connections:
+        proxy = _proxy(scheme, host) if scheme in ("http", "https") else None
+
+        if scheme == "https":
+            connection = http.client.HTTPSConnection(proxy[0] if proxy else host, timeout=timeout)
+            if proxy:
+                connection.set_tunnel(host, headers=proxy[1])
+            _local.connections[key] = connection, None
+        elif scheme == "http":
+            connection = http.client.HTTPConnection(proxy[0] if proxy else host, timeout=timeout)
+            _local.connections[key] = connection, proxy[1] if proxy else None
+        else:
+            raise DownloadError("unsupported URL scheme " + repr(scheme))
+
+    return _local.connections[key]
+
+
+# Closes and forgets this thread's connection to a host, so the next request opens a fresh one
+def _drop_connection(scheme, host):
+
+    connection, _ = _local.connections.pop((scheme, host), (None, None))
+    if connection is not None:
+        connection.close()
+
+
+# Sends a single GET request and returns (status, headers, body)
+# A connection that was left open can be closed by the server while it sits idle. If a reused connection fails,
+# the request is sent once more on a fresh connection before it counts as a failure
+def _get(url, timeout):
+
+    parts = urlsplit(url)
+    path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+
+    for fresh in (False, True):
+        if fresh:
+            _drop_connection(parts.scheme, parts.netloc)
+
+        connection, proxy_headers = _connection(parts.scheme, parts.netloc, timeout)
+        reused = connection.sock is not None
+
+        try:
+            if proxy_headers is None:
+                connection.request("GET", path, headers=HEADERS)
+            else:
+                connection.request("GET", url.split("#")[0], headers={**HEADERS, **proxy_headers})
+            response = connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            _drop_connection(parts.scheme, parts.netloc)
+            if reused and not fresh:
+                continue
+            raise
+
+        if response.will_close:
+            _drop_connection(parts.scheme, parts.netloc)
+
+        return response.status, response.headers, body
+
+
+# Downloads a URL and returns its contents as bytes, following redirects
+# Connection errors and "try again later" statuses are retried up to retries times. The pause before retry n is
+# backoff * 2^n seconds, give or take a little randomness so many threads don't all retry at the same moment
+# Raises DownloadError with the reason if the image can't be downloaded
+def fetch(url, retries=3, backoff=0.5, timeout=30):
+
+    for attempt in range(retries + 1):
+        try:
+            target = url
+            for _ in range(MAX_REDIRECTS + 1):
+                status, headers, body = _get(target, timeout)
+                if status not in (301, 302, 303, 307, 308) or not headers.get("Location"):
+                    break
+                target = urljoin(target, headers["Location"])
+
+            if status == 200:
+                return body
+
+            reason = "HTTP " + str(status)
+            retry = status in RETRY_STATUSES
+
+        except DownloadError:
+            raise
+        except (OSError, http.client.HTTPException) as error:
+            reason = type(error).__name__ + ": " + str(error)
+            retry = True
+
+        if not retry or attempt == retries:
+            raise DownloadError(reason)
+
+        time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+# Saves downloaded bytes to path. The file is written under a temporary name first and renamed once complete,
+# so an interrupted download never leaves a half-written image behind
+def save_file(body, path):
+
+    with open(path + ".part", "wb") as file:
+        file.write(body)
+    os.replace(path + ".part", path)
+
+
+# Downloads one image, saves it to path if one is given, and returns its bytes
+def download_image(url, path=None, retries=3, backoff=0.5, timeout=30):
+
+    if not isinstance(url, str) or not url:
+        raise DownloadError("missing url")
+
+    body = fetch(url, retries, backoff, timeout)
+
+    if path is not None:
+        save_file(body, path)
+
+    return body
+
+
+# Turns an error raised while downloading into the reason written to the failure manifest
+def failure_reason(error):
+
+    if isinstance(error, DownloadError):
+        return str(error)
+    return type(error).__name__ + ": " + str(error)
+
+
+# Writes the failure manifest, a csv file with the id, url and reason of every image that failed
+def write_manifest(failures, path):
+
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "image_url", "reason"])
+        writer.writerows(failures)
+
+
+# Downloads every image to dest, saved as <id>.jpg, and returns a list of (id, url, reason) for the ones that failed
+# ids and urls are lists (or dataframe columns) of the same length
+# workers is the most downloads in progress at once. Image hosts tend to slow down or refuse clients that open
+# too many connections, so a few dozen is usually plenty
+# If manifest is a path, the failures are also written there as a csv file
+# Images that already exist in dest are skipped, so an interrupted run can just be started again
+def download_images(ids, urls, dest, workers=16, retries=3, backoff=0.5, timeout=30, manifest=None, progress=True):
+
+    os.makedirs(dest, exist_ok=True)
+    jobs = [(i, u, os.path.join(dest, str(i) + ".jpg")) for i, u in zip(ids, urls)]
+    todo = [job for job in jobs if not os.path.exists(job[2])]
+
+    failures = []
+    meter = Progress(len(jobs), skipped=len(jobs) - len(todo)) if progress else None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(download_image, u, path, retries, backoff, timeout): (i, u) for i, u, path in todo}
+
+        for future in as_completed(futures):
+            i, u = futures[future]
+            failed = 0
+            try:
+                future.result()
+            except Exception as error:
+                # Any error only costs its own image, e.g. an OSError from a destination folder that isn't writable
+                # or a ValueError from a malformed url, and the rest of the run (and the manifest) carries on
+                failures.append((i, u, failure_reason(error)))
+                failed = 1
+
+            if meter is not None:
+                meter.update(failed=failed)
+
+    if meter is not None:
+        meter.close()
+
+    if manifest is not None:
+        write_manifest(failures, manifest)
+
+    return failures
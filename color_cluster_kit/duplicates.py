@@ -0,0 +1,108 @@
+# Finding duplicate and near-duplicate images, so each one is only clustered once
+# Observation exports are full of re-uploads and near-identical photos of the same plant, and every one of them pays
+# for a full K-Means fit. A perceptual hash boils an image down to 64 bits that barely change when the image is
+# re-encoded, resized or slightly edited: the image is shrunk to 9 x 8 gray pixels and every bit says whether a pixel
+# is brighter than its right neighbour (a "difference hash"). Two images are near-duplicates when their hashes differ
+# in at most max_distance bits (the Hamming distance). 0 only matches images that look exactly the same; 4 to 6 also
+# matches re-encoded and resized copies. Hashing an image takes a few milliseconds, against seconds for clustering it
+import functools
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from color_cluster_kit.batch import run_batch
+from color_cluster_kit.images import jpeg_size
+
+# The default Hamming distance for near-duplicates
+MAX_DISTANCE = 4
+
+# The hash is HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+
+# The output column that says which observation a duplicate's result was copied from (empty for the rest)
+DUPLICATE_COLUMN = "duplicate_of"
+
+
+# Returns the difference hash of an image as a number (of hash_size x hash_size bits), or None if the image can't be
+# read. source is a path to an image file or the raw bytes of an encoded image, like in load_image()
+def image_hash(source, hash_size=HASH_SIZE):
+
+    try:
+        data = source if isinstance(source, (bytes, bytearray, memoryview)) else np.fromfile(source, dtype=np.uint8)
+    except OSError:
+        return None
+
+    # The hash only needs a tiny gray image, so JPEGs are decoded at 1/8 of their size, which is much faster. Other
+    # formats are decoded at full size, because their reduced decoding skips pixels instead of averaging them
+    flag = cv2.IMREAD_GRAYSCALE if jpeg_size(data) is None else cv2.IMREAD_REDUCED_GRAYSCALE_8
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if image is None:
+        return None
+
+    # cv2.resize() takes the new size as (width, height)
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+# Returns the hash of every image in sources (None for images that can't be read), hashed in several processes
+def hash_images(sources, hash_size=HASH_SIZE, processes=None):
+
+    return run_batch(functools.partial(image_hash, hash_size=hash_size), sources, processes, error_value=None)
+
+
+# Groups the hashes and returns, for every position, the position of its group's representative (itself if it is
+# one). The representative is the first image of its group, and every other image in the group is within
+# max_distance bits of it. Images without a hash (None) are never grouped
+# Comparing every image with every other one would take forever on a big data set. Instead, the bits are split into
+# max_distance + 1 bands: two hashes that differ in at most max_distance bits must match exactly in at least one
+# band, so only the representatives that share a band with an image are compared with it
+def find_duplicates(hashes, max_distance=MAX_DISTANCE, bits=HASH_SIZE * HASH_SIZE):
+
+    bands = max_distance + 1
+    width = -(-bits // bands)
+    mask = (1 << width) - 1
+
+    # For every band, {the value of that band: the representatives that have it}
+    tables = [{} for _ in range(bands)]
+    representatives = []
+
+    for position, value in enumerate(hashes):
+        if value is None:
+            representatives.append(position)
+            continue
+
+        keys = [value >> (band * width) & mask for band in range(bands)]
+        candidates = set()
+        for table, key in zip(tables, keys):
+            candidates.update(table.get(key, ()))
+
+        matches = [candidate for candidate in candidates if bin(hashes[candidate] ^ value).count("1") <= max_distance]
+        if matches:
+            representatives.append(min(matches))
+        else:
+            representatives.append(position)
+            for table, key in zip(tables, keys):
+                table.setdefault(key, []).append(position)
+
+    return representatives
+
+
+# Hashes every image in sources and returns the position of each one's representative (see find_duplicates())
+def duplicate_groups(sources, max_distance=MAX_DISTANCE, processes=None):
+
+    return find_duplicates(hash_images(sources, processes=processes), max_distance)
+
+
+# Returns the id of every row's representative (its own id for the rows that aren't a copy of an earlier one), as a
+# series with the same index as df, hashing the images in df[source_column]
+# Worked out over the whole data file before it's split into shards (see select_shard()), every machine finds the
+# same groups, and a group never ends up split between two shards
+def duplicate_ids(df, max_distance=MAX_DISTANCE, source_column="path", id_column="id", processes=None):
+
+    ids = df[id_column].astype(str).tolist()
+    representatives = duplicate_groups(df[source_column].tolist(), max_distance, processes)
+
+    return pd.Series([ids[representative] for representative in representatives], index=df.index)
@@ -0,0 +1,149 @@
+# Builds a paginated HTML gallery to review the Visualizer's output for many images at once
+# The single image Visualizer writes one html file and opens one browser tab per image. For a few thousand
+# observations that's a few thousand tabs, so instead every image gets a card on a page of per_page images, with
+# links to the previous and next pages. The pictures are small thumbnails that the browser only loads when they
+# are scrolled into view (loading="lazy"), so even a long page opens quickly
+import html
+import math
+import os
+import re
+
+import cv2
+
+# The largest width, in pixels, of the thumbnails
+THUMBNAIL_WIDTH = 320
+
+
+# Turns an image name (an id, a file name, ...) into a name that's safe to use for a folder on any system
+def safe_name(name):
+
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", str(name)).strip("._")
+    return name or "image"
+
+
+# Gives every image its own folder name. Names that come up more than once get a number added to the end, so no
+# image overwrites another image's pictures
+def image_folders(names):
+
+    folders = []
+    seen = {}
+    for name in names:
+        folder = safe_name(name)
+        if folder in seen:
+            seen[folder] += 1
+            folder = folder + "_" + str(seen[folder])
+        else:
+            seen[folder] = 1
+        folders.append(folder)
+
+    return folders
+
+
+# Shrinks an image so it's at most width pixels wide, keeping its proportions. Smaller images are left alone
+def thumbnail(image, width=THUMBNAIL_WIDTH):
+
+    if not width or image.shape[1] <= width:
+        return image
+
+    height = max(1, round(image.shape[0] * width / image.shape[1]))
+    return cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+
+# The file name of each page. The first page is index.html, so the gallery folder opens on it
+def page_name(page):
+
+    return "index.html" if page == 1 else "page_" + str(page) + ".html"
+
+
+# Returns the html of one image's card
+# entry is a dictionary with:
+#   "name": the name shown on the card
+#   "image": the path of the image's thumbnail, relative to the gallery folder (or None)
+#   "details": a list of lines of text shown under the name (e.g. the collector's results)
+#   "clusters": a list of dictionaries with the "label", "hsv" values, "rgb" swatch color and cluster "image"
+#   "error": an error message, for images that couldn't be summarized
+def _card(entry):
+
+    lines = ['<div class="card">', "<h3>" + html.escape(str(entry["name"])) + "</h3>"]
+
+    for detail in entry.get("details", []):
+        lines.append("<p>" + html.escape(str(detail)) + "</p>")
+
+    if entry.get("error"):
+        lines.append('<p class="error">' + html.escape(str(entry["error"])) + "</p>")
+
+    if entry.get("image"):
+        lines.append('<img loading="lazy" src="' + html.escape(entry["image"]) + '">')
+
+    if entry.get("clusters"):
+        lines.append('<div class="clusters">')
+        for cluster in entry["clusters"]:
+            h, s, v = cluster["hsv"]
+            r, g, b = cluster["rgb"]
+            lines.append('<div class="cluster">')
+            lines.append("<p>" + html.escape(cluster["label"]) + "<br>H %.1f S %.1f V %.1f</p>" % (h, s, v))
+            lines.append('<div class="swatch" style="background-color:rgb(%d,%d,%d)"></div>' % (r, g, b))
+            lines.append('<img loading="lazy" src="' + html.escape(cluster["image"]) + '">')
+            lines.append("</div>")
+        lines.append("</div>")
+
+    lines.append("</div>")
+    return "\n".join(lines)
+
+
+# Links to the previous and next pages, plus the page number
+def _navigation(page, pages):
+
+    links = []
+    if page > 1:
+        links.append('<a href="' + page_name(page - 1) + '">&larr; Previous</a>')
+    links.append("Page %d of %d" % (page, pages))
+    if page < pages:
+        links.append('<a href="' + page_name(page + 1) + '">Next &rarr;</a>')
+
+    return '<p class="nav">' + " | ".join(links) + "</p>"
+
+
+STYLE = """
+        body { font-family: sans-serif; }
+        .card { border-bottom: 1px solid #ccc; padding: 10px 0; }
+        .card img { max-width: %dpx; }
+        .clusters { display: flex; flex-wrap: wrap; gap: 10px; }
+        .cluster img { max-width: 160px; }
+        .swatch { height: 30px; width: 30px; }
+        .error { color: #b00; }
+"""
+
+
+# Writes the gallery pages into the dest folder and returns the path of the first page
+# entries is a list of dictionaries as described in _card(). Image paths in them are relative to dest
+def write_gallery(entries, dest, title="Image Summary", per_page=50, thumbnail_width=THUMBNAIL_WIDTH):
+
+    os.makedirs(dest, exist_ok=True)
+    pages = max(1, math.ceil(len(entries) / per_page))
+
+    for page in range(1, pages + 1):
+        cards = [_card(entry) for entry in entries[(page - 1) * per_page:page * per_page]]
+        navigation = _navigation(page, pages)
+
+        document = "\n".join([
+            "<!DOCTYPE html>",
+            "<html>",
+            "<head>",
+            '<meta charset="utf-8">',
+            "<title>" + html.escape(title) + "</title>",
+            "<style>" + STYLE % thumbnail_width + "</style>",
+            "</head>",
+            "<body>",
+            "<h1>" + html.escape(title) + "</h1>",
+            navigation,
+            "\n".join(cards),
+            navigation,
+            "</body>",
+            "</html>",
+        ])
+
+        with open(os.path.join(dest, page_name(page)), "w", encoding="utf-8") as file:
+            file.write(document)
+
+    return os.path.join(dest, page_name(1))
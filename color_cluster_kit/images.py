@@ -0,0 +1,133 @@
+# Loading images from wherever they come from, shrunk to a pixel budget
+# Clustering time grows with the number of pixels, and a 12 megapixel photo doesn't give noticeably different
+# cluster colors than the same photo at 1 megapixel. So images are shrunk to at most max_pixels pixels as they are
+# loaded. JPEG files can be decoded straight at 1/2, 1/4 or 1/8 of their size (cv2.IMREAD_REDUCED_COLOR_*), which
+# skips most of the decoding work, so a large JPEG is never decoded at full size. Whatever is left over is shrunk
+# with area interpolation, which averages the pixels that get merged instead of skipping some of them
+# max_pixels is an upper limit. An image decoded at a reduced size with between half of max_pixels and max_pixels
+# pixels is used as it is, because shrinking it the rest of the way costs about as much as the reduced decode saves
+# The Data Collectors and the Visualizer all load images through load_image(), so they follow the same policy
+import math
+
+import cv2
+import numpy as np
+
+from color_cluster_kit.telemetry import lap, note
+
+# The default pixel budget, about 1000 x 1000 pixels
+MAX_PIXELS = 1000000
+
+# The reduced decoding flags, largest reduction first
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# The JPEG markers that start a frame header, which holds the image size (every SOF marker from 0xC0 to 0xCF except
+# 0xC4, 0xC8 and 0xCC, which mean other things)
+_FRAME_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+# Returns the (height, width) of a JPEG image from its header, without decoding it
+# Returns None if data isn't a JPEG or the header can't be read
+def jpeg_size(data):
+
+    data = memoryview(data).cast("B")
+    if bytes(data[:2]) != b"\xff\xd8":
+        return None
+
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+
+        # Padding, and markers that have no length after them
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            i += 2
+            continue
+
+        if marker in _FRAME_MARKERS:
+            height = data[i + 5] << 8 | data[i + 6]
+            width = data[i + 7] << 8 | data[i + 8]
+            return (height, width) if height and width else None
+
+        i += 2 + (data[i + 2] << 8 | data[i + 3])
+
+    return None
+
+
+# Returns the reduced decoding flag for an image of the given size: the biggest reduction that still leaves at
+# least half of max_pixels pixels, so the image is never made bigger again afterwards
+def reduced_flag(height, width, max_pixels):
+
+    if max_pixels:
+        for scale, flag in REDUCED_FLAGS:
+            if math.ceil(height / scale) * math.ceil(width / scale) >= max_pixels / 2:
+                return flag
+
+    return cv2.IMREAD_COLOR
+
+
+# Shrinks an image to at most max_pixels pixels, keeping its proportions. Smaller images (or max_pixels None) are
+# returned as they are
+def fit_to_budget(image, max_pixels=MAX_PIXELS):
+
+    height, width = image.shape[:2]
+    if not max_pixels or height * width <= max_pixels:
+        return image
+
+    scale = math.sqrt(max_pixels / (height * width))
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    # cv2.resize() takes the new size as (width, height)
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+# Decodes an encoded image (e.g. the bytes of a JPEG), at a reduced size when that's possible for its format
+# and it's larger than max_pixels. The result can still be larger than max_pixels; fit_to_budget() finishes the job
+# Returns None if the bytes can't be decoded
+def decode_image(data, max_pixels=MAX_PIXELS):
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    size = jpeg_size(data)
+
+    # Not a JPEG, so decode it at full size
+    if size is None:
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+        if image is not None:
+            note(height=image.shape[0], width=image.shape[1])
+        return image
+
+    note(height=size[0], width=size[1])
+    return cv2.imdecode(buffer, reduced_flag(size[0], size[1], max_pixels))
+
+
+# Returns the image as a BGR array, the same thing cv2.imread() gives, shrunk to at most max_pixels pixels
+# (None keeps the full size)
+# source can be a path to an image file, the raw bytes of an encoded image (e.g. a JPEG straight from a download,
+# so it never has to be written to disk) or an image that's already been decoded
+# Like cv2.imread(), None is returned if the image can't be read
+def load_image(source, max_pixels=MAX_PIXELS):
+
+    if isinstance(source, np.ndarray):
+        image = source
+        note(height=image.shape[0], width=image.shape[1])
+    else:
+        if not isinstance(source, (bytes, bytearray, memoryview)):
+            # Reading the file ourselves also works for paths with non-English characters on Windows, which
+            # cv2.imread() can't open
+            try:
+                source = np.fromfile(source, dtype=np.uint8)
+            except OSError:
+                return None
+
+        image = decode_image(source, max_pixels)
+        if image is None:
+            return None
+        lap("decode")
+
+    image = fit_to_budget(image, max_pixels)
+    lap("resize")
+
+    return image
@@ -0,0 +1,74 @@
+# A memory budget for each worker process, so more of them fit on one machine side by side
+# Without one, the number of processes is just the number of cores, and a machine with many cores but not much
+# memory runs out of it on large images. With a budget of memory_mb per worker, images are shrunk so that
+# clustering one of them stays within the budget, and no more processes are started than fit in the free memory
+# The estimate is deliberately simple: a worker needs about WORKER_MB for python and its libraries, plus about
+# BYTES_PER_PIXEL for every pixel it clusters (the decoded image, its HSV copy, the float32 features and what
+# K-Means needs on top of them). The telemetry's "peak_memory_mb" shows what images really used
+import os
+
+# What a worker process uses before it loads any image (python, numpy, pandas, OpenCV and scikit-learn)
+WORKER_MB = 250
+
+# Bytes needed per clustered pixel on top of WORKER_MB. A full K-Means fit measured 50 to 60 bytes per pixel for k
+# from 5 to 15, and the rest is room to spare for larger k
+BYTES_PER_PIXEL = 80
+
+
+# Returns the number of pixels one worker can cluster within memory_mb megabytes
+def pixels_for_memory(memory_mb):
+
+    if memory_mb <= WORKER_MB:
+        raise ValueError("A worker needs more than " + str(WORKER_MB) + " MB, so the memory budget can't be "
+                         + str(memory_mb) + " MB")
+
+    return int((memory_mb - WORKER_MB) * 1024 ** 2 / BYTES_PER_PIXEL)
+
+
+# Returns the pixel budget that fits both max_pixels (None means no limit) and a memory budget of memory_mb
+# megabytes per worker (None means no memory budget)
+def fit_pixel_budget(max_pixels, memory_mb):
+
+    if not memory_mb:
+        return max_pixels
+
+    budget = pixels_for_memory(memory_mb)
+    return budget if not max_pixels else min(max_pixels, budget)
+
+
+# Returns how many megabytes of memory the machine has available right now, or None if it can't be found out
+# The psutil package works everywhere (pip install psutil). Without it, Linux and macOS can still be asked directly
+def available_memory_mb():
+
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 1024 ** 2
+    except ImportError:
+        pass
+
+    # Linux counts memory it can free right away (e.g. file caches) as available too
+    try:
+        with open("/proc/meminfo") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+# Returns the number of worker processes to run with a budget of memory_mb megabytes each: as many as fit in the
+# available memory, but no more than processes (None means one per core) and at least one
+# Without a budget, or when the available memory can't be found out, processes is returned as it is
+def processes_for_memory(memory_mb, processes=None):
+
+    available = available_memory_mb() if memory_mb else None
+    if available is None:
+        return processes
+
+    cores = processes or os.cpu_count() or 1
+    return max(1, min(cores, int(available // memory_mb)))
@@ -0,0 +1,170 @@
+# Streams images from their URLs straight into image_summary, without writing them to disk first
+# Downloading and clustering happen at the same time: a pool of threads downloads images into a small buffer
+# while a pool of processes clusters the ones that have already arrived. The buffer only holds a bounded number
+# of images, so memory stays flat however long the CSV is, and results come out as soon as each image is done
+import csv
+import functools
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from color_cluster_kit.batch import ERROR_VALUE, iter_batch
+from color_cluster_kit.download import download_image, failure_reason, write_manifest
+from color_cluster_kit.results import STATUS_ERROR, output_columns, output_row, result_status
+from color_cluster_kit.scheduler import log_throughput
+from color_cluster_kit.telemetry import Progress, TelemetryLog, split_result
+
+
+# Generator that downloads the urls on a thread pool and yields (row, image bytes) as each download finishes
+# At most prefetch images are downloading or waiting to be picked up at any time. The generator only downloads
+# more when it's asked for the next image, so a slow consumer holds the downloads back instead of piling images
+# up in memory
+# Failed downloads aren't yielded. Their (row, url, reason) is appended to failures instead
+def _download_stream(urls, names, workers, prefetch, save_dir, retries, backoff, timeout, failures):
+
+    jobs = iter(enumerate(urls))
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+
+        def submit():
+            for row, url in jobs:
+                path = None if save_dir is None else os.path.join(save_dir, str(names[row]) + ".jpg")
+                running[pool.submit(download_image, url, path, retries, backoff, timeout)] = (row, url)
+                return
+
+        for _ in range(prefetch):
+            submit()
+
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                row, url = running.pop(future)
+                submit()
+
+                try:
+                    body = future.result()
+                except Exception as error:
+                    # Any error (e.g. a ValueError from a malformed url) only fails its own image, as in
+                    # download_images()
+                    failures.append((row, url, failure_reason(error)))
+                    continue
+
+                yield row, body
+
+
+# Downloads every url and runs summary_func on the image bytes, yielding (row, result) as each image finishes
+# row is the position of the url in urls. Results arrive in the order they finish, not in row order
+# summary_func must accept the raw bytes of an image (see load_image()) and, like with run_batch(), be importable
+# by the worker processes, e.g. partial(image_summary, k=5, lower_bound=lower_bound, upper_bound=upper_bound)
+# processes is the number of clustering processes and download_workers the number of download threads
+# prefetch is how many images can be downloading or waiting for a free process at once (default: 2 per thread)
+# If save_dir is given, the raw images are saved there too, named after names (the row numbers by default)
+# Images that fail to download get ERROR_VALUE. If failures is a list, their (row, url, reason) is added to it
+# threads is how many threads each clustering process may use (see iter_batch())
+def stream_summaries(summary_func, urls, processes=None, download_workers=16, prefetch=None, save_dir=None,
+                     names=None, retries=3, backoff=0.5, timeout=30, failures=None, threads=None):
+
+    urls = list(urls)
+    names = list(names) if names is not None else list(range(len(urls)))
+    prefetch = prefetch or download_workers * 2
+    failures = failures if failures is not None else []
+
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+
+    # The download stream yields (row, bytes). The process pool only sees the bytes, so remember which row each
+    # one came from, in the order they're handed over
+    handed_over = {}
+
+    def images():
+        for position, (row, body) in enumerate(
+                _download_stream(urls, names, download_workers, prefetch, save_dir, retries, backoff, timeout,
+                                 failures)):
+            handed_over[position] = row
+            yield body
+
+    # Yields the rows of downloads that failed since the last time this was called
+    reported = 0
+
+    def new_failures():
+        nonlocal reported
+        while reported < len(failures):
+            yield failures[reported][0], ERROR_VALUE
+            reported += 1
+
+    for position, result in iter_batch(summary_func, images(), processes, threads=threads):
+        yield handed_over.pop(position), result
+        yield from new_failures()
+
+    yield from new_failures()
+
+
+# Runs stream_summaries() over a dataframe of observations and writes each row to the output csv as soon as its
+# result is ready, with the result in a new result_column
+# If measure is given ("v_mean" or "num_points"), the result is written as typed columns instead (h_mean, s_mean,
+# measure and status, see color_cluster_kit/results.py). Rows are written one at a time, so output is always csv
+# For a multi-profile summary_func, measure is a dictionary {profile name: measure} (see profile_measures())
+# df needs an "image_url" and an "id" column (the same ones the Downloader uses)
+# Rows are written in the order they finish. Sort by id afterwards if the original order matters
+# If manifest is a path, the id, url and reason of every failed download is written there
+# If telemetry is a path, a record for every image is appended there, as in run_checkpointed(). Failed downloads
+# get a record too, with the download error as their error
+# plan and schedule_log work as in run_checkpointed(): the plan's processes and threads are used, and the
+# throughput is printed (and logged) at the end
+# with_k works as in run_checkpointed(): the k each image was clustered with (with auto_k) gets a "k" column
+# Any other keyword arguments (processes, download_workers, save_dir, ...) go to stream_summaries()
+def run_pipeline(summary_func, df, output, result_column="KMeansData", measure=None, manifest=None, progress=True,
+                 telemetry=None, plan=None, schedule_log=None, with_k=False, **options):
+
+    failures = []
+    columns = list(df.columns)
+    rows = list(df.itertuples(index=False, name=None))
+
+    func = summary_func if telemetry is None else functools.partial(summary_func, telemetry=True)
+    log = TelemetryLog(telemetry) if telemetry is not None else None
+    meter = Progress(len(rows)) if progress else None
+
+    if plan is not None:
+        options.update(processes=plan["processes"], threads=plan["threads"])
+
+    start = time.perf_counter()
+    with open(output, "w", newline="") as file:
+        writer = csv.writer(file)
+        if measure is None:
+            writer.writerow(columns + [result_column])
+        else:
+            writer.writerow(columns + output_columns(measure, with_k))
+
+        try:
+            for row, result in stream_summaries(func, df["image_url"], names=df["id"], failures=failures,
+                                                **options):
+                if log is not None:
+                    failed_download = [reason for failed_row, _, reason in failures if failed_row == row]
+                    if failed_download:
+                        record = {"error_type": "DownloadError", "error": failed_download[0]}
+                    else:
+                        result, record = split_result(result)
+                    log.write({"id": df["id"].iloc[row], "source": df["image_url"].iloc[row],
+                               "status": result_status(result), **record})
+
+                values = [result] if measure is None else output_row(result, measure, with_k)
+                writer.writerow(list(rows[row]) + values)
+                file.flush()
+
+                if meter is not None:
+                    meter.update(failed=int(result_status(result) == STATUS_ERROR))
+        finally:
+            if log is not None:
+                log.close()
+            if meter is not None:
+                meter.close()
+
+    if plan is not None:
+        log_throughput(plan, len(rows), time.perf_counter() - start, schedule_log)
+
+    if manifest is not None:
+        write_manifest([(df["id"].iloc[row], url, reason) for row, url, reason in failures], manifest)
+
+    return failures
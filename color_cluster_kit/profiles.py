@@ -0,0 +1,81 @@
+# Species profiles for the multi-profile Data Collector
+# The Geranium and Sandblossom collectors only differ in their HSV bounds, k and the third value they save
+# (v_mean or num_points), yet running both decodes and clusters every image twice. A profile holds just those
+# settings, so one run can load each image once, cluster it once for every distinct k, and apply the bounds of
+# every profile to the same clusters
+# Profiles are kept in a JSON file, one entry per species, e.g.
+# {
+#     "Geranium": {"k": 5, "lower_bound": [123, 15, 0], "upper_bound": [157, 255, 255], "measure": "v_mean"},
+#     "Sandblossom": {"k": 15, "lower_bound": [112, 26, 0], "upper_bound": [155, 165, 255], "measure": "num_points"}
+# }
+# The name of each profile is put in front of its result columns, e.g. Geranium_h_mean or Sandblossom_status
+import json
+
+from color_cluster_kit.stats import in_range_summary
+
+# What each profile has to have, and what it can have
+REQUIRED_KEYS = ("k", "lower_bound", "upper_bound")
+MEASURES = ("v_mean", "num_points")
+
+
+# Reads the profiles in a JSON file and returns them as a dictionary of {name: profile}, in the order of the file
+# Every profile gets a "measure" ("v_mean" unless the file says otherwise), and the bounds become tuples
+# Raises ValueError if a profile is missing a setting, has a setting it doesn't know (usually a typo) or a bad value
+def load_profiles(path):
+
+    with open(path, encoding="utf-8") as file:
+        config = json.load(file)
+
+    if not isinstance(config, dict) or not config:
+        raise ValueError(path + " has to hold at least one profile, e.g. "
+                         '{"Geranium": {"k": 5, "lower_bound": [123, 15, 0], "upper_bound": [157, 255, 255]}}')
+
+    profiles = {}
+    for name, profile in config.items():
+        where = "Profile " + repr(name) + " in " + path
+
+        missing = [key for key in REQUIRED_KEYS if key not in profile]
+        if missing:
+            raise ValueError(where + " is missing " + ", ".join(missing))
+
+        unknown = sorted(set(profile) - set(REQUIRED_KEYS) - {"measure"})
+        if unknown:
+            raise ValueError(where + " has unknown settings: " + ", ".join(unknown))
+
+        measure = profile.get("measure", "v_mean")
+        if measure not in MEASURES:
+            raise ValueError(where + ": measure must be 'v_mean' or 'num_points', not " + repr(measure))
+
+        if len(profile["lower_bound"]) != 3 or len(profile["upper_bound"]) != 3:
+            raise ValueError(where + ": the bounds need three values each (H, S and V)")
+
+        if int(profile["k"]) < 1:
+            raise ValueError(where + ": k must be at least 1")
+
+        profiles[name] = {
+            "k": int(profile["k"]),
+            "lower_bound": tuple(profile["lower_bound"]),
+            "upper_bound": tuple(profile["upper_bound"]),
+            "measure": measure,
+        }
+
+    return profiles
+
+
+# Returns the measure of every profile as {name: measure}, which is what the result writers take to give each
+# profile its own columns (see color_cluster_kit/results.py)
+def profile_measures(profiles):
+
+    return {name: profile["measure"] for name, profile in profiles.items()}
+
+
+# Applies every profile's bounds to the clusters of one image and returns {name: result}, where each result is the
+# same value a single species collector returns (see in_range_summary())
+# stats is a dictionary of {k: the image's stats clustered with that k}, with an entry for every profile's k
+def profiles_summary(stats, profiles):
+
+    return {
+        name: in_range_summary(stats[profile["k"]], profile["lower_bound"], profile["upper_bound"],
+                               measure=profile["measure"])
+        for name, profile in profiles.items()
+    }
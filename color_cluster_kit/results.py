@@ -0,0 +1,234 @@
+# Turns image_summary() results into proper typed columns, and reads and writes result files
+# image_summary() returns a list like [130.2, 45.1, 5120], "no flowers" or "An error occured". Saved as is, the
+# list ends up in the csv file as the text "[130.2, 45.1, 5120]", which every reader has to pick apart again row
+# by row. Instead, each value gets its own numeric column, plus a "status" column saying which rows have values
+# The multi-profile collector returns one such result per species profile, as a dictionary {profile name: result}
+# (see color_cluster_kit/profiles.py). measure is then a dictionary {profile name: measure} too, and every profile
+# gets its own columns with its name in front, e.g. Geranium_h_mean, ..., Geranium_status
+# With auto_k, k is picked for every image, and image_summary() adds the k it used as a fourth value, e.g.
+# [130.2, 45.1, 5120, 7]. with_k then adds a "k" column, so the output says which k each image was clustered with
+import json
+
+import numpy as np
+import pandas as pd
+
+# The values of the "status" column
+STATUS_OK = "ok"
+STATUS_NO_FLOWERS = "no flowers"
+STATUS_ERROR = "error"
+
+# The name of the column the collectors used to store the whole result as text
+LEGACY_COLUMN = "KMeansData"
+
+
+# Returns the names of the value columns for a measure ("v_mean" or "num_points", see in_range_summary()), plus "k"
+# with with_k
+def result_columns(measure="v_mean", with_k=False):
+
+    return ["h_mean", "s_mean", measure] + (["k"] if with_k else [])
+
+
+# Returns the status of a single result
+# For a multi-profile result, it's "error" if any profile failed, "ok" if any profile found flowers and
+# "no flowers" otherwise
+def result_status(result):
+
+    if isinstance(result, dict):
+        statuses = [result_status(value) for value in result.values()]
+        if STATUS_ERROR in statuses or not statuses:
+            return STATUS_ERROR
+        return STATUS_OK if STATUS_OK in statuses else STATUS_NO_FLOWERS
+
+    if isinstance(result, (list, tuple)):
+        return STATUS_OK
+    if result == STATUS_NO_FLOWERS:
+        return STATUS_NO_FLOWERS
+    return STATUS_ERROR
+
+
+# Returns the values of a single result as a list: the three values (and the k, with with_k) and then the status.
+# Rows without values get empty values (None), e.g. [None, None, None, "no flowers"]
+def result_row(result, with_k=False):
+
+    status = result_status(result)
+    if status != STATUS_OK:
+        return [None] * len(result_columns(with_k=with_k)) + [status]
+
+    return list(result) + [status]
+
+
+# Returns the names of all the columns a result is written to: the value columns and the status column, or those of
+# every profile for a multi-profile measure
+def output_columns(measure="v_mean", with_k=False):
+
+    if isinstance(measure, dict):
+        return [name + "_" + column for name, value in measure.items() for column in output_columns(value, with_k)]
+
+    return result_columns(measure, with_k) + ["status"]
+
+
+# Returns the values of a result in the same order as output_columns()
+# A multi-profile result that isn't a dictionary (e.g. "An error occured" for an image that couldn't be read)
+# counts as that result for every profile
+def output_row(result, measure="v_mean", with_k=False):
+
+    if isinstance(measure, dict):
+        return [value for name in measure for value in result_row(_profile_result(result, name), with_k)]
+
+    return result_row(result, with_k)
+
+
+# Returns the result of one profile from a multi-profile result, which can also be its JSON text (the way it's
+# saved in checkpoint files)
+def _profile_result(result, name):
+
+    if isinstance(result, str) and result.startswith("{"):
+        result = json.loads(result)
+
+    return result[name] if isinstance(result, dict) else result
+
+
+# Turns many results into a dataframe with the value columns and a "status" column
+# results can hold the lists returned by image_summary() or their text form ("[130.2, 45.1, 5120]", as found in
+# older result files), so this also converts old files
+# num_points (and k, with with_k) is stored as a whole number column that allows missing values
+# With a multi-profile measure, every profile's columns are made this way and put side by side
+def expand_results(results, measure="v_mean", with_k=False):
+
+    if isinstance(measure, dict):
+        results = list(results)
+        return pd.concat([
+            expand_results([_profile_result(result, name) for result in results], value,
+                           with_k).add_prefix(name + "_")
+            for name, value in measure.items()
+        ], axis=1)
+
+    # str() of a list gives the same text that ends up in a csv file, so both kinds of input go down the same path
+    text = pd.Series(results, dtype=object).astype(str).reset_index(drop=True)
+
+    # Status of every row, worked out on the whole column at once
+    ok = text.str.startswith("[")
+    status = np.where(ok, STATUS_OK, np.where(text == STATUS_NO_FLOWERS, STATUS_NO_FLOWERS, STATUS_ERROR))
+
+    columns = result_columns(measure, with_k)
+    values = pd.DataFrame(np.nan, index=text.index, columns=columns)
+
+    if ok.any():
+        # Results from before with_k (e.g. in an older checkpoint) have no k, which is left empty
+        parts = text[ok].str.slice(1, -1).str.split(", ", expand=True)
+        values.loc[ok, columns[:parts.shape[1]]] = parts.to_numpy(dtype=float)
+
+    for column in ("num_points", "k"):
+        if column in columns:
+            values[column] = values[column].round().astype("Int64")
+
+    values["status"] = status
+
+    return values
+
+
+# Writes a dataframe of results. The format is picked from the file extension:
+# ".parquet" writes Parquet and ".feather" writes Arrow/Feather (both need the pyarrow package), and anything else
+# writes a csv file the same way df.to_csv() always has
+def write_results(df, path):
+
+    if path.endswith((".parquet", ".feather")):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Writing " + path + " needs the pyarrow package (pip install pyarrow), "
+                              "or save to a .csv file instead")
+
+        if path.endswith(".parquet"):
+            df.to_parquet(path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(path)
+    else:
+        df.to_csv(path)
+
+
+# Reads a result file written by write_results() (csv, Parquet or Feather)
+# Older csv files, which only have the "KMeansData" text column, are converted on the way in. measure says what
+# the third value in them is ("v_mean" or "num_points"), since the old files don't record it
+# profile picks one profile out of a multi-profile file: its columns (e.g. Sandblossom_h_mean) are renamed to the
+# usual names (h_mean), so the Classifiers read it like a single species file. The other profiles' columns are left
+# out. Raises ValueError if the file has no columns for that profile
+# Any other keyword arguments (e.g. encoding) go to pd.read_csv()
+def read_results(path, measure="v_mean", profile=None, **options):
+
+    if path.endswith(".parquet"):
+        df = pd.read_parquet(path)
+    elif path.endswith(".feather"):
+        df = pd.read_feather(path)
+    else:
+        df = pd.read_csv(path, **options)
+
+    return _tidy_results(df, path, measure, profile)
+
+
+# Reads a result file like read_results(), but chunk_size rows at a time, so a file with tens of millions of rows
+# never has to fit in memory. Yields one dataframe per chunk, each already converted like read_results() does, and
+# numbered on from the previous chunk, so putting the chunks together gives exactly what read_results() returns
+# Parquet and Feather files need the pyarrow package. Their chunks can be a little smaller than chunk_size
+def iter_results(path, measure="v_mean", profile=None, chunk_size=100000, **options):
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet
+
+        chunks = (batch.to_pandas() for batch in pyarrow.parquet.ParquetFile(path).iter_batches(chunk_size))
+    elif path.endswith(".feather"):
+        chunks = _feather_chunks(path, chunk_size)
+    else:
+        chunks = pd.read_csv(path, chunksize=chunk_size, **options)
+
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield _tidy_results(chunk, path, measure, profile)
+
+
+# Yields the rows of a Feather file in chunks of at most chunk_size rows. The file is memory-mapped, so only the
+# chunk being read is loaded
+def _feather_chunks(path, chunk_size):
+
+    import pyarrow.ipc
+
+    with pyarrow.memory_map(path) as source:
+        reader = pyarrow.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            for start in range(0, batch.num_rows, chunk_size):
+                yield batch.slice(start, chunk_size).to_pandas()
+
+
+# Converts the rows of a result file the way read_results() describes: the old "KMeansData" column is split into
+# columns, and with profile, only that profile's columns are kept under the usual names
+# A csv file doesn't record that num_points (or k) is a whole number, so it's read as one with decimals wherever it
+# has missing values. It's always made a whole number column again, however many rows are read at once
+def _tidy_results(df, path, measure, profile):
+
+    # The k columns are "k" and every profile's "<profile>_k" next to its "<profile>_status"
+    k_columns = {"k"} | {str(column)[:-len("status")] + "k" for column in df.columns if str(column).endswith("_status")}
+
+    for column in df.columns:
+        if (str(column).endswith("num_points") or column in k_columns) and df[column].dtype != "Int64":
+            df[column] = df[column].round().astype("Int64")
+
+    if "status" not in df.columns and LEGACY_COLUMN in df.columns:
+        values = expand_results(df[LEGACY_COLUMN], measure)
+        values.index = df.index
+        df = df.drop(columns=LEGACY_COLUMN).join(values)
+
+    if profile is not None:
+        prefix = profile + "_"
+        columns = [column for column in df.columns if column.startswith(prefix)]
+        if prefix + "status" not in columns:
+            raise ValueError(path + " has no results for the profile " + repr(profile))
+
+        # Columns of the other profiles end in _status, _h_mean, ... as well
+        others = {column.rsplit("_status", 1)[0] + "_" for column in df.columns if column.endswith("_status")}
+        keep = [column for column in df.columns if not any(column.startswith(other) for other in others)]
+        df = df[keep].join(df[columns].rename(columns=lambda column: column[len(prefix):]))
+
+    return df
@@ -0,0 +1,164 @@
+# Planning how many worker processes a run uses and how many threads each of them may start
+# K-Means in scikit-learn runs on OpenMP threads, numpy hands its maths to a BLAS library with threads of its own,
+# and OpenCV has a third set. Each of them starts one thread per core, in every worker process. With one worker per
+# core, that's cores x cores threads fighting over the cores, and the machine spends its time switching between them
+# A plan fixes both numbers so that processes x threads is the number of cores, and limit_threads() makes every
+# worker stick to it. Small images run fastest as many single-threaded processes, each busy with its own image. Huge
+# images give each thread enough pixels to be worth it, and need so much memory that only a few workers fit, so they
+# run as fewer processes that share out the remaining cores as threads
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+from threadpoolctl import threadpool_limits
+
+from color_cluster_kit.images import MAX_PIXELS, jpeg_size
+from color_cluster_kit.memory import BYTES_PER_PIXEL, WORKER_MB, available_memory_mb
+
+# An image gets one more thread for every PIXELS_PER_THREAD pixels it's clustered at. Below that, handing the work
+# out to several threads costs more than it saves, and a process of its own does better
+PIXELS_PER_THREAD = 2000000
+
+# How many images' sizes are read to plan a run. Only their headers are read, not the images
+SAMPLE_IMAGES = 50
+
+# How much of the start of an image file is read to find its size. The size is near the start of a JPEG, but after
+# its EXIF data (e.g. the camera settings and a thumbnail), which can take up to 64 KB
+HEADER_BYTES = 128 * 1024
+
+# The environment variables that set the number of threads of OpenMP and the BLAS libraries. They only count for
+# libraries loaded after they're set, which is why limit_threads() also limits the ones already loaded
+THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                    "NUMEXPR_NUM_THREADS")
+
+
+# Returns the number of cores this process may run on. On Linux that can be fewer than the machine has (e.g. in a
+# container or when started with taskset), and os.cpu_count() counts them all
+def usable_cores():
+
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+
+# Returns the number of pixels an image will be clustered at (its size shrunk to max_pixels, see load_image()), or
+# None if its size can't be told from its header (it isn't a readable JPEG file)
+def image_pixels(source, max_pixels=MAX_PIXELS):
+
+    try:
+        with open(source, "rb") as file:
+            size = jpeg_size(file.read(HEADER_BYTES))
+    except (OSError, TypeError, ValueError):
+        return None
+
+    if size is None:
+        return None
+
+    pixels = size[0] * size[1]
+    return min(pixels, max_pixels) if max_pixels else pixels
+
+
+# Works out how many worker processes to run and how many threads each one may use, and returns the plan as a
+# dictionary, e.g. {"cores": 16, "processes": 16, "threads": 1, "images": 5000, "pixels": 1000000}
+# sources is the list of image paths of the run (or None, e.g. for images that are downloaded as the run goes).
+# The sizes of a sample of SAMPLE_IMAGES of them are read, and "pixels" is the middle (median) one. Without any
+# sizes, every image is taken to be max_pixels pixels
+# processes is the number of processes the run would use otherwise (None means one per core). threads is "auto" to
+# plan both numbers, a number to fix the threads per process (the processes then fill the rest of the cores), or
+# None to leave the libraries to start as many threads as they like, like before there were plans
+# Unless threads is None, processes x threads is never more than the cores (see usable_cores()): more threads than
+# cores are cut to the cores, and the processes, even a number that was asked for, to the cores the threads leave
+# With "auto", images get one thread per PIXELS_PER_THREAD pixels and the cores that leaves go to processes. No
+# more processes are started than fit in the available memory (see color_cluster_kit/memory.py), than processes,
+# or than there are images, and the cores left over by those limits go to each process as threads
+def plan_workers(sources=None, max_pixels=MAX_PIXELS, processes=None, threads="auto", sample=SAMPLE_IMAGES,
+                 random_state=0):
+
+    cores = usable_cores()
+    images = None if sources is None else len(sources)
+
+    sizes = []
+    if sources is not None and len(sources):
+        sources = list(sources)
+        rng = np.random.default_rng(random_state)
+        picked = rng.choice(len(sources), min(sample, len(sources)), replace=False)
+        sizes = [size for size in (image_pixels(sources[i], max_pixels) for i in picked) if size is not None]
+    pixels = int(np.median(sizes)) if sizes else (max_pixels or 0)
+
+    plan = {"cores": cores, "processes": processes or cores, "threads": threads, "images": images, "pixels": pixels}
+
+    if threads is None:
+        return plan
+
+    if threads != "auto":
+        plan["threads"] = min(threads, cores)
+        plan["processes"] = min(processes or cores, max(1, cores // plan["threads"]))
+        return plan
+
+    workers = min(processes or cores, max(1, cores // min(cores, max(1, pixels // PIXELS_PER_THREAD))))
+
+    # Each worker needs about WORKER_MB plus BYTES_PER_PIXEL for every pixel it clusters
+    available = available_memory_mb()
+    if available is not None:
+        workers = min(workers, max(1, int(available // (WORKER_MB + pixels * BYTES_PER_PIXEL / 1024 ** 2))))
+
+    if images:
+        workers = min(workers, images)
+
+    plan["processes"] = workers
+    plan["threads"] = max(1, cores // workers)
+    return plan
+
+
+# Returns the number followed by word, or by its plural (word + "s" unless given), e.g. "1 core" or "16 cores"
+def _count(number, word, plural=None):
+
+    return str(number) + " " + (word if number == 1 else plural or word + "s")
+
+
+# Returns a plan as one line of text for printing, e.g. "16 processes x 1 thread on 16 cores, for 5000 images of
+# about 1000000 pixels"
+def describe_plan(plan):
+
+    threads = "any number of threads" if plan["threads"] is None else _count(plan["threads"], "thread")
+    images = "images" if plan["images"] is None else _count(plan["images"], "image")
+
+    return (_count(plan["processes"], "process", "processes") + " x " + threads + " on " +
+            _count(plan["cores"], "core") + ", for " + images + " of about " + str(plan["pixels"]) + " pixels")
+
+
+# Limits this process to threads threads in OpenMP, the BLAS libraries and OpenCV. The worker pools run this in
+# every worker process as it starts (see color_cluster_kit/batch.py). None leaves the limits as they are
+def limit_threads(threads):
+
+    if threads is None:
+        return
+
+    # For the libraries that aren't loaded yet. On Windows and macOS a worker starts as a new python, which loads
+    # them after this
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(threads)
+
+    # For the libraries that are loaded already. On Linux a worker starts as a copy of its parent, with everything
+    # the parent had loaded
+    threadpool_limits(threads)
+    cv2.setNumThreads(threads)
+
+
+# Prints the throughput a run achieved with a plan and returns it in images per second. If path is given, the plan
+# and its throughput are also appended to that file as a line of JSON, so the plans of different runs (e.g. with
+# other settings or on another machine) can be compared afterwards
+def log_throughput(plan, images, seconds, path=None):
+
+    rate = images / seconds if seconds > 0 else 0.0
+    print("Throughput: " + str(round(rate, 2)) + " images/s with " + describe_plan(plan))
+
+    if path is not None:
+        record = dict(plan, created=time.strftime("%Y-%m-%d %H:%M:%S"), done=images, seconds=round(seconds, 3),
+                      images_per_second=round(rate, 3))
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+
+    return rate
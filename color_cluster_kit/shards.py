@@ -0,0 +1,128 @@
+# Splitting a Data Collector run across several machines, and putting the pieces back together
+# Every observation goes to one of n shards, picked from its id alone (a hash of the id, the same on every machine
+# and every run), so each machine can work out its own share of the data file without talking to the others:
+#   python "Data Collector (Sandblossom).py" --shard 1/4     on the first machine
+#   python "Data Collector (Sandblossom).py" --shard 2/4     on the second machine, and so on
+# Each shard is saved to its own output file (e.g. YourSaveFile.shard-1-of-4.csv). Once they're all copied into
+# one folder, --merge 4 combines them into the usual output file, exactly as a run on a single machine would have
+# written it, after checking that no observation is missing and none was done twice
+import argparse
+import hashlib
+import os
+
+import pandas as pd
+
+from color_cluster_kit.duplicates import DUPLICATE_COLUMN
+from color_cluster_kit.results import read_results, write_results
+
+
+# Turns "i/n" into (i, n). Shards are numbered from 1 to n
+def parse_shard(text):
+
+    try:
+        shard, count = (int(part) for part in str(text).split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("a shard looks like 2/4 (the 2nd of 4 shards), not " + repr(text))
+
+    if count < 1 or not 1 <= shard <= count:
+        raise argparse.ArgumentTypeError("the shard has to be between 1 and " + str(count) + ", not " + str(shard))
+
+    return shard, count
+
+
+# Reads the command line options of a Data Collector. With neither option, the whole data file is run as usual
+def shard_arguments(argv=None):
+
+    parser = argparse.ArgumentParser(description="Runs the Data Collector on all of the data, or on one shard of it")
+    options = parser.add_mutually_exclusive_group()
+    options.add_argument("--shard", type=parse_shard, metavar="i/n",
+                         help="only process the i-th of n shards of the data, e.g. --shard 2/4")
+    options.add_argument("--merge", type=int, metavar="n",
+                         help="combine the outputs of all n shards into the output file, e.g. --merge 4")
+
+    return parser.parse_args(argv)
+
+
+# Returns the shard (from 1 to n) of every id. The hash only depends on the text of the id, so it's the same on
+# every machine, operating system and python version (unlike python's own hash(), which changes every run)
+def shard_of(ids, n):
+
+    return [int.from_bytes(hashlib.blake2b(str(id).encode("utf-8"), digest_size=8).digest(), "big") % n + 1
+            for id in ids]
+
+
+# Returns the rows of df that belong to shard i of n, in their original order
+# groups is optional and holds a key for every row of df, e.g. the ids of duplicate_ids(). The shard is then picked
+# from the key instead of the id, so rows with the same key (a group of duplicates) always go to the same shard
+def select_shard(df, shard, n, id_column="id", groups=None):
+
+    keys = df[id_column] if groups is None else groups.reindex(df.index)
+    return df[[value == shard for value in shard_of(keys, n)]]
+
+
+# Returns the file name of shard i of n's output, e.g. YourSaveFile.csv becomes YourSaveFile.shard-2-of-4.csv
+def shard_output(output, shard, n):
+
+    root, extension = os.path.splitext(output)
+    return root + ".shard-" + str(shard) + "-of-" + str(n) + extension
+
+
+# Combines the outputs of all n shards of a run into output and returns the combined dataframe
+# df is the data file the run was made from, read the same way (it gives the row order and the original columns)
+# The shard outputs are found next to output, named by shard_output(). Raises ValueError if a shard's file is
+# missing, if an observation is in none of the shards or if one is in more than one (e.g. when shards of two
+# different runs got mixed up)
+# Any other keyword arguments (e.g. encoding) go to read_results()
+def merge_shards(df, output, n, id_column="id", **options):
+
+    paths = [shard_output(output, shard, n) for shard in range(1, n + 1)]
+    missing_files = [path for path in paths if not os.path.exists(path)]
+    if missing_files:
+        raise ValueError("These shard outputs are missing: " + ", ".join(missing_files))
+
+    # round_trip reads every number back exactly as it was written, so the merged file matches a single run. The
+    # ids in the duplicate column are read as text, as a single run writes them: read as numbers, the empty rows
+    # would turn them into decimals (100.0 instead of 100)
+    if not output.endswith((".parquet", ".feather")):
+        options.setdefault("float_precision", "round_trip")
+        options.setdefault("dtype", {DUPLICATE_COLUMN: str})
+    shards = [read_results(path, **options) for path in paths]
+
+    # The result columns are the ones the shards added to the data file's columns (a csv file's unnamed index
+    # column doesn't count)
+    columns = [column for column in shards[0].columns
+               if column not in df.columns and not str(column).startswith("Unnamed: ")]
+    results = pd.concat([shard[[id_column] + columns] for shard in shards], ignore_index=True)
+
+    # Every observation has to be in exactly one shard, as often as it's in the data file
+    ids = df[id_column].astype(str)
+    expected = ids.value_counts()
+    found = results[id_column].astype(str).value_counts()
+    every_id = expected.index.union(found.index)
+    difference = found.reindex(every_id, fill_value=0) - expected.reindex(every_id, fill_value=0)
+
+    problems = []
+    if (difference < 0).any():
+        missing = difference[difference < 0].index.tolist()
+        problems.append(str(len(missing)) + " ids are missing (e.g. " + ", ".join(missing[:5]) + ")")
+    if (difference > 0).any():
+        extra = difference[difference > 0].index.tolist()
+        problems.append(str(len(extra)) + " ids are duplicated or aren't in the data (e.g. " +
+                        ", ".join(extra[:5]) + ")")
+    if problems:
+        raise ValueError("The shard outputs don't match the data: " + "; ".join(problems))
+
+    # Put the results back in the order of the data file. An id that's in the data file more than once got the
+    # same result every time, so any one of its rows will do
+    results = results.drop_duplicates(id_column)
+    results.index = results[id_column].astype(str)
+    merged = df.join(results[columns].reindex(ids).set_axis(df.index))
+
+    # A pixel count column with missing values is read back as decimals, so make it whole numbers again
+    for column in columns:
+        if column.endswith("num_points"):
+            merged[column] = merged[column].round().astype("Int64")
+
+    write_results(merged, output)
+
+    return merged
@@ -0,0 +1,84 @@
+# Per-cluster summary statistics computed straight from the K-Means labels
+# Filtering a dataframe with df[df["cluster"] == i] once per cluster scans every pixel k times and copies each
+# cluster out before taking its mean. np.bincount adds up every cluster's values in a single pass instead, and
+# the means fall out of the sums and counts
+import numpy as np
+
+
+# Receives the cluster labels of every pixel, the pixels themselves and k, and returns a dictionary with
+# - "counts": the number of pixels in each cluster, shape (k,)
+# - "sums": the sum of the H, S and V values of each cluster, shape (k, 3)
+# - "means": the average H, S and V values of each cluster, shape (k, 3). Empty clusters get NaN
+# pixels is an array with one row per pixel and one column per channel. For an HSV image, image_hsv.reshape(-1, 3)
+# gives exactly that without copying anything
+# weights is optional and says how many pixels each row stands for (all 1 by default)
+def cluster_stats(labels, pixels, k, weights=None):
+
+    labels = np.asarray(labels).ravel()
+    pixels = np.asarray(pixels).reshape(len(labels), -1)
+
+    # the number of pixels in each cluster
+    counts = np.bincount(labels, weights=weights, minlength=k)
+
+    # the sum of each channel in each cluster, one bincount per channel
+    sums = np.empty((k, pixels.shape[1]))
+    for c in range(pixels.shape[1]):
+        channel = pixels[:, c] if weights is None else pixels[:, c] * weights
+        sums[:, c] = np.bincount(labels, weights=channel, minlength=k)
+
+    return stats_from_sums(counts, sums)
+
+
+# Builds the same dictionary as cluster_stats() from already known per-cluster counts and sums
+def stats_from_sums(counts, sums):
+
+    # averages, leaving NaN for clusters that ended up empty (the same thing np.mean of an empty cluster gives)
+    means = np.full(sums.shape, np.nan)
+    np.divide(sums, counts[:, None], out=means, where=counts[:, None] > 0)
+
+    return {"counts": counts, "sums": sums, "means": means}
+
+
+# Returns the list of clusters whose average values all sit between lower_bound and upper_bound (inclusive)
+# Only as many channels as there are bounds are checked, so passing (h, s) bounds ignores V entirely
+def in_range_clusters(stats, lower_bound, upper_bound):
+
+    n = len(lower_bound)
+    means = stats["means"][:, :n]
+
+    # NaN (empty clusters) compares as False, so they never count as in range
+    in_range = np.all((means >= np.asarray(lower_bound)) & (means <= np.asarray(upper_bound)), axis=1)
+
+    return np.flatnonzero(in_range).tolist()
+
+
+# Combines several clusters into one and returns its pixel count and average H, S and V values
+# Because the sums and counts are already known, this is a little arithmetic rather than another pass over the pixels
+def merge_clusters(stats, clusters):
+
+    count = stats["counts"][clusters].sum()
+    means = stats["sums"][clusters].sum(axis=0) / count
+
+    return int(count), means.tolist()
+
+
+# Turns the stats of an image into the value the Data Collectors store for it
+# The clusters within the bounds are merged and [h_mean, s_mean, third] is returned, where third is
+# - "v_mean": the average V value, and all three of H, S and V have to be within the bounds
+# - "num_points": the number of pixels in range, and only H and S have to be within the bounds
+# If no cluster is in range, "no flowers" is returned instead
+def in_range_summary(stats, lower_bound, upper_bound, measure="v_mean"):
+
+    if measure == "v_mean":
+        clusters = in_range_clusters(stats, lower_bound, upper_bound)
+    elif measure == "num_points":
+        clusters = in_range_clusters(stats, lower_bound[:2], upper_bound[:2])
+    else:
+        raise ValueError("measure must be 'v_mean' or 'num_points', not " + repr(measure))
+
+    if len(clusters) == 0:
+        return "no flowers"
+
+    num_points, (h_mean, s_mean, v_mean) = merge_clusters(stats, clusters)
+
+    return [h_mean, s_mean, v_mean if measure == "v_mean" else num_points]
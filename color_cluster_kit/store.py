@@ -0,0 +1,211 @@
+# A packed store of preprocessed images, so repeated runs never decode the same JPEG twice
+# Every tuning run of a Data Collector (a new k, new bounds, another mode) used to decode every image again, shrink
+# it to the pixel budget and convert it to HSV before clustering even started. build_store() does that once: the
+# HSV pixels of every image are written one after the other into a single file (pixels.bin), and an index
+# (index.json) records where each image starts and its height and width. Images are looked up by their path, the
+# same thing the Data Collectors and the Visualizer pass around
+# The pixel file is opened with np.memmap, so reading an image is just a view into the file: nothing is decoded or
+# copied, and the operating system keeps the file in its page cache, shared by every worker process
+# A store holds the images at one pixel budget (max_pixels). To change it, delete the store folder and build it again
+# The index also records the content id of every image (a hash of its file, see content_id()), which the cache uses
+# as the image's key, so a cache lookup of a stored image doesn't read its file either
+import functools
+import hashlib
+import json
+import os
+
+import cv2
+import numpy as np
+
+from color_cluster_kit.batch import iter_batch
+from color_cluster_kit.images import MAX_PIXELS, load_image
+from color_cluster_kit.telemetry import Progress, lap
+
+# The files inside a store folder
+PIXELS_FILE = "pixels.bin"
+INDEX_FILE = "index.json"
+
+# Every process keeps one open store per folder, see open_store()
+_open_stores = {}
+
+
+# Returns the content id of an image's raw bytes (the file contents, or the bytes of a downloaded image): a hash of
+# them, the same for the same image wherever it's stored. The cache keys images by it (see color_cluster_kit/cache.py)
+def content_id(data):
+
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+# Loads an image and returns (its HSV pixels shrunk to max_pixels, its content id), or None if it can't be read. This
+# is the work build_store() does once per image, in a worker process. The file is read once for both
+def preprocess_image(source, max_pixels=MAX_PIXELS):
+
+    try:
+        with open(source, "rb") as file:
+            data = file.read()
+    except (OSError, TypeError):
+        return None
+
+    image = load_image(data, max_pixels)
+    if image is None:
+        return None
+
+    return cv2.cvtColor(image, cv2.COLOR_BGR2HSV), content_id(data)
+
+
+# Reads a store's index, or returns a new empty one if the store doesn't exist yet
+def read_index(path, max_pixels=MAX_PIXELS):
+
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {"max_pixels": max_pixels, "images": {}}
+
+    with open(index_path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+# Raises a ValueError if a store built with stored_max_pixels is used with another max_pixels. Its images are
+# shrunk to stored_max_pixels, and handing them out for another pixel budget would silently change the results
+def check_max_pixels(path, stored_max_pixels, max_pixels):
+
+    if stored_max_pixels != max_pixels:
+        raise ValueError("The image store in " + path + " holds images shrunk to max_pixels = " +
+                         str(stored_max_pixels) + ", not " + str(max_pixels) + ". Use the same max_pixels, or "
+                         "delete the folder to build it again")
+
+
+# The HSV pixels of the images in a store folder, read straight from the file without copying them
+class PixelStore:
+
+    def __init__(self, path):
+
+        self.path = path
+        index = read_index(path)
+        self.max_pixels = index["max_pixels"]
+
+        # {image path: [where its pixels start in the file, height, width, content id]}
+        # Stores built before there were content ids have just the first three
+        self.images = index["images"]
+
+        # An empty file can't be memory-mapped, but then there's nothing to read from it anyway
+        pixels_path = os.path.join(path, PIXELS_FILE)
+        if os.path.exists(pixels_path) and os.path.getsize(pixels_path) > 0:
+            self.pixels = np.memmap(pixels_path, dtype=np.uint8, mode="r")
+        else:
+            self.pixels = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, source):
+        return str(source) in self.images
+
+    # Returns the HSV pixels of an image as a (height, width, 3) array, or None if it isn't in the store
+    # The array is a read-only view into the file, so it costs nothing until its pixels are actually used
+    def get(self, source):
+
+        entry = self.images.get(str(source))
+        if entry is None:
+            return None
+
+        offset, height, width = entry[:3]
+        return self.pixels[offset:offset + height * width * 3].reshape(height, width, 3)
+
+    # Returns the content id of an image (see content_id()), or None if it isn't in the store or the store is older
+    # than content ids
+    def content_id(self, source):
+
+        entry = self.images.get(str(source))
+        if entry is None or len(entry) < 4:
+            return None
+
+        return entry[3]
+
+
+# Returns this process's PixelStore for path, opening it the first time (like open_cache())
+# image_summary() runs in many worker processes, and each of them maps the file once instead of once per image
+def open_store(path):
+
+    key = (os.path.abspath(path), os.getpid())
+    if key not in _open_stores:
+        _open_stores[key] = PixelStore(path)
+
+    return _open_stores[key]
+
+
+# Adds every image in sources that isn't in the store at path yet, and returns how many couldn't be read
+# The images are loaded the usual way (shrunk to max_pixels, see load_image()) in several processes, converted to
+# HSV and appended to the pixel file. Running it again with more images only adds the new ones, so it can be
+# called at the start of every run. Images that can't be read are left out, and are tried again next time
+# Raises ValueError if the store was built with a different max_pixels
+def build_store(path, sources, max_pixels=MAX_PIXELS, processes=None, progress=True):
+
+    os.makedirs(path, exist_ok=True)
+    index = read_index(path, max_pixels)
+    check_max_pixels(path, index["max_pixels"], max_pixels)
+
+    # Every image that isn't in the store yet, once
+    todo = list(dict.fromkeys(str(source) for source in sources if str(source) not in index["images"]))
+    if not todo:
+        return 0
+
+    func = functools.partial(preprocess_image, max_pixels=max_pixels)
+    meter = Progress(len(todo)) if progress else None
+    failed = 0
+
+    try:
+        with open(os.path.join(path, PIXELS_FILE), "ab") as file:
+
+            # New images go after whatever is in the file already. That includes the pixels of any image written
+            # by a run that was stopped before it saved the index, which are simply never used
+            offset = file.seek(0, os.SEEK_END)
+
+            for position, loaded in iter_batch(func, todo, processes, error_value=None):
+                if loaded is None:
+                    failed += 1
+                else:
+                    image_hsv, content = loaded
+                    file.write(image_hsv.tobytes())
+                    index["images"][todo[position]] = [offset, image_hsv.shape[0], image_hsv.shape[1], content]
+                    offset += image_hsv.nbytes
+
+                if meter is not None:
+                    meter.update(failed=int(loaded is None))
+    finally:
+        # Whatever happens, save the index of everything that was written, so it isn't done again. It's written
+        # to a temporary file first, so a crash can't leave a half-written index behind
+        temporary = os.path.join(path, INDEX_FILE + ".tmp")
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(index, file)
+        os.replace(temporary, os.path.join(path, INDEX_FILE))
+
+        if meter is not None:
+            meter.close()
+
+        # This process may have the store open from before, without the new images
+        _open_stores.pop((os.path.abspath(path), os.getpid()), None)
+
+    return failed
+
+
+# Returns the HSV pixels of an image: from the store at store if it's in there, or else by loading the image and
+# converting it (see load_image()). Returns None if the image can't be read
+# Raises ValueError if the store was built with a different max_pixels, like build_store() does
+def load_hsv(source, max_pixels=MAX_PIXELS, store=None):
+
+    if store:
+        pixel_store = open_store(store)
+        check_max_pixels(store, pixel_store.max_pixels, max_pixels)
+        image_hsv = pixel_store.get(source)
+        if image_hsv is not None:
+            lap("store")
+            return image_hsv
+
+    image = load_image(source, max_pixels)
+    if image is None:
+        return None
+
+    image_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    lap("bgr_to_hsv")
+
+    return image_hsv
@@ -0,0 +1,111 @@
+# Clustering one loaded image into its per-cluster stats, shared by every Data Collector
+# This is the slow part of a collector's image_summary(). It doesn't depend on the upper and lower bounds, which
+# is what lets the cache reuse it when only the bounds change, and lets several species profiles share one
+# clustering of the same image (see color_cluster_kit/profiles.py)
+import cv2
+
+from color_cluster_kit.clustering import (MIN_EXPLAINED, choose_k, cluster_color_histogram, fit_clusters,
+                                          scale_features)
+from color_cluster_kit.stats import cluster_stats
+from color_cluster_kit.telemetry import lap, note
+
+# Every setting that changes what cluster_image() returns (besides its arguments). They're part of the cache key,
+# so if the scaling or resizing is ever changed, change these too and old cache entries won't be reused
+# A new argument of cluster_hsv() that changes the clusters has to be added to cluster_settings() as well, or the
+# cache would hand back the clusters of the old setting
+CLUSTER_SETTINGS = {"scaling": "standard, float32", "resize": "pixel budget, area interpolation"}
+
+
+# Returns the settings that identify a clustering of an image, used as part of its cache key (see
+# color_cluster_kit/cache.py). codebook is a loaded Codebook or None. The arguments are the ones of cluster_image(),
+# plus max_pixels, the pixel budget the image was loaded with
+def cluster_settings(k, mode="full", sample_size=20000, random_state=None, quantize=None, max_pixels=None,
+                     codebook=None, warm_start=False, auto_k=None, min_explained=MIN_EXPLAINED, backend="sklearn"):
+
+    settings = dict(CLUSTER_SETTINGS, k=k, mode=mode, sample_size=sample_size, random_state=random_state,
+                    quantize=quantize, max_pixels=max_pixels)
+    if codebook is not None:
+        settings.update(codebook=codebook.fingerprint(), warm_start=warm_start)
+    if auto_k:
+        settings.update(auto_k=list(auto_k), min_explained=min_explained)
+
+    # Only added for the other backends, so cache entries from before there was a choice are still reused
+    if backend != "sklearn":
+        settings.update(backend=backend)
+
+    return settings
+
+
+# Receives a loaded BGR image and the number of clusters k and returns the per-cluster stats (the pixel count, sums
+# and average H, S and V values of every cluster, see cluster_stats())
+# It converts the image to HSV and clusters it with cluster_hsv(), which takes the same arguments
+def cluster_image(image, k, mode="full", sample_size=20000, random_state=None, quantize=None, codebook=None,
+                  warm_start=False, auto_k=None, min_explained=MIN_EXPLAINED, backend="sklearn"):
+
+    image_hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    lap("bgr_to_hsv")
+
+    return cluster_hsv(image_hsv, k, mode, sample_size, random_state, quantize, codebook, warm_start, auto_k,
+                       min_explained, backend)
+
+
+# Receives an image already converted to HSV (e.g. read from an image store, see color_cluster_kit/store.py) and the
+# number of clusters k and returns the per-cluster stats. image_hsv is only read, never changed
+# mode, sample_size and random_state pick how K-Means is fit (see fit_clusters()), and quantize clusters the
+# image's distinct colors instead of every pixel (see cluster_color_histogram())
+# codebook is optional and is a loaded Codebook (see color_cluster_kit/codebook.py). Without warm_start, every pixel
+# simply goes to the cluster of its nearest codebook center. With warm_start, K-Means is still fit as usual but
+# starts from the codebook centers
+# auto_k is optional and is a list of candidate values of k. The smallest one whose clusters explain at least
+# min_explained of the image's color variance is used instead of k (see choose_k())
+# backend picks the K-Means implementation ("sklearn", "minibatch" or "opencv", see color_cluster_kit/backends.py)
+def cluster_hsv(image_hsv, k, mode="full", sample_size=20000, random_state=None, quantize=None, codebook=None,
+                warm_start=False, auto_k=None, min_explained=MIN_EXPLAINED, backend="sklearn"):
+
+    # The image was already shrunk to the pixel budget when it was loaded (see load_image())
+    # With telemetry turned on, lap() records how long each step took since the previous one, and note() records
+    # extra details. Without it, they do nothing
+    note(clustered_height=image_hsv.shape[0], clustered_width=image_hsv.shape[1])
+
+    # One row per pixel (H, S, V). reshape() doesn't copy anything, it's just another way of looking at the image
+    pixels = image_hsv.reshape(-1, 3)
+
+    # With a codebook (and no warm start) there is no K-Means fit at all, just a nearest center lookup per color
+    if codebook is not None and not warm_start:
+        stats = codebook.cluster(pixels)
+        lap("assign")
+        return stats
+
+    # The centers K-Means starts from (in HSV), if any. None lets K-Means pick its own starting centers
+    start = None if codebook is None else codebook.centers
+
+    # With auto_k, k is picked for this image on a small sample of its pixels. The centers found on the way are a
+    # good start for the fit on every pixel. A codebook fixes k, so auto_k is ignored with one
+    if auto_k and codebook is None:
+        k, start, explained = choose_k(pixels, auto_k, min_explained=min_explained, random_state=random_state)
+        note(k=k, k_explained=explained)
+        lap("choose_k")
+
+    # With quantize, K-Means is run on the image's distinct colors, each weighted by how often it appears
+    if quantize:
+        stats = cluster_color_histogram(pixels, k, quantize=quantize, random_state=random_state, init=start,
+                                        backend=backend)
+        lap("kmeans")
+        return stats
+
+    # H values vary from 0-179 and S and V from 0-255, so every channel is put on the same scale first (in
+    # float32, on a single copy of the pixels)
+    features, mean, scale = scale_features(pixels)
+    lap("scaling")
+
+    # Whatever the mode, every pixel ends up with a cluster label, so the pixel counts stay exact
+    init = None if start is None else (start - mean) / scale
+    labels, _ = fit_clusters(features, k, mode=mode, sample_size=sample_size, random_state=random_state, init=init,
+                             backend=backend)
+    lap("kmeans")
+
+    # The averages are taken over the real H, S and V values, in the same order as the labels
+    stats = cluster_stats(labels, pixels, k)
+    lap("stats")
+
+    return stats
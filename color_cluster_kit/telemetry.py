@@ -0,0 +1,234 @@
+# Per-image telemetry and a live progress line
+# A long run of the Data Collectors used to say nothing until 'Done!', and every failure became the same
+# "An error occured". With telemetry turned on, every image gets a record of how long each stage took, how much
+# memory it needed at its peak, how big it was, how many K-Means iterations it ran and, if it failed, the type of
+# the error and its message. The records are saved one per line as JSON (a "JSON lines" file) next to the results,
+# so the slow images and the common failures of a 100k image run can be found with read_telemetry()
+#
+# Recording works like a stopwatch with laps: start_record() starts it, lap("kmeans") stores the time since the
+# previous lap under "kmeans", and finish_record() returns the record. When no record was started, lap() and note()
+# do nothing, so the same code runs with or without telemetry
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+# The record of the image being processed right now (each worker process handles one image at a time)
+_record = None
+_last_lap = None
+
+
+# Returns the most physical memory (the peak resident set size) this process has used, in MB, or None if it can't
+# be found out. Reading it costs next to nothing, unlike following every allocation with tracemalloc
+# On Linux the peak can be reset (see _reset_peak_memory()), so it's the peak of the current image. Elsewhere it's
+# the peak of the whole worker process so far, i.e. of the largest image it has handled
+def _peak_memory_mb():
+
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+    # macOS (and other Unix systems). ru_maxrss is in bytes on macOS and in KB everywhere else
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+
+    # Windows, with the psutil package (pip install psutil)
+    try:
+        import psutil
+        return psutil.Process(os.getpid()).memory_info().peak_wset / 1024 ** 2
+    except (ImportError, AttributeError):
+        return None
+
+
+# Sets the peak memory of this process back to what it uses right now. Only Linux allows that
+def _reset_peak_memory():
+
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+# Starts a new record. Any keyword arguments are stored in it as they are
+# The peak memory is the process's peak physical memory (see _peak_memory_mb()). With trace_memory, the peak of
+# the memory python and numpy allocated for this image is also measured with tracemalloc ("traced_peak_mb").
+# That follows every single allocation and makes an image several times slower to process, so the stage times of
+# such a record are mostly tracemalloc's own
+def start_record(trace_memory=False, **fields):
+
+    global _record, _last_lap
+
+    _reset_peak_memory()
+    if trace_memory:
+        tracemalloc.start()
+
+    _record = dict(fields, stages={})
+    _record["_start"] = _last_lap = time.perf_counter()
+
+
+# Stores the time since the previous lap (or since the start) as the time of the stage name
+def lap(name):
+
+    global _last_lap
+
+    if _record is None:
+        return
+
+    now = time.perf_counter()
+    _record["stages"][name] = _record["stages"].get(name, 0.0) + now - _last_lap
+    _last_lap = now
+
+
+# Stores extra values in the record, e.g. note(height=1200, width=1600)
+def note(**fields):
+
+    if _record is not None:
+        _record.update(fields)
+
+
+# Removes a value from the record and returns it (None if there's no record or no such value), e.g. to store it
+# again under a name of its own before the next note() of the same name overwrites it
+def pop_note(name):
+
+    if _record is None:
+        return None
+
+    return _record.pop(name, None)
+
+
+# Stores the type and message of an error in the record
+def note_error(error):
+
+    note(error_type=type(error).__name__, error=str(error))
+
+
+# Stops recording and returns the finished record. Returns None when no record was started
+def finish_record():
+
+    global _record
+
+    if _record is None:
+        return None
+
+    record = _record
+    _record = None
+
+    record["seconds"] = time.perf_counter() - record.pop("_start")
+    record["peak_memory_mb"] = _peak_memory_mb()
+
+    # Stop tracing, so whatever the process does next runs at full speed again
+    if tracemalloc.is_tracing():
+        record["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    return record
+
+
+# Splits what a summary function returned with telemetry turned on into (result, record)
+# A worker that crashed only gives back an error value, not a record, so one is made up for it
+def split_result(value):
+
+    if isinstance(value, tuple) and len(value) == 2 and (value[1] is None or isinstance(value[1], dict)):
+        return value[0], value[1] or {}
+
+    return value, {"error_type": "WorkerFailed", "error": str(value)}
+
+
+# Appends records to a JSON lines file, one record per line
+# Each line is flushed right away, so the file is useful even while the run is still going (or after it crashed)
+class TelemetryLog:
+
+    def __init__(self, path):
+
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def write(self, record):
+
+        self.file.write(json.dumps(record, default=str) + "\n")
+        self.file.flush()
+
+    def close(self):
+
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Reads a telemetry file into a dataframe with one row per image. The stage times become columns named
+# "stage_" plus the stage, e.g. df.sort_values("seconds").tail(20) lists the 20 slowest images and
+# df["error_type"].value_counts() counts the failures of each kind
+def read_telemetry(path):
+
+    # imported here so the worker processes, which only record, don't have to load pandas
+    import pandas as pd
+
+    df = pd.read_json(path, lines=True)
+
+    if "stages" in df.columns:
+        stages = pd.json_normalize(df["stages"].tolist()).add_prefix("stage_")
+        stages.index = df.index
+        df = df.drop(columns="stages").join(stages)
+
+    return df
+
+
+# Prints a progress line that keeps overwriting itself, e.g.
+# 1200/50000 (3 failed, 14.2 images/s, ETA 0:57:18)
+# skipped is how many of the total were already done before this run (e.g. by an interrupted run). They count
+# towards the total, but the rate and time left only use the images done since the Progress was made, so a
+# resumed run still gets an honest estimate. The line is printed at most every interval seconds
+class Progress:
+
+    def __init__(self, total, skipped=0, interval=0.5, stream=None):
+
+        self.total = total
+        self.skipped = skipped
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.start = time.perf_counter()
+        self.printed = 0.0
+        self.done = skipped
+        self.failed = 0
+
+    def update(self, done=1, failed=0):
+
+        self.done += done
+        self.failed += failed
+
+        now = time.perf_counter()
+        if now - self.printed >= self.interval or self.done >= self.total:
+            self.printed = now
+            self.stream.write("\r" + self.line(now))
+            self.stream.flush()
+
+    def line(self, now=None):
+
+        elapsed = max((now or time.perf_counter()) - self.start, 1e-9)
+        rate = (self.done - self.skipped) / elapsed
+        text = f"{self.done}/{self.total} ({self.failed} failed, {rate:.1f} images/s"
+
+        if rate > 0 and self.done < self.total:
+            left = round((self.total - self.done) / rate)
+            text += f", ETA {left // 3600}:{left // 60 % 60:02d}:{left % 60:02d}"
+
+        return text + ")"
+
+    def close(self):
+
+        self.stream.write("\n")
+        self.stream.flush()
@@ -0,0 +1,5 @@
+# Lets the tests import color_cluster_kit from the folder above, the same way the scripts do
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
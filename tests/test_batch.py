@@ -0,0 +1,33 @@
+# Checks that an input that crashes its worker process only costs its own result
+import os
+
+from color_cluster_kit import batch
+from color_cluster_kit.batch import ERROR_VALUE, run_batch
+
+
+# Squares x, but takes the whole worker process down for the inputs in crash
+def square_or_crash(x, crash=(13, 40)):
+
+    if x in crash:
+        os._exit(1)
+    return x * x
+
+
+def test_crashing_inputs_only_lose_their_own_result(monkeypatch):
+
+    pools = []
+    run_pool = batch._run_pool
+
+    def counting_run_pool(*args):
+        pools.append(args[2])
+        return run_pool(*args)
+
+    monkeypatch.setattr(batch, "_run_pool", counting_run_pool)
+
+    results = run_batch(square_or_crash, range(64), processes=8)
+
+    assert results == [ERROR_VALUE if x in (13, 40) else x * x for x in range(64)]
+
+    # The bad inputs are found by halving the suspects, not by running every suspect alone in a pool of one
+    # process. Only the two bad inputs themselves should end up alone
+    assert pools.count(1) <= 4
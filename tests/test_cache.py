@@ -0,0 +1,39 @@
+# Checks that the cache only hands back clusters made with the same settings, and that a hit gives exactly what a
+# fresh run with those settings gives
+import cv2
+import numpy as np
+
+from color_cluster_kit import ClusterCache, cluster_hsv, cluster_settings
+from color_cluster_kit.benchmark import synthetic_flower
+
+K = 5
+
+
+def test_changing_a_fit_setting_misses_the_cache(tmp_path):
+
+    path = str(tmp_path / "flower.jpg")
+    cv2.imwrite(path, synthetic_flower(240, 320, seed=0))
+    image_hsv = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2HSV)
+    cache = ClusterCache(str(tmp_path / "clusters.db"))
+
+    sample = {"mode": "sample", "sample_size": 2000, "random_state": 0}
+    stats = cluster_hsv(image_hsv, K, **sample)
+    cache.put(cache.key(path, cluster_settings(K, **sample)), stats)
+
+    # The same settings find the stats, which are the averages of the pixels in each cluster, as a fresh run has them
+    hit = cache.get(cache.key(path, cluster_settings(K, **sample)))
+    fresh = cluster_hsv(image_hsv, K, **sample)
+    assert np.array_equal(hit["counts"], fresh["counts"])
+    assert np.allclose(hit["means"], fresh["means"])
+
+    # Only the mode changes, and the clusters aren't the same, so it has to be a miss
+    full = dict(sample, mode="full")
+    assert cache.get(cache.key(path, cluster_settings(K, **full))) is None
+    assert not np.array_equal(cluster_hsv(image_hsv, K, **full)["counts"], stats["counts"])
+
+    for changed in ({"mode": "stratified"}, {"mode": "minibatch"}, {"sample_size": 3000}, {"quantize": 4},
+                    {"backend": "minibatch"}, {"random_state": 1}):
+        assert cache.get(cache.key(path, cluster_settings(K, **dict(sample, **changed)))) is None
+
+    assert cache.counters()["hits"] == 1
+    cache.close()
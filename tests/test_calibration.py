@@ -0,0 +1,89 @@
+# Checks the thresholds the Calibrator works out from a results file, and the error bound of the quantile sketch
+import numpy as np
+import pandas as pd
+import pytest
+
+from color_cluster_kit import QuantileSketch, calibrate, load_thresholds, save_thresholds, write_results
+
+
+# A results file with the saturations 1, 2, ..., 300, in shuffled order, and some rows without values that must be
+# left out
+@pytest.fixture
+def results_file(tmp_path):
+
+    rng = np.random.default_rng(0)
+    s_mean = rng.permutation(np.arange(1, 301)).astype(float)
+    df = pd.DataFrame({"id": np.arange(300), "h_mean": 120.0, "s_mean": s_mean, "v_mean": 0.5, "status": "ok"})
+    df.loc[::50, ["h_mean", "s_mean", "v_mean"]] = np.nan
+    df.loc[::50, "status"] = "no flowers"
+
+    path = str(tmp_path / "results.csv")
+    write_results(df, path)
+    return path, df
+
+
+def test_terciles_of_a_known_file(results_file):
+
+    path, df = results_file
+    calibration = calibrate(path, "s_mean", [1 / 3, 2 / 3], chunk_size=40)
+    s_mean = df.loc[df["status"] == "ok", "s_mean"]
+
+    # With every value kept, the thresholds are the exact terciles of the 294 saturations that are ok
+    assert calibration["rows"] == 294
+    assert calibration["thresholds"] == [np.sort(s_mean)[97], np.sort(s_mean)[195]]
+    assert calibration["rank_error"] == 1 / 294
+
+
+def test_the_chunk_size_doesnt_change_the_thresholds(results_file):
+
+    path, _ = results_file
+    thresholds = [calibrate(path, "s_mean", [0.1, 0.5, 0.9], chunk_size=size)["thresholds"] for size in (7, 300)]
+
+    assert thresholds[0] == thresholds[1]
+
+
+def test_a_file_without_ok_rows_or_the_column_is_an_error(results_file, tmp_path):
+
+    path, df = results_file
+    with pytest.raises(ValueError, match="no 'saturation' column"):
+        calibrate(path, "saturation", [0.5])
+
+    empty = str(tmp_path / "empty.csv")
+    write_results(df[df["status"] != "ok"], empty)
+    with pytest.raises(ValueError, match="no rows with a status of 'ok'"):
+        calibrate(empty, "s_mean", [0.5])
+
+
+def test_the_sketch_stays_within_its_rank_error():
+
+    values = np.random.default_rng(1).lognormal(size=100000)
+    sketch = QuantileSketch(capacity=256)
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+
+    quantiles = np.linspace(0.01, 0.99, 25)
+    ranks = np.searchsorted(np.sort(values), sketch.quantiles(quantiles), side="right") / len(values)
+
+    assert sketch.count == len(values)
+    assert 0 < sketch.rank_error() < 0.05
+    assert np.abs(ranks - quantiles).max() <= sketch.rank_error()
+
+    with pytest.raises(ValueError, match="empty"):
+        QuantileSketch().quantiles([0.5])
+
+
+def test_thresholds_are_saved_and_loaded_by_name(results_file, tmp_path):
+
+    path, _ = results_file
+    thresholds = str(tmp_path / "thresholds.json")
+
+    assert load_thresholds(thresholds, "Geranium", default=[70.5, 92.7]) == [70.5, 92.7]
+    with pytest.raises(ValueError, match="Calibrator"):
+        load_thresholds(thresholds, "Geranium")
+
+    calibration = calibrate(path, "s_mean", [1 / 3, 2 / 3])
+    save_thresholds(thresholds, "Geranium", calibration)
+    save_thresholds(thresholds, "Sandblossom", {"thresholds": [3000]})
+
+    assert load_thresholds(thresholds, "Geranium", default=[70.5, 92.7]) == calibration["thresholds"]
+    assert load_thresholds(thresholds, "Sandblossom") == [3000]
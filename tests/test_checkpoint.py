@@ -0,0 +1,39 @@
+# Checks that resuming a run retries the observations that failed, and that a run with other settings starts a
+# checkpoint of its own instead of stopping on the old one
+import os
+from functools import partial
+
+import pandas as pd
+
+from color_cluster_kit import checkpoint_path, run_checkpointed
+from color_cluster_kit.checkpoint import run_settings
+
+
+# A stand-in for a collector's image_summary that fails on the observations in broken while the file flag exists
+def flaky_summary(x, bound, flag, broken=(3,)):
+
+    if x in broken and os.path.exists(flag):
+        return "An error occured"
+    return [float(x), float(bound), 1.0]
+
+
+def test_resume_retries_failures_and_new_settings_start_over(tmp_path):
+
+    df = pd.DataFrame({"id": range(6), "path": range(6)})
+    output = str(tmp_path / "out.csv")
+    flag = str(tmp_path / "broken")
+    summary = partial(flaky_summary, bound=1, flag=flag)
+
+    open(flag, "w").close()
+    first = run_checkpointed(summary, df.copy(), output, measure="v_mean", processes=1, progress=False)
+    assert first["status"].tolist().count("error") == 1
+
+    os.remove(flag)
+    resumed = run_checkpointed(summary, df.copy(), output, measure="v_mean", processes=1, progress=False)
+    assert resumed["status"].tolist() == ["ok"] * 6
+
+    other = partial(flaky_summary, bound=2, flag=flag)
+    changed = run_checkpointed(other, df.copy(), output, measure="v_mean", processes=1, progress=False)
+    assert changed["s_mean"].tolist() == [2.0] * 6
+    assert os.path.exists(checkpoint_path(output, run_settings(summary)))
+    assert os.path.exists(checkpoint_path(output, run_settings(other)))
@@ -0,0 +1,106 @@
+# Checks the clustering modes, choose_k(), and how far clustering the color histogram (quantize) moves the clusters
+# away from clustering every pixel
+import cv2
+import numpy as np
+import pytest
+
+from color_cluster_kit import cluster_color_histogram, cluster_stats, scale_features
+from color_cluster_kit.benchmark import count_shift, synthetic_flower
+from color_cluster_kit.clustering import MODES, centroid_drift, check_mode, choose_k, fit_clusters
+
+K = 5
+
+
+# Fits K-Means on every pixel like the collectors do and returns the cluster stats. init is in HSV
+def per_pixel_stats(pixels, random_state=0, init=None):
+
+    features, mean, scale = scale_features(pixels)
+    start = None if init is None else (init - mean) / scale
+    labels, _ = fit_clusters(features, K, random_state=random_state, init=start)
+    return cluster_stats(labels, pixels, K)
+
+
+# Five flat colors of different sizes with a little noise, far enough apart that K-Means always finds the same
+# clusters, whatever it starts from
+def patch_pixels(noise=12, seed=0):
+
+    rng = np.random.default_rng(seed)
+    colors = np.array([[20, 80, 60], [45, 200, 120], [60, 120, 200], [140, 180, 230], [150, 60, 160]])
+    sizes = np.array([30000, 20000, 12000, 6000, 2000])
+    pixels = np.repeat(colors, sizes, axis=0) + rng.integers(-noise, noise + 1, size=(sizes.sum(), 3))
+    return np.clip(pixels, 0, [179, 255, 255]).astype(np.uint8)
+
+
+def flower_pixels(seed):
+
+    return cv2.cvtColor(synthetic_flower(240, 320, seed=seed), cv2.COLOR_BGR2HSV).reshape(-1, 3)
+
+
+def test_quantize_1_reproduces_the_per_pixel_fit():
+
+    pixels = patch_pixels()
+    full = per_pixel_stats(pixels)
+    histogram = cluster_color_histogram(pixels, K, quantize=1, random_state=0)
+
+    assert sorted(histogram["counts"]) == sorted(full["counts"])
+    assert count_shift(full, histogram) == 0
+    assert centroid_drift(full, histogram).max() < 1e-6
+
+
+# The largest drift (in units of H, S or V) and count shift (share of the pixels) measured on synthetic_flower()
+# images with seeds 0 to 5, with both fits started from the same centers, rounded up
+@pytest.mark.parametrize("quantize, max_drift, max_shift", [(1, 0.1, 0.001), (2, 0.1, 0.001), (4, 0.5, 0.005),
+                                                           (8, 1.0, 0.015)])
+def test_quantize_stays_within_the_measured_bound(quantize, max_drift, max_shift):
+
+    for seed in range(3):
+        pixels = flower_pixels(seed)
+        init = per_pixel_stats(pixels)["means"]
+        full = per_pixel_stats(pixels, init=init)
+        histogram = cluster_color_histogram(pixels, K, quantize=quantize, random_state=0, init=init)
+
+        assert centroid_drift(full, histogram).max() <= max_drift
+        assert count_shift(full, histogram) <= max_shift
+
+
+@pytest.mark.parametrize("mode", MODES)
+def test_every_mode_labels_every_pixel_with_k_clusters(mode):
+
+    pixels = flower_pixels(0)
+    features, _, _ = scale_features(pixels)
+    labels, centers = fit_clusters(features, K, mode=mode, sample_size=2000, random_state=0)
+    stats = cluster_stats(labels, pixels, K)
+
+    assert centers.shape == (K, 3)
+    assert len(labels) == len(pixels)
+    assert stats["counts"].sum() == len(pixels)
+    assert np.count_nonzero(stats["counts"]) == K
+
+
+@pytest.mark.parametrize("mode", ["sample", "stratified"])
+def test_a_sample_smaller_than_k_is_a_clear_error(mode):
+
+    features, _, _ = scale_features(flower_pixels(0))
+
+    with pytest.raises(ValueError, match="sample_size"):
+        fit_clusters(features, K, mode=mode, sample_size=K - 1, random_state=0)
+    with pytest.raises(ValueError, match="sample_size"):
+        check_mode(K, mode, K - 1)
+
+    check_mode(K, "full", K - 1)
+    with pytest.raises(ValueError, match="mode"):
+        check_mode(K, "fast")
+
+
+def test_choose_k_picks_a_candidate():
+
+    pixels = patch_pixels()
+    k, centers, explained = choose_k(pixels, [2, 3, 5, 8], random_state=0)
+
+    assert k in (2, 3, 5, 8)
+    assert centers.shape == (k, 3)
+    assert explained[k] >= 0.9 or k == 8
+    assert all(share < 0.9 for candidate, share in explained.items() if candidate < k)
+
+    with pytest.raises(ValueError, match="sample_size"):
+        choose_k(pixels, [2, 3, 5, 8], sample_size=4)
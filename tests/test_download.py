@@ -0,0 +1,111 @@
+# Checks the downloader against a small local web server: a "try again later" status that's retried, a missing
+# image, a redirect and a malformed url, and that the proxy settings are honored
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from color_cluster_kit import DownloadError, download_images, fetch
+
+IMAGE = b"not really a jpeg"
+
+
+# Answers /busy with 503 the first time and the image after that, /moved with a redirect to /image, and anything
+# else that isn't /image with 404
+# It also acts as a proxy for http://images.example, whose requests come with the full URL, and remembers the
+# Proxy-Authorization header of the last one
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    busy = set()
+    proxied = []
+
+    def do_GET(self):
+
+        if self.path.startswith("http://images.example/"):
+            Handler.proxied.append(self.headers.get("Proxy-Authorization"))
+            self.path = self.path[len("http://images.example"):]
+
+        if self.path == "/moved":
+            self.reply(302, b"", {"Location": "/image"})
+        elif self.path.startswith("/busy") and self.path not in Handler.busy:
+            Handler.busy.add(self.path)
+            self.reply(503, b"busy")
+        elif self.path == "/image" or self.path.startswith("/busy"):
+            self.reply(200, IMAGE)
+        else:
+            self.reply(404, b"missing")
+
+    def reply(self, status, body, headers={}):
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:" + str(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_retries_follows_redirects_and_fails_on_404(server):
+
+    assert fetch(server + "/busy/1", backoff=0) == IMAGE
+    assert fetch(server + "/moved", backoff=0) == IMAGE
+
+    with pytest.raises(DownloadError, match="HTTP 404"):
+        fetch(server + "/missing", backoff=0)
+
+    with pytest.raises(DownloadError, match="HTTP 503"):
+        fetch(server + "/busy/2", retries=0, backoff=0)
+
+
+def test_download_images_records_every_failure(server, tmp_path):
+
+    ids = [1, 2, 3, 4]
+    urls = [server + "/busy/3", server + "/moved", server + "/missing", "http://[not a url"]
+    manifest = str(tmp_path / "failed.csv")
+
+    failures = download_images(ids, urls, str(tmp_path / "images"), workers=4, backoff=0, manifest=manifest,
+                               progress=False)
+
+    assert [(i, reason.split(":")[0]) for i, _, reason in sorted(failures)] == [(3, "HTTP 404"), (4, "ValueError")]
+    for i in (1, 2):
+        with open(os.path.join(tmp_path, "images", str(i) + ".jpg"), "rb") as file:
+            assert file.read() == IMAGE
+    assert os.path.exists(manifest)
+
+
+@pytest.fixture
+def no_proxies(monkeypatch):
+
+    for name in ("http_proxy", "https_proxy", "no_proxy", "all_proxy"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.upper(), raising=False)
+    return monkeypatch
+
+
+def test_fetch_goes_through_the_proxy_unless_no_proxy_says_otherwise(server, no_proxies):
+
+    no_proxies.setenv("http_proxy", server.replace("http://", "http://user:secret@"))
+
+    assert fetch("http://images.example/moved", backoff=0) == IMAGE
+    assert Handler.proxied[-1] == "Basic dXNlcjpzZWNyZXQ="
+
+    # Nothing listens on port 1, so this only works because 127.0.0.1 skips the proxy
+    no_proxies.setenv("http_proxy", "http://127.0.0.1:1")
+    no_proxies.setenv("no_proxy", "127.0.0.1")
+    assert fetch(server + "/image", backoff=0) == IMAGE
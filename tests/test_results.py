@@ -0,0 +1,127 @@
+# Checks how results are split into typed columns and read back, whole or a chunk at a time, and that the
+# Classifiers give the same output either way
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from color_cluster_kit import expand_results, iter_results, output_columns, output_row, read_results, write_results
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# A results file the way a Data Collector writes it, with rows of every status. Rows without flowers have no pixel
+# count, so num_points is a whole number column with missing values
+def results_frame(rows=50):
+
+    rng = np.random.default_rng(0)
+    status = rng.choice(["ok", "ok", "ok", "no flowers", "error"], size=rows)
+    ok = status == "ok"
+    return pd.DataFrame({
+        "id": np.arange(rows),
+        "path": ["image" + str(i) + ".jpg" for i in range(rows)],
+        "h_mean": np.where(ok, rng.uniform(0, 179, rows).round(2), np.nan),
+        "s_mean": np.where(ok, rng.uniform(40, 120, rows).round(2), np.nan),
+        "num_points": pd.Series(rng.integers(0, 6000, rows), dtype="Int64").where(ok, pd.NA),
+        "status": status,
+    })
+
+
+def test_with_k_adds_a_whole_number_k_column():
+
+    results = [[130.2, 45.1, 5120, 7], "no flowers", "[20.5, 80.0, 300, 4]", "An error occured"]
+    values = expand_results(results, "num_points", with_k=True)
+
+    assert list(values.columns) == ["h_mean", "s_mean", "num_points", "k", "status"]
+    assert values["k"].dtype == "Int64"
+    assert values["k"].tolist() == [7, pd.NA, 4, pd.NA]
+    assert values["status"].tolist() == ["ok", "no flowers", "ok", "error"]
+
+
+def test_results_without_k_leave_the_k_column_empty():
+
+    values = expand_results(["[130.2, 45.1, 0.5]", "[20.5, 80.0, 0.25, 3]"], "v_mean", with_k=True)
+
+    assert values["v_mean"].tolist() == [0.5, 0.25]
+    assert values["k"].tolist() == [pd.NA, 3]
+
+
+def test_output_row_matches_output_columns_with_k():
+
+    measure = {"Geranium": "v_mean", "Sandblossom": "num_points"}
+    result = {"Geranium": [130.2, 45.1, 0.5, 6], "Sandblossom": "no flowers"}
+    columns = output_columns(measure, with_k=True)
+    row = output_row(result, measure, with_k=True)
+
+    assert len(row) == len(columns)
+    assert dict(zip(columns, row))["Geranium_k"] == 6
+    assert dict(zip(columns, row))["Sandblossom_k"] is None
+    assert output_row("An error occured", measure, with_k=True)[-1] == "error"
+
+
+def test_legacy_kmeans_data_is_split_into_columns(tmp_path):
+
+    path = str(tmp_path / "old.csv")
+    pd.DataFrame({"id": [1, 2, 3, 4], "KMeansData": ["[130.2, 45.1, 5120]", "no flowers", "An error occured",
+                                                     "[20.5, 80.0, 300]"]}).to_csv(path)
+
+    df = read_results(path, measure="num_points")
+
+    assert "KMeansData" not in df.columns
+    assert df["h_mean"].tolist()[::3] == [130.2, 20.5]
+    assert df["num_points"].dtype == "Int64"
+    assert df["num_points"].tolist() == [5120, pd.NA, pd.NA, 300]
+    assert df["status"].tolist() == ["ok", "no flowers", "error", "ok"]
+
+    # The old file read a row at a time gives the same columns, even for chunks that only hold missing values
+    chunks = pd.concat(iter_results(path, measure="num_points", chunk_size=1))
+    pd.testing.assert_frame_equal(chunks, df)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet", ".feather"])
+def test_a_results_file_reads_back_the_same_whole_or_in_chunks(tmp_path, suffix):
+
+    if suffix != ".csv":
+        pytest.importorskip("pyarrow")
+
+    path = str(tmp_path / ("results" + suffix))
+    expected = results_frame()
+    write_results(expected, path)
+
+    df = read_results(path, measure="num_points")
+    chunks = list(iter_results(path, measure="num_points", chunk_size=7))
+
+    assert df["num_points"].dtype == "Int64"
+    pd.testing.assert_frame_equal(df[expected.columns], expected)
+    assert all(chunk["num_points"].dtype == "Int64" for chunk in chunks)
+    pd.testing.assert_frame_equal(pd.concat(chunks), df)
+
+
+# Runs a Classifier script on results, with chunk_size set, and returns its output file's text
+def run_classifier(name, results, chunk_size):
+
+    with open(os.path.join(SCRIPTS, "Classifier (" + name + ").py"), encoding="utf-8") as file:
+        source = file.read()
+
+    source = source.replace(r"C:\Users\Example\FlowerClassification\YourSaveFile.csv", results)
+    source = source.replace("chunk_size = None", "chunk_size = " + repr(chunk_size))
+    exec(compile(source, name, "exec"), {"__name__": "__main__"})
+
+    with open("FlowerClassifications(" + name + ").csv", encoding="utf-8") as file:
+        return file.read()
+
+
+@pytest.mark.parametrize("name", ["Geranium", "Sandblossom"])
+def test_the_classifiers_write_the_same_file_in_chunks(tmp_path, monkeypatch, name):
+
+    monkeypatch.chdir(tmp_path)
+    results = str(tmp_path / "results.csv")
+    df = results_frame()
+    df["v_mean"] = df["num_points"] / 6000
+    write_results(df, results)
+
+    whole = run_classifier(name, results, None)
+    assert len(whole.splitlines()) == len(df) + 1
+    assert run_classifier(name, results, 7) == whole
+    assert run_classifier(name, results, 1) == whole
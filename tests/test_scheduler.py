@@ -0,0 +1,54 @@
+# Checks that a plan never runs more processes x threads than there are cores
+import os
+
+import pytest
+
+from color_cluster_kit import plan_workers, scheduler, usable_cores
+
+CORES = 8
+
+
+@pytest.fixture(autouse=True)
+def eight_cores(monkeypatch):
+
+    monkeypatch.setattr(scheduler, "usable_cores", lambda: CORES)
+    monkeypatch.setattr(scheduler, "available_memory_mb", lambda: None)
+
+
+@pytest.mark.parametrize("processes, threads, expected", [
+    (None, 1, (8, 1)),
+    (None, 2, (4, 2)),
+    (None, 3, (2, 3)),
+    (None, 32, (1, 8)),
+    (4, 4, (2, 4)),
+    (16, 1, (8, 1)),
+    (2, 2, (2, 2)),
+])
+def test_a_fixed_number_of_threads_stays_within_the_cores(processes, threads, expected):
+
+    plan = plan_workers(None, 1000000, processes, threads)
+
+    assert (plan["processes"], plan["threads"]) == expected
+    assert plan["cores"] == CORES
+
+
+@pytest.mark.parametrize("processes, pixels", [(None, 1000000), (None, 9000000), (20, 1000000), (3, 1000000)])
+def test_an_auto_plan_stays_within_the_cores(processes, pixels):
+
+    plan = plan_workers(None, pixels, processes, "auto")
+
+    assert plan["processes"] * plan["threads"] <= CORES
+    assert plan["processes"] == min(processes or CORES, CORES // max(1, pixels // scheduler.PIXELS_PER_THREAD))
+
+
+def test_no_threads_leaves_the_processes_alone():
+
+    plan = plan_workers(None, 1000000, 16, None)
+
+    assert (plan["processes"], plan["threads"]) == (16, None)
+
+
+# usable_cores was imported before the fixture replaced it, so this is the real one
+def test_usable_cores_is_at_most_the_machines_cores():
+
+    assert 1 <= usable_cores() <= (os.cpu_count() or 1)
@@ -0,0 +1,68 @@
+# Checks that a run split into shards and merged again writes exactly the file a run on one machine writes, also
+# with duplicate images whose copies would land in other shards by their own id
+import filecmp
+
+import cv2
+import pandas as pd
+
+from color_cluster_kit import (duplicate_ids, load_hsv, merge_shards, run_checkpointed, select_shard, shard_of,
+                               shard_output)
+from color_cluster_kit.benchmark import synthetic_flower
+
+SHARDS = 3
+
+
+# A stand-in for a collector's image_summary: the average H, S and V of the image, which is quick and always the
+# same for the same image
+def mean_summary(source):
+
+    image_hsv = load_hsv(source)
+    if image_hsv is None:
+        return "An error occured"
+
+    return image_hsv.reshape(-1, 3).mean(axis=0).tolist()
+
+
+# Makes 12 images, plus a re-compressed copy of each of the first 4 whose id puts it in another shard than its
+# original
+def make_data(folder):
+
+    rows = []
+    for i in range(12):
+        path = str(folder / (str(i) + ".jpg"))
+        cv2.imwrite(path, synthetic_flower(120 + 8 * i, 160, seed=i))
+        rows.append({"id": i, "path": path})
+
+    copies = 0
+    candidate = 100
+    while copies < 4:
+        original = rows[copies]
+        if shard_of([candidate], SHARDS) != shard_of([original["id"]], SHARDS):
+            path = str(folder / (str(candidate) + ".jpg"))
+            cv2.imwrite(path, cv2.imread(original["path"]), [cv2.IMWRITE_JPEG_QUALITY, 60])
+            rows.append({"id": candidate, "path": path})
+            copies += 1
+        candidate += 1
+
+    return pd.DataFrame(rows)
+
+
+def test_merged_shards_match_a_single_run(tmp_path):
+
+    df = make_data(tmp_path)
+    single = str(tmp_path / "single.csv")
+    output = str(tmp_path / "merged.csv")
+
+    single_df = run_checkpointed(mean_summary, df.copy(), single, measure="v_mean", processes=2, progress=False,
+                                 duplicate_distance=4)
+    assert single_df["duplicate_of"].notna().sum() == 4
+
+    duplicates = duplicate_ids(df, 4, processes=2)
+    for shard in range(1, SHARDS + 1):
+        run_checkpointed(mean_summary, select_shard(df, shard, SHARDS, groups=duplicates).copy(),
+                         shard_output(output, shard, SHARDS), measure="v_mean", processes=2, progress=False,
+                         duplicates=duplicates)
+
+    merge_shards(df, output, SHARDS)
+
+    assert filecmp.cmp(single, output, shallow=False)
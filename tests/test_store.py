@@ -0,0 +1,50 @@
+# Checks that the image store refuses another pixel budget than the one it was built with, and that the cache keys
+# a stored image by the content id the store recorded, without reading the image file again
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from color_cluster_kit import ClusterCache, build_store, cluster_settings, load_hsv
+from color_cluster_kit.benchmark import synthetic_flower
+
+MAX_PIXELS = 20000
+
+
+@pytest.fixture
+def stored_image(tmp_path):
+
+    path = str(tmp_path / "flower.jpg")
+    cv2.imwrite(path, synthetic_flower(240, 320, seed=0))
+    store = str(tmp_path / "pixels.store")
+    assert build_store(store, [path], MAX_PIXELS, processes=1, progress=False) == 0
+    return path, store
+
+
+def test_the_store_only_serves_its_own_pixel_budget(stored_image):
+
+    path, store = stored_image
+
+    assert np.array_equal(load_hsv(path, MAX_PIXELS, store), load_hsv(path, MAX_PIXELS))
+
+    with pytest.raises(ValueError, match="max_pixels"):
+        load_hsv(path, MAX_PIXELS * 4, store)
+
+
+def test_the_cache_key_of_a_stored_image_comes_from_the_store(stored_image, tmp_path):
+
+    path, store = stored_image
+    cache = ClusterCache(str(tmp_path / "clusters.db"))
+    settings = cluster_settings(5, max_pixels=MAX_PIXELS)
+
+    key = cache.key(path, settings)
+    assert cache.key(path, settings, store) == key
+
+    # With the store, the image file isn't read at all
+    os.remove(path)
+    assert cache.key(path, settings, store) == key
+    with pytest.raises(OSError):
+        cache.key(path, settings)
+
+    cache.close()